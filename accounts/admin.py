@@ -0,0 +1,44 @@
+from django.contrib import admin
+from django.db.models import ExpressionWrapper, F, FloatField
+
+from accounts.models import LockContention
+
+
+@admin.register(LockContention)
+class LockContentionAdmin(admin.ModelAdmin):
+    """Most contended Account locks, see :mod:`accounts.contention`. Rows may only be deleted to reset them."""
+
+    list_display = ('account', 'waits', 'wait_ms', 'average_ms', 'max_ms', 'shard_count', 'updated')
+    list_select_related = ('account',)
+    search_fields = ('account__name',)
+    ordering = ('-wait_time',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            average=ExpressionWrapper(F('wait_time') / F('waits'), output_field=FloatField()),
+        )
+
+    def wait_ms(self, obj):
+        return round(obj.wait_time * 1000, 1)
+    wait_ms.short_description = 'wait, ms'
+    wait_ms.admin_order_field = 'wait_time'
+
+    def average_ms(self, obj):
+        return round(obj.average * 1000, 3)
+    average_ms.short_description = 'average, ms'
+    average_ms.admin_order_field = 'average'
+
+    def max_ms(self, obj):
+        return round(obj.max_wait * 1000, 3)
+    max_ms.short_description = 'max, ms'
+    max_ms.admin_order_field = 'max_wait'
+
+    def shard_count(self, obj):
+        return obj.account.shard_count
+    shard_count.admin_order_field = 'account__shard_count'
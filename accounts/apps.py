@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class AccountsConfig(AppConfig):
     name = 'accounts'
+
+    def ready(self):
+        from accounts.cache import account_deleted, account_saved
+        from accounts.currencies import currencies
+        post_save.connect(account_saved, sender=self.get_model('Account'))
+        post_delete.connect(account_deleted, sender=self.get_model('Account'))
+        post_save.connect(currencies.clear, sender=self.get_model('Currency'))
+        post_delete.connect(currencies.clear, sender=self.get_model('Currency'))
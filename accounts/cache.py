@@ -0,0 +1,165 @@
+"""
+Caches of Accounts: serialized balances for the Accounts list and primary keys by name
+
+Balances are keyed by Account name. Writers invalidate entries of changed Accounts after commit
+by :func:`invalidate_on_commit`, so the cache never shows a balance of an uncommitted transaction.
+A reader racing with a commit may still store the previous balance, which lives until the entry expires,
+see `settings.ACCOUNT_BALANCE_CACHE_TTL`. Entries are filled from the primary database only, so replication
+lag does not widen that race, and clients pinned to the primary database after a write bypass the cache.
+
+Backends, chosen by `settings.ACCOUNT_BALANCE_CACHE`:
+
+ - `lru`: :class:`utils.cache.LRUCache` in each process. Invalidations do not reach other processes,
+   so they see changes after the TTL only.
+ - `django`: the `default` Django cache, shared by processes if the cache backend is, e.g. memcached.
+ - empty: caching is disabled.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from accounts.models import Account
+from utils.cache import LRUCache
+
+# Account primary keys by name, names are unique and are not changed
+account_pks = LRUCache(settings.ACCOUNT_PK_CACHE_SIZE)
+
+
+class LRUBackend:
+    def __init__(self, size: int, ttl: float):
+        self.cache = LRUCache(size, ttl=ttl)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, object]:
+        values = ((key, self.cache.get(key)) for key in keys)
+        return {key: value for key, value in values if value is not None}
+
+    def set_many(self, values: Dict[str, object]):
+        for key, value in values.items():
+            self.cache.set(key, value)
+
+    def delete_many(self, keys: Iterable[str]):
+        for key in keys:
+            self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class DjangoBackend:
+    def __init__(self, size: int, ttl: float):
+        self.cache = caches['default']
+        self.ttl = ttl
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, object]:
+        return self.cache.get_many(list(keys))
+
+    def set_many(self, values: Dict[str, object]):
+        self.cache.set_many(values, timeout=self.ttl)
+
+    def delete_many(self, keys: Iterable[str]):
+        self.cache.delete_many(list(keys))
+
+    def clear(self):
+        self.cache.clear()
+
+
+BACKENDS = {
+    'lru': LRUBackend,
+    'django': DjangoBackend,
+}
+
+
+class BalanceCache:
+    """
+    Serialized Accounts by name and Accounts list pages
+
+    A page stores Account names only, so a payment invalidates two Account entries rather than every page
+    with them. Pages are invalidated all at once when an Account is created or deleted.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def account_key(name: str) -> str:
+        return 'accounts:account:{}'.format(name)
+
+    def pages_version(self) -> int:
+        return self.backend.get_many(['accounts:pages']).get('accounts:pages', 0)
+
+    def get_page(self, url: str) -> Optional[dict]:
+        key = 'accounts:page:{}:{}'.format(self.pages_version(), url)
+        return self.backend.get_many([key]).get(key)
+
+    def set_page(self, url: str, page: dict):
+        self.backend.set_many({'accounts:page:{}:{}'.format(self.pages_version(), url): page})
+
+    def invalidate_pages(self):
+        self.backend.set_many({'accounts:pages': self.pages_version() + 1})
+
+    def get_accounts(self, names: Iterable[str]) -> Dict[str, dict]:
+        names = list(names)
+        values = self.backend.get_many(self.account_key(name) for name in names)
+        return {name: values[self.account_key(name)] for name in names if self.account_key(name) in values}
+
+    def set_accounts(self, accounts: List[dict]):
+        self.backend.set_many({self.account_key(account['id']): account for account in accounts})
+
+    def invalidate_accounts(self, names: Iterable[str]):
+        self.backend.delete_many(self.account_key(name) for name in names)
+
+    def clear(self):
+        self.backend.clear()
+
+
+_caches = {}
+
+
+def balance_cache() -> Optional[BalanceCache]:
+    """Return the cache configured by settings, `None` if caching is disabled."""
+    if not settings.ACCOUNT_BALANCE_CACHE:
+        return None
+    key = (settings.ACCOUNT_BALANCE_CACHE, settings.ACCOUNT_BALANCE_CACHE_SIZE, settings.ACCOUNT_BALANCE_CACHE_TTL)
+    if key not in _caches:
+        _caches[key] = BalanceCache(BACKENDS[key[0]](*key[1:]))
+    return _caches[key]
+
+
+def resolve_account_pks(names: Iterable[str]) -> Dict[str, int]:
+    """Return primary keys of existing Accounts by name, names missing in :data:`account_pks` are read at once."""
+    pks = {name: account_pks.get(name) for name in names}
+    missing = [name for name, pk in pks.items() if pk is None]
+    if missing:
+        for name, pk in Account.objects.filter(name__in=missing).values_list('name', 'pk'):
+            account_pks.set(name, pk)
+            pks[name] = pk
+    return {name: pk for name, pk in pks.items() if pk is not None}
+
+
+def invalidate_on_commit(names: Iterable[str]):
+    """Invalidate cached Accounts with `names` when the current transaction is committed."""
+    cache = balance_cache()
+    if cache is not None:
+        names = list(names)
+        transaction.on_commit(lambda: cache.invalidate_accounts(names))
+
+
+def account_saved(sender, instance, created, **kwargs):
+    """Invalidate a saved Account, and the list pages if it is created."""
+    cache = balance_cache()
+    if cache is not None:
+        transaction.on_commit(lambda: cache.invalidate_accounts([instance.name]))
+        if created:
+            transaction.on_commit(cache.invalidate_pages)
+
+
+def account_deleted(sender, instance, **kwargs):
+    """Invalidate a deleted Account and the list pages."""
+    account_pks.delete(instance.name)
+    cache = balance_cache()
+    if cache is not None:
+        transaction.on_commit(lambda: cache.invalidate_accounts([instance.name]))
+        transaction.on_commit(cache.invalidate_pages)
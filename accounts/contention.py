@@ -0,0 +1,135 @@
+"""
+Profiler of Account row lock waits
+
+With `settings.ACCOUNT_LOCK_PROFILER` enabled, `PaymentManager.create_payment` times acquiring of each Account
+lock and passes it to :meth:`LockProfiler.record`. Wait times are summed by a count-min sketch, and the Accounts
+with the largest sums are kept as top-K heavy hitters, so memory does not depend on the number of Accounts.
+The sketch estimate only ranks Accounts: waits, wait time and the longest wait of a heavy hitter are counted
+exactly since it entered the top, so averages are not inflated by waits before that or by sketch collisions.
+
+Each process periodically adds its heavy hitters to :class:`accounts.models.LockContention` rows after commit
+and starts a new window, so the most contended Accounts of all processes are shown by `lock_contention`
+management command and the admin site.
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from accounts.models import LockContention
+
+
+class CountMinSketch:
+    """
+    Approximate sums of values by key in `depth` rows of `width` counters
+
+    An estimate is never less than the real sum, and exceeds it by at most `e / width` of the total
+    with probability `1 - exp(-depth)`.
+    """
+
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0.0] * width for _ in range(depth)]
+
+    def add(self, key: int, value: float) -> float:
+        """Add `value` to `key`, return the new estimate of `key` sum."""
+        estimate = None
+        for seed, row in enumerate(self.rows):
+            index = hash((seed, key)) % self.width
+            row[index] += value
+            estimate = row[index] if estimate is None else min(estimate, row[index])
+        return estimate
+
+
+class LockProfiler:
+    """
+    Heavy hitters of Account lock wait time in the current window
+
+    Attributes
+
+     - top (dict): Account primary key -> `[estimated wait seconds, waits, wait seconds, max wait seconds]`
+       of up to `size` Accounts with the largest estimated wait. The estimate ranks Accounts, the others are
+       counted since the Account entered the top.
+
+    """
+
+    def __init__(self, size: int, width: int, depth: int, flush_interval: float):
+        self.size = size
+        self.width = width
+        self.depth = depth
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.sketch = CountMinSketch(self.width, self.depth)
+        self.top = {}  # type: Dict[int, List[float]]
+        self.flush_at = time.monotonic() + self.flush_interval
+
+    def record(self, account_pk: int, seconds: float):
+        """Record a lock wait, and flush the window after commit once `flush_interval` passed."""
+        with self._lock:
+            estimate = self.sketch.add(account_pk, seconds)
+            entry = self.top.get(account_pk)
+            if entry is not None:
+                entry[0] = estimate
+                entry[1] += 1
+                entry[2] += seconds
+                entry[3] = max(entry[3], seconds)
+            elif len(self.top) < self.size:
+                self.top[account_pk] = [estimate, 1, seconds, seconds]
+            else:
+                coldest = min(self.top, key=lambda pk: self.top[pk][0])
+                if self.top[coldest][0] < estimate:
+                    del self.top[coldest]
+                    self.top[account_pk] = [estimate, 1, seconds, seconds]
+            # If the transaction is rolled back, the window is flushed by a later one
+            now = time.monotonic()
+            flush = now >= self.flush_at
+            if flush:
+                self.flush_at = now + self.flush_interval
+        if flush:
+            transaction.on_commit(self.flush)
+
+    def take(self) -> List[Tuple[int, float, int, float]]:
+        """Return `(account_pk, wait, waits, max_wait)` of the current window, and start a new one."""
+        with self._lock:
+            top = self.top
+            self._reset()
+        return [(pk, wait, waits, max_wait) for pk, (_, waits, wait, max_wait) in top.items()]
+
+    def flush(self):
+        """Add the current window to :class:`accounts.models.LockContention`."""
+        for account_pk, wait, waits, max_wait in self.take():
+            updates = dict(wait_time=F('wait_time') + wait, waits=F('waits') + waits,
+                           max_wait=Greatest('max_wait', max_wait), updated=timezone.now())
+            if LockContention.objects.filter(account_id=account_pk).update(**updates):
+                continue
+            try:
+                with transaction.atomic():
+                    LockContention.objects.create(account_id=account_pk, wait_time=wait, waits=waits,
+                                                  max_wait=max_wait)
+            except IntegrityError:
+                # Created by another process meanwhile, or the Account is deleted
+                LockContention.objects.filter(account_id=account_pk).update(**updates)
+
+
+_profilers = {}
+
+
+def lock_profiler() -> Optional[LockProfiler]:
+    """Return the profiler configured by settings, `None` if profiling is disabled."""
+    if not settings.ACCOUNT_LOCK_PROFILER:
+        return None
+    key = (settings.ACCOUNT_LOCK_PROFILER_TOP_K, settings.ACCOUNT_LOCK_PROFILER_SKETCH_WIDTH,
+           settings.ACCOUNT_LOCK_PROFILER_SKETCH_DEPTH, settings.ACCOUNT_LOCK_PROFILER_FLUSH_INTERVAL)
+    if key not in _profilers:
+        _profilers[key] = LockProfiler(*key)
+    return _profilers[key]
@@ -0,0 +1,77 @@
+"""
+Process-wide registry of Currency codes
+
+Currencies are tiny and almost static, so all of them are loaded by a single query on first use
+and kept in memory, instead of joining or fetching Currency rows per Account.
+Saving or deleting a Currency clears the registry of the process. Other processes are not notified:
+
+ - Loaded Currencies are kept for `settings.CURRENCY_REGISTRY_TTL` seconds, so a Currency changed
+   or deleted elsewhere may be seen with its previous code until then.
+ - A lookup miss, e.g. a Currency created elsewhere, reloads Currencies at most once per
+   `settings.CURRENCY_REGISTRY_MISS_INTERVAL` seconds, so unknown codes and stale primary keys
+   in requests do not read the Currency table each time. A Currency created elsewhere
+   may be unknown for that long.
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+
+
+class CurrencyRegistry:
+    """Currency codes by primary key and primary keys by code, loaded on first use."""
+
+    def __init__(self):
+        self._codes = None
+        self._pks = None
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, dict]:
+        """Load all Currencies, return the new mappings by attribute name, as they may be cleared meanwhile."""
+        from accounts.models import Currency
+
+        codes = dict(Currency.objects.values_list('pk', 'code'))
+        mappings = dict(_codes=codes, _pks={code: pk for pk, code in codes.items()})
+        with self._lock:
+            self._codes = mappings['_codes']
+            self._pks = mappings['_pks']
+            self._loaded = time.monotonic()
+        return mappings
+
+    def _mapping(self, attr: str) -> dict:
+        """Return the mapping `attr`, loaded again if it is missing or expired."""
+        with self._lock:
+            mapping, age = getattr(self, attr), time.monotonic() - self._loaded
+        if mapping is None or age >= settings.CURRENCY_REGISTRY_TTL:
+            mapping = self.load()[attr]
+        return mapping
+
+    def _get(self, attr: str, key):
+        mapping = self._mapping(attr)
+        if key not in mapping and time.monotonic() - self._loaded >= settings.CURRENCY_REGISTRY_MISS_INTERVAL:
+            # Currency may have been created by another process
+            mapping = self.load()[attr]
+        return mapping.get(key)
+
+    def code(self, pk: int) -> Optional[str]:
+        """Return code of Currency `pk`, `None` if it does not exist."""
+        return self._get('_codes', pk)
+
+    def pk(self, code: str) -> Optional[int]:
+        """Return primary key of Currency with `code`, `None` if it does not exist."""
+        return self._get('_pks', code)
+
+    def all(self) -> Dict[int, str]:
+        return dict(self._mapping('_codes'))
+
+    def clear(self, *args, **kwargs):
+        """Forget loaded Currencies, can be used as a signal receiver."""
+        with self._lock:
+            self._codes = None
+            self._pks = None
+
+
+currencies = CurrencyRegistry()
@@ -0,0 +1,252 @@
+"""
+Bulk provisioning of Accounts
+
+Accounts are read from CSV (with a header) or NDJSON rows with `name`, `currency` code and optional
+`owner` username fields, by `import_accounts` management command and `POST /v1/accounts/import/`,
+which accepts a JSON array of rows too.
+Rows are read lazily and created by :meth:`AccountImporter.run` with `bulk_create` in batches,
+each batch in its own transaction, so an invalid row is reported and skipped without rolling back others.
+Currency codes and owners are resolved once per import, not per row.
+"""
+
+import codecs
+import csv
+import json
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connections, router, transaction
+
+from accounts.cache import balance_cache
+from accounts.currencies import currencies
+from accounts.models import Account
+
+FORMATS = ('csv', 'ndjson')
+
+# Row number -> field -> error message, `non_field_errors` for unreadable rows
+RowErrors = List[Tuple[int, Dict[str, str]]]
+
+
+class UnreadableRow:
+    """
+    Row which cannot be decoded or parsed
+
+    Attributes
+
+     - message (str): Error message.
+     - last (bool): Whether following rows cannot be read either, e.g. CSV is broken.
+
+    """
+
+    def __init__(self, message: str, last: bool = False):
+        self.message = message
+        self.last = last
+
+
+def read_rows(lines: Iterable, format: str, encoding: str = 'utf-8') -> Iterator:
+    """
+    Yield rows of CSV or NDJSON `lines`, which may be bytes
+
+    NDJSON rows are decoded JSON values, blank lines are skipped. Lines which cannot be decoded or parsed
+    are yielded as :class:`UnreadableRow`. CSV rows after an unreadable one are not read, as the position
+    in the file is unknown then.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown format {}.'.format(format))
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    lines = chain([first], lines)
+    if format == 'csv':
+        if isinstance(first, bytes):
+            decoder = codecs.getincrementaldecoder(encoding)()
+            lines = (decoder.decode(line) for line in lines)
+        try:
+            yield from csv.DictReader(lines)
+        except UnicodeDecodeError:
+            yield UnreadableRow('Row is not valid {} text.'.format(encoding), last=True)
+        except csv.Error as exc:
+            yield UnreadableRow('Row is not valid CSV: {}.'.format(exc), last=True)
+        return
+    for line in lines:
+        if isinstance(line, bytes):
+            try:
+                line = line.decode(encoding)
+            except UnicodeDecodeError:
+                yield UnreadableRow('Row is not valid {} text.'.format(encoding))
+                continue
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield UnreadableRow('Row is not valid JSON.')
+
+
+class AccountImport(NamedTuple):
+    """
+    Result of :meth:`AccountImporter.run`
+
+    Attributes
+
+     - created (int): Number of created Accounts.
+     - errors (list): `(row number, {field: message})` of skipped rows, rows are numbered from 1.
+     - complete (bool): Whether all rows were read, otherwise the last error tells where reading stopped.
+
+    """
+
+    created: int
+    errors: RowErrors
+    complete: bool
+
+
+class AccountImporter:
+    """
+    Creates Accounts from rows in batches of `batch_size`
+
+    Attributes
+
+     - currency_pks (dict): Currency primary keys by code, `None` for unknown codes, resolved on first use.
+     - owner_pks (dict): User primary keys by username, `None` for unknown usernames, resolved on first use.
+     - db (str): Database alias Accounts are created in.
+     - constraints (dict): Constraints of the Account table by name, introspected on the first violation.
+
+    """
+
+    name_max_length = Account._meta.get_field('name').max_length
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.db = router.db_for_write(Account)
+        self.currency_pks = {}  # type: Dict[str, Optional[int]]
+        self.owner_pks = {}  # type: Dict[str, Optional[int]]
+        self.constraints = None  # type: Optional[Dict[str, dict]]
+
+    def currency_pk(self, code: str) -> Optional[int]:
+        if code not in self.currency_pks:
+            self.currency_pks[code] = currencies.pk(code)
+        return self.currency_pks[code]
+
+    def owner_pk(self, username: str) -> Optional[int]:
+        if username not in self.owner_pks:
+            user_model = get_user_model()
+            self.owner_pks[username] = user_model.objects.filter(
+                **{user_model.USERNAME_FIELD: username}
+            ).values_list('pk', flat=True).first()
+        return self.owner_pks[username]
+
+    def validate(self, row) -> Tuple[Optional[Account], Dict[str, str]]:
+        """Return an unsaved Account of `row` and no errors, or `None` and errors by field."""
+        if isinstance(row, UnreadableRow):
+            return None, dict(non_field_errors=row.message)
+        if not isinstance(row, dict):
+            return None, dict(non_field_errors='Row must be an object.')
+        errors = {}
+        name = str(row.get('name') or '').strip()
+        if not name:
+            errors['name'] = 'This field is required.'
+        elif len(name) > self.name_max_length:
+            errors['name'] = 'Ensure this field has no more than {} characters.'.format(self.name_max_length)
+        code = str(row.get('currency') or '').strip()
+        currency_pk = self.currency_pk(code) if code else None
+        if not code:
+            errors['currency'] = 'This field is required.'
+        elif currency_pk is None:
+            errors['currency'] = 'Currency {} does not exist.'.format(code)
+        username = str(row.get('owner') or '').strip()
+        owner_pk = self.owner_pk(username) if username else None
+        if username and owner_pk is None:
+            errors['owner'] = 'User {} does not exist.'.format(username)
+        if errors:
+            return None, errors
+        return Account(name=name, currency_id=currency_pk, owner_id=owner_pk), {}
+
+    def run(self, rows: Iterable) -> AccountImport:
+        """
+        Create Accounts of valid `rows`, Accounts with existing names are reported as errors
+
+        Reading stops at an :class:`UnreadableRow` which is the last one, Accounts of the previous rows
+        are created anyway.
+        """
+        created, errors, batch, complete = 0, [], [], True
+        for number, row in enumerate(rows, 1):
+            account, row_errors = self.validate(row)
+            if row_errors:
+                errors.append((number, row_errors))
+                if isinstance(row, UnreadableRow) and row.last:
+                    complete = False
+                    break
+                continue
+            batch.append((number, account))
+            if len(batch) >= self.batch_size:
+                created += self.create(batch, errors)
+                batch = []
+        if batch:
+            created += self.create(batch, errors)
+        errors.sort(key=lambda error: error[0])
+        return AccountImport(created, errors, complete)
+
+    def violation(self, exc: IntegrityError) -> Dict[str, str]:
+        """Return errors by field of an Account rejected by `exc`, a duplicate name or another violation."""
+        diag = getattr(exc.__cause__, 'diag', None)
+        if diag is None:
+            return dict(non_field_errors=str(exc))
+        if self.constraints is None:
+            with connections[self.db].cursor() as cursor:
+                self.constraints = connections[self.db].introspection.get_constraints(cursor, Account._meta.db_table)
+        constraint = self.constraints.get(diag.constraint_name) or {}
+        columns = constraint.get('columns') or []
+        if constraint.get('unique') and columns == [Account._meta.get_field('name').column]:
+            return dict(name='Account with this name already exists.')
+        fields = {field.column: field.name for field in Account._meta.concrete_fields}
+        field = fields.get(columns[0]) if len(columns) == 1 else None
+        return {field or 'non_field_errors': ' '.join(filter(None, (diag.message_primary, diag.message_detail)))}
+
+    @transaction.atomic
+    def create(self, batch: List[Tuple[int, Account]], errors: RowErrors) -> int:
+        """
+        Create a batch of Accounts by a single query, return the number of created ones
+
+        Foreign keys are checked immediately instead of on commit, so a Currency or an owner deleted
+        meanwhile is reported for its row.
+        """
+        existing = set(Account.objects.filter(name__in=[account.name for _, account in batch]).values_list(
+            'name', flat=True,
+        ))
+        accounts = []
+        for number, account in batch:
+            if account.name in existing:
+                errors.append((number, dict(name='Account with this name already exists.')))
+                continue
+            existing.add(account.name)
+            accounts.append((number, account))
+        if not accounts:
+            return 0
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        try:
+            with transaction.atomic():
+                Account.objects.bulk_create([account for _, account in accounts])
+        except IntegrityError:
+            # Some names were taken concurrently or some rows violate other constraints,
+            # so each Account is created separately
+            return self.create_each(accounts, errors)
+        cache = balance_cache()
+        if cache is not None:
+            transaction.on_commit(cache.invalidate_pages)
+        return len(accounts)
+
+    def create_each(self, accounts: List[Tuple[int, Account]], errors: RowErrors) -> int:
+        created = 0
+        for number, account in accounts:
+            try:
+                with transaction.atomic():
+                    account.save(force_insert=True)
+            except IntegrityError as exc:
+                errors.append((number, self.violation(exc)))
+            else:
+                created += 1
+        return created
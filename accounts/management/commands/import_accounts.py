@@ -0,0 +1,42 @@
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.imports import FORMATS, AccountImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Create Accounts from a CSV file with a header or an NDJSON file with `name`, `currency` and optional '
+            '`owner` fields. Invalid rows are reported and skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File path, `-` reads standard input.')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='File format, guessed from the file extension by default.')
+        parser.add_argument('--batch-size', type=int, default=settings.ACCOUNT_IMPORT_BATCH_SIZE,
+                            help='Accounts created by a single query.')
+        parser.add_argument('--encoding', default='utf-8', help='File encoding.')
+
+    def handle(self, *args, **options):
+        format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if format not in FORMATS:
+            raise CommandError('Unknown file format, use --format {}.'.format(' or '.join(FORMATS)))
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be positive.')
+        try:
+            file = sys.stdin.buffer if options['path'] == '-' else open(options['path'], 'rb')
+        except OSError as exc:
+            raise CommandError('Cannot open {}: {}.'.format(options['path'], exc.strerror))
+        with file:
+            result = AccountImporter(options['batch_size']).run(read_rows(file, format, options['encoding']))
+        for number, errors in result.errors:
+            self.stderr.write('Row {}: {}'.format(number, ' '.join(
+                '{}: {}'.format(field, message) for field, message in sorted(errors.items())
+            )))
+        self.stdout.write('Created {} accounts, skipped {} rows.'.format(result.created, len(result.errors)))
+        if not result.complete:
+            raise CommandError('Import stopped at row {}, the following rows were not read.'.format(
+                result.errors[-1][0],
+            ))
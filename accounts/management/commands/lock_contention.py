@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import LockContention
+
+ORDERINGS = ('wait_time', 'waits', 'max_wait')
+
+
+class Command(BaseCommand):
+    help = ('Show Accounts with the most contended locks recorded by the lock profiler, '
+            'see `settings.ACCOUNT_LOCK_PROFILER`.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Number of Accounts to show.')
+        parser.add_argument('--order', choices=ORDERINGS, default='wait_time', help='Order Accounts by.')
+        parser.add_argument('--reset', action='store_true', help='Delete recorded waits after showing them.')
+
+    def handle(self, *args, **options):
+        contention = LockContention.objects.select_related('account').order_by('-{}'.format(options['order']))
+        self.stdout.write('{:<32} {:>10} {:>12} {:>10} {:>10} {:>6}'.format(
+            'account', 'waits', 'wait ms', 'avg ms', 'max ms', 'shards',
+        ))
+        for row in contention[:options['top']]:
+            self.stdout.write('{:<32} {:>10} {:>12.1f} {:>10.3f} {:>10.3f} {:>6}'.format(
+                row.account.name, row.waits, row.wait_time * 1000, row.wait_time / row.waits * 1000,
+                row.max_wait * 1000, row.account.shard_count,
+            ))
+        if options['reset']:
+            LockContention.objects.all().delete()
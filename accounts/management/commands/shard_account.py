@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Change number of balance shards of a hot Account, 0 disables sharding.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Account name.')
+        parser.add_argument('shard_count', type=int, help='Number of shards.')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shard_count'] <= 1000:
+            raise CommandError('Number of shards must be from 0 to 1000.')
+        try:
+            account_pk = Account.objects.values_list('pk', flat=True).get(name=options['name'])
+        except Account.DoesNotExist:
+            raise CommandError('Account {} does not exist.'.format(options['name']))
+        account = Account.objects.set_shard_count(account_pk, options['shard_count'])
+        self.stdout.write('Account {} has {} shards.'.format(account, account.shard_count))
@@ -0,0 +1,184 @@
+import random
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections, models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, ExpressionWrapper, Case, Value, When
+from django.db.models import sql
+from django.db.models.sql.compiler import SQLCompiler
+from django.db.models.functions import Coalesce
+from django.utils.translation import gettext as _
+
+from utils.models import AmountField
+
+
+def sum_of_values(queryset):
+    """Return subquery expression of `queryset` values sum, `queryset` must be filtered by `OuterRef`."""
+    return Coalesce(
+        Subquery(queryset.order_by().values('account').annotate(sum=Sum('value')).values('sum'),
+                 output_field=AmountField()),
+        Decimal(0),
+    )
+
+
+class NoKeyUpdateCompiler(SQLCompiler):
+    """Compiler of :class:`NoKeyUpdateQuery`, replaces `FOR UPDATE`, which is the last clause on PostgreSQL."""
+
+    def as_sql(self, with_limits=True, with_col_aliases=False):
+        statement, params = super().as_sql(with_limits, with_col_aliases)
+        if self.query.select_for_update:
+            for_update = self.connection.ops.for_update_sql(
+                nowait=self.query.select_for_update_nowait,
+                skip_locked=self.query.select_for_update_skip_locked,
+                of=self.get_select_for_update_of_arguments(),
+            )
+            if statement.endswith(for_update):
+                statement = '{}FOR NO KEY UPDATE{}'.format(
+                    statement[:-len(for_update)], for_update[len('FOR UPDATE'):],
+                )
+        return statement, params
+
+
+class NoKeyUpdateQuery(sql.Query):
+    """Query locking rows selected for update by `FOR NO KEY UPDATE` on PostgreSQL."""
+
+    def get_compiler(self, using=None, connection=None):
+        if using:
+            connection = connections[using]
+        if connection is None or connection.vendor != 'postgresql':
+            return super().get_compiler(using, connection)
+        return NoKeyUpdateCompiler(self, connection, using)
+
+
+class AccountQuerySet(models.QuerySet):
+    def select_for_no_key_update(self, nowait: bool = False, skip_locked: bool = False):
+        """
+        Return Accounts locked by `SELECT ... FOR NO KEY UPDATE`
+
+        Unlike `FOR UPDATE` this lock does not conflict with foreign key checks, so other transactions can still
+        insert Payments and Postings referring to a locked Account, e.g. when crediting its shards.
+        Same as `select_for_update(no_key=True)` of Django 3.2+, the result is a QuerySet compiled for its own
+        database by :class:`NoKeyUpdateCompiler`. Other databases than PostgreSQL lock rows by `FOR UPDATE`.
+        """
+        queryset = self.select_for_update(nowait=nowait, skip_locked=skip_locked)
+        queryset.query = queryset.query.chain(NoKeyUpdateQuery)
+        return queryset
+
+    def update_returning_values(self, **kwargs) -> List[Decimal]:
+        """
+        Update Accounts like `update()`, return new values of updated Accounts
+
+        Done by a single `UPDATE ... RETURNING value`, so updated rows are not read again.
+        """
+        query = self.query.chain(sql.UpdateQuery)
+        query.add_update_values(kwargs)
+        statement, params = query.get_compiler(self.db).as_sql()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute('{} RETURNING {}'.format(statement, connections[self.db].ops.quote_name('value')), params)
+            return [value for value, in cursor.fetchall()]
+
+    def with_balance(self, as_of: datetime = None):
+        """
+        Annotate `balance`: Account value plus values of all its shards
+
+        With `as_of` the balance at that moment is annotated instead: the latest
+        :class:`postings.models.BalanceCheckpoint` not later than `as_of` plus Postings after the checkpoint
+        created not later than `as_of`. Accounts without such checkpoint get current balance minus Postings
+        created after `as_of`. Either way only a bounded range of Postings is summed.
+        """
+        shards = self.model.shards.rel.related_model.objects.filter(account=OuterRef('pk'))
+        balance = ExpressionWrapper(F('value') + sum_of_values(shards), output_field=AmountField())
+        if as_of is None:
+            return self.annotate(balance=balance)
+
+        postings = self.model.postings.rel.related_model.objects.filter(account=OuterRef('pk'))
+        checkpoints = self.model.balance_checkpoints.rel.related_model.objects.filter(
+            account=OuterRef('pk'), as_of__lte=as_of
+        ).order_by('-as_of')
+        return self.annotate(
+            checkpoint_value=Subquery(checkpoints.values('value')[:1], output_field=AmountField()),
+            checkpoint_posting_id=Subquery(checkpoints.values('last_posting_id')[:1]),
+        ).annotate(balance=Case(
+            When(checkpoint_value__isnull=True, then=balance - sum_of_values(postings.filter(created__gt=as_of))),
+            default=F('checkpoint_value') + sum_of_values(
+                postings.filter(id__gt=OuterRef('checkpoint_posting_id'), created__lte=as_of)
+            ),
+            output_field=AmountField(),
+        ))
+
+
+class AccountManager(models.Manager.from_queryset(AccountQuerySet)):  # type: ignore
+    """Custom Manager with hot Accounts sharding support."""
+
+    @staticmethod
+    def fold_shards(account) -> None:
+        """
+        Move values of all `account` shards to `account.value`
+
+        The Account row must be locked by the caller. Shards are locked and zeroed,
+        `account.value` is changed in memory only and must be saved by the caller.
+
+        :raises ValidationError: if Account value overflows.
+        """
+        values = list(account.shards.select_for_update().order_by('index').values_list('value', flat=True))
+        total = sum(values, Decimal(0))
+        if not total:
+            return
+        if account.value + total > settings.AMOUNT_VALUE_MAX:
+            raise ValidationError(_('Value overflow for an account {}').format(account), code='overflow')
+        account.shards.update(value=0)
+        account.value += total
+
+    def credit_shard(self, account, value: Decimal) -> None:
+        """
+        Add `value` to a random shard of `account` without locking the Account row
+
+        Each shard is capped at `(AMOUNT_VALUE_MAX - account.value) / shard_count`, so the folded total
+        of the Account never overflows, though a credit may fail before the total reaches the maximum.
+        The shard is locked first and the cap is read by the next statement, so it sees the Account value
+        raised by :meth:`fold_shards`, which locks all shards before. `account.shard_count` is read without
+        a lock, so :meth:`set_shard_count` may have deleted the chosen shard meanwhile. Then the number
+        of shards is read again and another shard is credited, or the Account itself if sharding was disabled.
+
+        :raises ValidationError: if shard value overflows.
+        """
+        while account.shard_count:
+            index = random.randrange(account.shard_count)
+            shards = account.shards.filter(index=index)
+            if shards.select_for_update().exists():
+                account_value = Subquery(self.filter(pk=account.pk).values('value'), output_field=AmountField())
+                cap = (Value(settings.AMOUNT_VALUE_MAX, output_field=AmountField()) - account_value) / Value(
+                    account.shard_count
+                ) - Value(value, output_field=AmountField())
+                if shards.filter(value__lte=cap).update(value=F('value') + value):
+                    return
+                raise ValidationError(_('Value overflow for an account {}').format(account), code='overflow')
+            account.shard_count = self.filter(pk=account.pk).values_list('shard_count', flat=True).get()
+        if not self.filter(pk=account.pk, value__lte=settings.AMOUNT_VALUE_MAX - value).update(
+                value=F('value') + value):
+            raise ValidationError(_('Value overflow for an account {}').format(account), code='overflow')
+
+    @transaction.atomic
+    def set_shard_count(self, account_pk: int, shard_count: int):
+        """
+        Change number of `account` shards, 0 disables sharding
+
+        Existing shard values are moved to Account value first, so the balance is not changed.
+        """
+        try:
+            account, = self.filter(pk=account_pk).select_for_no_key_update()
+        except ValueError:
+            raise self.model.DoesNotExist
+        self.fold_shards(account)
+        account.shards.filter(index__gte=shard_count).delete()
+        existing = set(account.shards.values_list('index', flat=True))
+        shard_model = self.model.shards.rel.related_model
+        shard_model.objects.bulk_create(
+            shard_model(account=account, index=index) for index in range(shard_count) if index not in existing
+        )
+        account.shard_count = shard_count
+        account.save(update_fields=['value', 'shard_count'])
+        return account
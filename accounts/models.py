@@ -4,6 +4,7 @@ from django.db import models
 from django.utils.translation import gettext as _
 
 from accounts.consts import ERROR_INVALID_CURRENCY_CODE
+from accounts.managers import AccountManager
 from utils.models import DefaultCharField, AmountField
 
 
@@ -50,7 +51,9 @@ class Account(models.Model):
      - name (CharField): Unique name of an Account, e.g. `bob123`.
      - owner (get_user_model()): User who owns an Account.
      - currency (:class:`Currency`): Account Currency.
-     - value (`Decimal`): Account current value.
+     - value (`Decimal`): Account current value. For a sharded Account the balance is `value` plus values
+       of all its :class:`AccountShard`.
+     - shard_count (int): Number of :class:`AccountShard` used to receive credits, 0 means not sharded.
 
     """
 
@@ -59,6 +62,63 @@ class Account(models.Model):
                               on_delete=models.CASCADE)
     currency = models.ForeignKey(Currency, related_name='accounts', on_delete=models.CASCADE)
     value = AmountField()
+    shard_count = models.PositiveSmallIntegerField(default=0)
+
+    objects = AccountManager()
 
     def __str__(self):
         return self.name
+
+
+class AccountShard(models.Model):
+    """
+    Represents a part of a hot Account balance
+
+    Credits to a sharded Account go to a random shard, so concurrent payments to the same Account lock
+    different rows. Debits move shard values back to :attr:`Account.value` when needed,
+    see :meth:`accounts.managers.AccountManager.fold_shards`.
+
+    Attributes
+
+     - account (:class:`Account`): Sharded Account.
+     - index (int): Shard number, from 0 to `Account.shard_count - 1`.
+     - value (`Decimal`): Part of Account balance.
+
+    """
+
+    account = models.ForeignKey(Account, related_name='shards', on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField()
+    value = AmountField()
+
+    class Meta:
+        unique_together = ('account', 'index')
+
+
+class LockContention(models.Model):
+    """
+    Represents waits for an Account row lock by payments
+
+    Rows are added up by :class:`accounts.contention.LockProfiler` from heavy hitters of each process,
+    so only Accounts among the most contended ones in some profiling window are counted.
+
+    Attributes
+
+     - account (:class:`Account`): Locked Account.
+     - waits (int): Number of counted lock acquisitions.
+     - wait_time (float): Seconds spent acquiring the lock while the Account was among the heaviest ones.
+     - max_wait (float): The longest wait in seconds.
+     - updated (`datetime`): Last update time.
+
+    """
+
+    account = models.OneToOneField(Account, related_name='lock_contention', on_delete=models.CASCADE)
+    waits = models.PositiveIntegerField()
+    wait_time = models.FloatField()
+    max_wait = models.FloatField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'lock contention'
+
+    def __str__(self):
+        return str(self.account)
@@ -0,0 +1,23 @@
+from rest_framework.parsers import BaseParser
+
+from accounts.imports import read_rows
+
+
+class RowsParser(BaseParser):
+    """Parses a request body to a lazy iterator of rows, so the body is read while rows are consumed."""
+
+    format = ''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding') or 'utf-8'
+        return read_rows(stream if stream is not None else [], self.format, encoding)
+
+
+class CSVParser(RowsParser):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONParser(RowsParser):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
@@ -1,14 +1,57 @@
 from rest_framework import serializers
 
+from accounts.cache import resolve_account_pks
+from accounts.currencies import currencies
 from accounts.models import Account
-from utils.serializers import AmountField
+from utils.serializers import AmountField, TimedSerializerMixin
 
 
-class AccountSerializer(serializers.ModelSerializer):
+class CurrencyCodeField(serializers.ReadOnlyField):
+    """Currency code resolved by :data:`accounts.currencies.currencies`, so Currency is not fetched."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'currency_id')
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return currencies.code(value)
+
+
+class AccountNameField(serializers.CharField):
+    """
+    Account name resolved to the Account primary key by :func:`accounts.cache.resolve_account_pks`
+
+    Represents an Account instance, or `None`, by its name.
+    """
+
+    default_error_messages = {
+        'does_not_exist': 'Object with name={value} does not exist.',
+    }
+
+    def to_internal_value(self, data):
+        name = super().to_internal_value(data)
+        pk = resolve_account_pks([name]).get(name)
+        if pk is None:
+            self.fail('does_not_exist', value=name)
+        return pk
+
+    def to_representation(self, value):
+        return value.name
+
+
+class AccountSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializes Accounts annotated by :meth:`accounts.managers.AccountQuerySet.with_balance`."""
+
     id = serializers.ReadOnlyField(source='name')
-    balance = AmountField(source='value', read_only=True)
-    currency = serializers.SlugRelatedField(slug_field='code', read_only=True)
+    balance = AmountField(read_only=True)
+    currency = CurrencyCodeField()
 
     class Meta:
         model = Account
         fields = ['id', 'owner', 'balance', 'currency']
+
+
+class BalanceAsOfSerializer(serializers.Serializer):
+    """Validates `as_of` query parameter of Accounts list."""
+
+    as_of = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
@@ -1,11 +1,17 @@
+from datetime import datetime
 from decimal import Decimal
 
+from django.utils.timezone import utc
 from model_mommy import mommy
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
 from accounts.models import Currency, Account
+from payments.models import Payment
+from postings.models import Posting, TurnoverMark
+from postings.serializers import PaymentDirection
+from utils.views import reverse_querystring
 
 
 class ListAccountsTestCase(APITestCase):
@@ -23,3 +29,189 @@ class ListAccountsTestCase(APITestCase):
         self.assertEqual(response.data['count'], 2)
         self.assertEqual(len(response.data['results']), 2)
         self.assertSetEqual({account['id'] for account in response.data['results']}, {'account_a', 'account_b'})
+
+    def test_list_accounts_as_of(self):
+        account_a = Account.objects.get(name='account_a')
+        account_b = mommy.make(Account, name='account_c', currency=account_a.currency, value=Decimal('5'))
+        payment = Payment.objects.create_payment(
+            from_account_pk=account_a.pk, to_account_pk=account_b.pk, value=Decimal('0.5'),
+        )
+        Posting.objects.filter(payment=payment).update(created=datetime(2018, 12, 1, tzinfo=utc))
+
+        url = reverse_querystring('accounts_v1:accounts-list', query_kwargs=dict(as_of='2018-11-30'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        balances = {account['id']: account['balance'] for account in response.data['results']}
+        self.assertDictEqual(balances, dict(account_a='1.0000', account_b='2.0000', account_c='5.0000'))
+
+        response = self.client.get(reverse('accounts_v1:accounts-list'))
+        balances = {account['id']: account['balance'] for account in response.data['results']}
+        self.assertDictEqual(balances, dict(account_a='0.5000', account_b='2.0000', account_c='5.5000'))
+
+    def test_list_accounts_as_of_invalid(self):
+        url = reverse_querystring('accounts_v1:accounts-list', query_kwargs=dict(as_of='yesterday'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertIn('as_of', response.data)
+
+
+class AccountPostingsTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        currency = mommy.make(Currency, code='AAA')
+        cls.bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+        cls.alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('100'))
+        carol = mommy.make(Account, name='carol789', currency=currency, value=Decimal('1000'))
+        for from_account, to_account, value in (
+                (cls.bob, cls.alice, Decimal('1')),
+                (cls.alice, cls.bob, Decimal('20')),
+                (carol, cls.alice, Decimal('300')),
+                (cls.bob, carol, Decimal('40')),
+        ):
+            Payment.objects.create_payment(
+                from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=value
+            )
+
+    def test_postings(self):
+        url = reverse('accounts_v1:accounts-postings', kwargs=dict(name='bob123'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertNotIn('count', response.data)
+        results = response.data['results']
+        self.assertEqual([(posting['amount'], posting['direction'], posting['balance_after']) for posting in results], [
+            ('40.0000', PaymentDirection.OUTGOING.value, '79.0000'),
+            ('20.0000', PaymentDirection.INCOMING.value, '119.0000'),
+            ('1.0000', PaymentDirection.OUTGOING.value, '99.0000'),
+        ])
+        self.assertTrue(all(posting['account'] == 'bob123' for posting in results))
+
+    def test_postings_amount_filter(self):
+        url = reverse_querystring(
+            'accounts_v1:accounts-postings', kwargs=dict(name='alice456'),
+            query_kwargs=dict(amount_min='10', amount_max='100'),
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual([posting['amount'] for posting in response.data['results']], ['20.0000'])
+
+    def test_postings_date_filter(self):
+        Posting.objects.filter(account=self.bob, value=Decimal('-1')).update(created=datetime(2018, 12, 1, tzinfo=utc))
+        url = reverse_querystring(
+            'accounts_v1:accounts-postings', kwargs=dict(name='bob123'),
+            query_kwargs=dict(date_from='2018-11-30', date_to='2018-12-02'),
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual([posting['amount'] for posting in response.data['results']], ['1.0000'])
+
+    def test_postings_invalid_filter(self):
+        url = reverse_querystring(
+            'accounts_v1:accounts-postings', kwargs=dict(name='bob123'), query_kwargs=dict(date_from='yesterday'),
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertIn('date_from', response.data)
+
+    def test_postings_not_found(self):
+        url = reverse('accounts_v1:accounts-postings', kwargs=dict(name='dave000'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, response.data)
+
+
+class TurnoversTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        currency = mommy.make(Currency, code='AAA')
+        bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+        alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('100'))
+        for day, from_account, to_account, value in ((1, bob, alice, '10'), (2, alice, bob, '3'), (2, bob, alice, '5')):
+            payment = Payment.objects.create_payment(
+                from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=Decimal(value),
+            )
+            Posting.objects.filter(payment=payment).update(created=datetime(2018, 12, day, tzinfo=utc))
+        TurnoverMark.objects.roll_up(datetime(2018, 12, 3, tzinfo=utc))
+
+    def test_account_turnovers(self):
+        url = reverse('accounts_v1:accounts-turnovers', kwargs=dict(name='bob123'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['as_of'], '2018-12-03T00:00:00+00:00')
+        self.assertEqual(response.data['results'], [
+            dict(day='2018-12-02', debit='5.0000', credit='3.0000', postings=2),
+            dict(day='2018-12-01', debit='10.0000', credit='0.0000', postings=1),
+        ])
+
+    def test_account_turnovers_date_filter(self):
+        url = reverse_querystring(
+            'accounts_v1:accounts-turnovers', kwargs=dict(name='alice456'),
+            query_kwargs=dict(date_from='2018-12-01', date_to='2018-12-02'),
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual([turnover['day'] for turnover in response.data['results']], ['2018-12-01'])
+
+    def test_account_turnovers_not_found(self):
+        response = self.client.get(reverse('accounts_v1:accounts-turnovers', kwargs=dict(name='dave000')))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, response.data)
+
+    def test_currency_turnovers(self):
+        url = reverse('accounts_v1:currencies-turnovers', kwargs=dict(code='AAA'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['results'], [
+            dict(day='2018-12-02', debit='8.0000', credit='8.0000', postings=4),
+            dict(day='2018-12-01', debit='10.0000', credit='10.0000', postings=2),
+        ])
+
+    def test_currency_turnovers_invalid_filter(self):
+        url = reverse_querystring(
+            'accounts_v1:currencies-turnovers', kwargs=dict(code='AAA'), query_kwargs=dict(date_to='tomorrow'),
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertIn('date_to', response.data)
+
+
+class ImportAccountsTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        mommy.make(Currency, code='AAA')
+
+    def test_import_csv(self):
+        url = reverse('accounts_v1:accounts-import-accounts')
+        response = self.client.generic('POST', url, 'name,currency\nbob123,AAA\nalice456,BBB\n', 'text/csv')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data, dict(created=1, complete=True, errors=[
+            dict(row=2, errors=dict(currency='Currency BBB does not exist.')),
+        ]))
+        self.assertEqual(Account.objects.get(name='bob123').currency.code, 'AAA')
+
+    def test_import_ndjson(self):
+        url = reverse('accounts_v1:accounts-import-accounts')
+        body = '{"name": "bob123", "currency": "AAA"}\n{"name": "alice456", "currency": "AAA"}\n'
+        response = self.client.generic('POST', url, body, 'application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data, dict(created=2, complete=True, errors=[]))
+
+    def test_import_json_invalid(self):
+        url = reverse('accounts_v1:accounts-import-accounts')
+        response = self.client.post(url, [dict(name='bob123')], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertEqual(response.data, dict(created=0, complete=True, errors=[
+            dict(row=1, errors=dict(currency='This field is required.')),
+        ]))
+
+    def test_import_unreadable(self):
+        url = reverse('accounts_v1:accounts-import-accounts')
+        response = self.client.generic('POST', url, b'name,currency\nbob123,AAA\n\xff\xfe,AAA\n', 'text/csv')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertEqual(response.data, dict(created=1, complete=False, errors=[
+            dict(row=2, errors=dict(non_field_errors='Row is not valid utf-8 text.')),
+        ]))
+
+    def test_import_not_rows(self):
+        url = reverse('accounts_v1:accounts-import-accounts')
+        for body in ('1', '"bob123"'):
+            response = self.client.generic('POST', url, body, 'application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertFalse(Account.objects.exists())
@@ -0,0 +1,98 @@
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from django.db import transaction
+from model_mommy import mommy
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from accounts.cache import balance_cache
+from accounts.models import Account, Currency
+from payments.models import Payment
+from utils import routers
+from utils.routers import ReplicaRouter
+
+
+@pytest.fixture(params=['lru', 'django'])
+def cache(request, settings):
+    settings.ACCOUNT_BALANCE_CACHE = request.param
+    cache = balance_cache()
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
+def balances(client=None):
+    response = (client or APIClient()).get(reverse('accounts_v1:accounts-list'))
+    return {account['id']: account['balance'] for account in response.data['results']}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_list_accounts_cached(cache, django_assert_num_queries):
+    currency = mommy.make(Currency, code='AAA')
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('0'))
+    mommy.make(Account, name='carol789', currency=currency, value=Decimal('1'))
+    assert balances() == dict(bob123='100.0000', alice456='0.0000', carol789='1.0000')
+
+    with django_assert_num_queries(0):
+        assert balances() == dict(bob123='100.0000', alice456='0.0000', carol789='1.0000')
+
+    with transaction.atomic():
+        Payment.objects.create_payment(bob.pk, alice.pk, Decimal('10'))
+        # Not invalidated before commit
+        assert set(cache.get_accounts(['bob123', 'alice456'])) == {'bob123', 'alice456'}
+    assert cache.get_accounts(['bob123', 'alice456', 'carol789']).keys() == {'carol789'}
+
+    # Only invalidated Accounts are read
+    with django_assert_num_queries(1):
+        assert balances() == dict(bob123='90.0000', alice456='10.0000', carol789='1.0000')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_list_accounts_cache_invalidated(cache):
+    currency = mommy.make(Currency, code='AAA')
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('0'))
+    assert balances() == dict(bob123='100.0000', alice456='0.0000')
+
+    # New Accounts invalidate pages
+    dave = mommy.make(Account, name='dave000', currency=currency, value=Decimal('5'))
+    assert balances() == dict(bob123='100.0000', alice456='0.0000', dave000='5.0000')
+
+    Payment.objects.create_payments([(bob.pk, alice.pk, Decimal('1')), (dave.pk, alice.pk, Decimal('1'))])
+    assert balances() == dict(bob123='99.0000', alice456='2.0000', dave000='4.0000')
+
+    Payment.objects.create_transaction([(alice.pk, Decimal('-2')), (bob.pk, Decimal('1')), (dave.pk, Decimal('1'))])
+    assert balances() == dict(bob123='100.0000', alice456='0.0000', dave000='5.0000')
+
+    dave.delete()
+    assert balances() == dict(bob123='100.0000', alice456='0.0000')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_list_accounts_cache_read_after_write(cache, settings):
+    settings.DATABASE_REPLICAS = ['replica_0']
+    currency = mommy.make(Currency, code='AAA')
+    mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    mommy.make(Account, name='alice456', currency=currency, value=Decimal('0'))
+    client = APIClient()
+    aliases = []
+
+    def db_for_read(model, **hints):
+        aliases.append(routers._state.alias)  # pylint: disable=protected-access
+
+    # Queries still go to the `default` database, since there is no `replica_0` database
+    with mock.patch.object(ReplicaRouter, 'db_for_read', side_effect=db_for_read):
+        # The cache is filled from the primary database only
+        assert balances(client) == dict(bob123='100.0000', alice456='0.0000')
+        assert set(aliases) == {None}
+
+        response = client.post(
+            reverse('payments_v1:payments-list'), data=dict(from_account='bob123', to_account='alice456', value='1'),
+        )
+        assert routers.PIN_COOKIE in response.cookies
+        # A stale balance put back by a racing reader is not served to the pinned client
+        cache.set_accounts([dict(id='bob123', owner=None, balance='100.0000', currency='AAA')])
+        assert balances(client) == dict(bob123='99.0000', alice456='1.0000')
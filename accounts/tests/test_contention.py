@@ -0,0 +1,84 @@
+import random
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from model_mommy import mommy
+
+from accounts import contention
+from accounts.models import Account, Currency, LockContention
+from payments.consts import PAYMENTS_ENGINE_LOCKING, PAYMENTS_ENGINE_CONDITIONAL_UPDATE
+from payments.models import Payment
+
+
+@pytest.fixture
+def profiler(settings):
+    settings.ACCOUNT_LOCK_PROFILER = True
+    settings.ACCOUNT_LOCK_PROFILER_TOP_K = 3
+    settings.ACCOUNT_LOCK_PROFILER_FLUSH_INTERVAL = 3600
+    contention._profilers.clear()
+    yield contention.lock_profiler()
+    contention._profilers.clear()
+
+
+def test_count_min_sketch():
+    sketch = contention.CountMinSketch(width=16, depth=4)
+    sums = {}
+    rnd = random.Random(0)
+    for _ in range(1000):
+        key, value = rnd.randrange(100), rnd.random()
+        sums[key] = sums.get(key, 0) + value
+        assert sketch.add(key, value) >= sums[key] - 1e-9
+
+
+def test_heavy_hitters():
+    profiler = contention.LockProfiler(size=3, width=256, depth=4, flush_interval=3600)
+    rnd = random.Random(0)
+    for _ in range(2000):
+        account_pk = rnd.randrange(100)
+        profiler.record(account_pk, 0.001)
+        # Few hot Accounts wait much longer
+        profiler.record(account_pk % 3 + 1000, 0.01)
+    top = profiler.take()
+    assert sorted(account_pk for account_pk, *_ in top) == [1000, 1001, 1002]
+    assert all(waits > 0 and max_wait == 0.01 for _, _, waits, max_wait in top)
+    # Wait time is counted exactly since entering the top, so the average is not inflated by the estimate
+    assert all(wait == pytest.approx(waits * 0.01) for _, wait, waits, _ in top)
+    assert profiler.take() == []
+
+
+@pytest.mark.parametrize('engine', (PAYMENTS_ENGINE_LOCKING, PAYMENTS_ENGINE_CONDITIONAL_UPDATE))
+@pytest.mark.django_db
+def test_create_payment_profiled(settings, profiler, engine):
+    settings.PAYMENTS_ENGINE = engine
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('0'))
+    for _ in range(3):
+        Payment.objects.create_payment(from_account_pk=bob.pk, to_account_pk=alice.pk, value=Decimal('1'))
+    assert bob.pk in profiler.top and alice.pk in profiler.top
+    assert Account.objects.get(pk=alice.pk).value == 3
+
+    profiler.flush()
+    profiler.record(bob.pk, 0.5)
+    profiler.flush()
+    assert dict(LockContention.objects.values_list('account__name', 'waits')) == dict(bob123=4, alice456=3)
+    assert LockContention.objects.get(account=bob).max_wait == 0.5
+
+    out = StringIO()
+    call_command('lock_contention', '--reset', stdout=out)
+    lines = out.getvalue().splitlines()
+    assert lines[1].split()[:2] == ['bob123', '4']
+    assert lines[2].split()[:2] == ['alice456', '3']
+    assert not LockContention.objects.exists()
+
+
+@pytest.mark.django_db
+def test_lock_contention_admin(admin_client):
+    account = mommy.make(Account, name='bob123')
+    LockContention.objects.create(account=account, waits=4, wait_time=0.02, max_wait=0.01)
+    response = admin_client.get(reverse('admin:accounts_lockcontention_changelist'))
+    assert response.status_code == 200
+    assert b'bob123' in response.content
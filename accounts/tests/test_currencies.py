@@ -0,0 +1,68 @@
+import pytest
+from model_mommy import mommy
+
+from accounts.currencies import CurrencyRegistry, currencies
+from accounts.models import Currency
+
+
+@pytest.mark.django_db
+def test_currency_registry(django_assert_num_queries):
+    currency = mommy.make(Currency, code='AAA')
+    currencies.clear()
+    with django_assert_num_queries(1):
+        assert currencies.code(currency.pk) == 'AAA'
+        assert currencies.pk('AAA') == currency.pk
+        assert currencies.all()[currency.pk] == 'AAA'
+
+    # Saving a Currency clears the registry
+    currency.code = 'BBB'
+    currency.save()
+    assert currencies.code(currency.pk) == 'BBB'
+    assert currencies.pk('AAA') is None
+
+
+@pytest.mark.django_db
+def test_currency_registry_reloads_missing(settings, django_assert_num_queries):
+    settings.CURRENCY_REGISTRY_MISS_INTERVAL = 3600
+    mommy.make(Currency, code='AAA')
+    currencies.load()
+    # Created by another process, i.e. without signals
+    Currency.objects.bulk_create([Currency(code='CCC')])
+    pk = Currency.objects.get(code='CCC').pk
+    # Misses do not reload Currencies again and again
+    with django_assert_num_queries(0):
+        assert currencies.pk('CCC') is None
+        assert currencies.code(pk) is None
+
+    settings.CURRENCY_REGISTRY_MISS_INTERVAL = 0
+    with django_assert_num_queries(1):
+        assert currencies.pk('CCC') == pk
+
+
+@pytest.mark.django_db
+def test_currency_registry_expires(settings, django_assert_num_queries):
+    currency = mommy.make(Currency, code='AAA')
+    currencies.load()
+    # Changed by another process, i.e. without signals
+    Currency.objects.filter(pk=currency.pk).update(code='BBB')
+    with django_assert_num_queries(0):
+        assert currencies.code(currency.pk) == 'AAA'
+
+    settings.CURRENCY_REGISTRY_TTL = 0
+    assert currencies.code(currency.pk) == 'BBB'
+
+
+@pytest.mark.django_db
+def test_currency_registry_cleared_while_loading():
+    class Registry(CurrencyRegistry):
+        def load(self):
+            mappings = super().load()
+            # A Currency saved by another thread meanwhile
+            self.clear()
+            return mappings
+
+    currency = mommy.make(Currency, code='AAA')
+    registry = Registry()
+    assert registry.pk('AAA') == currency.pk
+    assert registry.code(currency.pk) == 'AAA'
+    assert registry.all() == {currency.pk: 'AAA'}
@@ -0,0 +1,113 @@
+import csv
+from io import StringIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from model_mommy import mommy
+
+from accounts.imports import AccountImporter, read_rows
+from accounts.models import Account, Currency
+
+
+@pytest.fixture
+def currency():
+    return mommy.make(Currency, code='AAA')
+
+
+def test_read_rows():
+    assert list(read_rows(['name,currency\n', 'bob123,AAA\n'], 'csv')) == [dict(name='bob123', currency='AAA')]
+    rows = list(read_rows([b'{"name": "bob123"}\n', b'\n', b'[1]\n', b'{\n', b'\xff\n', b'{}'], 'ndjson'))
+    assert rows[:2] == [dict(name='bob123'), [1]]
+    assert [(row.message, row.last) for row in rows[2:4]] == [
+        ('Row is not valid JSON.', False), ('Row is not valid utf-8 text.', False),
+    ]
+    assert rows[4] == {}
+    assert list(read_rows([], 'csv')) == []
+
+
+def test_read_rows_unreadable_csv():
+    rows = list(read_rows([b'name,currency\n', b'bob123,AAA\n', b'\xff\xfe,AAA\n', b'alice456,AAA\n'], 'csv'))
+    assert rows[0] == dict(name='bob123', currency='AAA')
+    assert (rows[1].message, rows[1].last, len(rows)) == ('Row is not valid utf-8 text.', True, 2)
+
+    rows = list(read_rows(['name,currency\n', '{},AAA\n'.format('x' * (csv.field_size_limit() + 1))], 'csv'))
+    assert rows[0].message.startswith('Row is not valid CSV: ')
+
+
+@pytest.mark.django_db
+def test_import_accounts(currency, django_assert_max_num_queries):
+    user = mommy.make(get_user_model(), username='bob')
+    mommy.make(Account, name='taken', currency=currency)
+    rows = [
+        dict(name='bob123', currency='AAA', owner='bob'),
+        dict(name='', currency='AAA'),
+        dict(name='alice456', currency='BBB', owner='nobody'),
+        dict(name='taken', currency='AAA'),
+        dict(name='carol789', currency='AAA'),
+        dict(name='carol789', currency='AAA'),
+        None,
+        dict(name='x' * 255, currency='AAA'),
+    ] + [dict(name='account{}'.format(i), currency='AAA') for i in range(10)]
+
+    # Currencies and owners are fetched once, then per batch of 5 immediate constraints, an existence check
+    # and an insert in savepoints
+    with django_assert_max_num_queries(4 + 3 * 7):
+        result = AccountImporter(batch_size=5).run(rows)
+    assert result.created == 12
+    assert result.errors == [
+        (2, dict(name='This field is required.')),
+        (3, dict(currency='Currency BBB does not exist.', owner='User nobody does not exist.')),
+        (4, dict(name='Account with this name already exists.')),
+        (6, dict(name='Account with this name already exists.')),
+        (7, dict(non_field_errors='Row must be an object.')),
+        (8, dict(name='Ensure this field has no more than 254 characters.')),
+    ]
+    assert Account.objects.get(name='bob123').owner == user
+    assert Account.objects.filter(name__startswith='account', currency=currency).count() == 10
+
+
+@pytest.mark.django_db
+def test_import_accounts_violations(currency):
+    importer = AccountImporter(batch_size=5)
+    # Currency was deleted after its code was resolved
+    deleted = mommy.make(Currency, code='ZZZ')
+    importer.currency_pks['ZZZ'] = deleted.pk
+    deleted.delete()
+
+    result = importer.run([dict(name='bob123', currency='AAA'), dict(name='alice456', currency='ZZZ')])
+    assert result.created == 1
+    (number, errors), = result.errors
+    assert number == 2
+    assert list(errors) == ['currency']
+    assert 'foreign key' in errors['currency']
+    assert Account.objects.filter(name='bob123').exists()
+
+@pytest.mark.django_db
+def test_import_accounts_command(currency, tmp_path):
+    path = tmp_path / 'accounts.ndjson'
+    path.write_text('{"name": "bob123", "currency": "AAA"}\n{"name": "alice456", "currency": "ZZZ"}\n')
+    out, err = StringIO(), StringIO()
+    call_command('import_accounts', str(path), '--batch-size', '1', stdout=out, stderr=err)
+    assert out.getvalue() == 'Created 1 accounts, skipped 1 rows.\n'
+    assert err.getvalue() == 'Row 2: currency: Currency ZZZ does not exist.\n'
+    assert Account.objects.filter(name='bob123').exists()
+
+    path = tmp_path / 'accounts.txt'
+    path.write_text('name,currency\ncarol789,AAA\n')
+    with pytest.raises(CommandError):
+        call_command('import_accounts', str(path))
+    call_command('import_accounts', str(path), '--format', 'csv', stdout=out)
+    assert Account.objects.filter(name='carol789').exists()
+
+
+@pytest.mark.django_db
+def test_import_accounts_command_unreadable(currency, tmp_path):
+    path = tmp_path / 'accounts.csv'
+    path.write_bytes(b'name,currency\nbob123,AAA\n\xff\xfe,AAA\nalice456,AAA\n')
+    out, err = StringIO(), StringIO()
+    with pytest.raises(CommandError, match='Import stopped at row 2'):
+        call_command('import_accounts', str(path), stdout=out, stderr=err)
+    assert out.getvalue() == 'Created 1 accounts, skipped 1 rows.\n'
+    assert err.getvalue() == 'Row 2: non_field_errors: Row is not valid utf-8 text.\n'
+    assert Account.objects.filter(name='bob123').exists()
@@ -1,8 +1,13 @@
+import random
 from decimal import Decimal
 
 import pytest
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from model_mommy import mommy
 
 from accounts.models import Currency, CurrencyCodeValidator, Account
@@ -83,3 +88,77 @@ def test_account_model_value_valid(value):
     account.save()
     account.refresh_from_db()
     assert account.value == Decimal(value)
+
+
+@pytest.mark.django_db
+def test_account_select_for_no_key_update():
+    account = mommy.make(Account)
+    locked = Account.objects.using('default').select_for_no_key_update(skip_locked=True).filter(pk=account.pk)
+    assert isinstance(locked, QuerySet)
+    with CaptureQueriesContext(connection) as context:
+        assert list(locked) == [account]
+    assert context.captured_queries[0]['sql'].endswith(' FOR NO KEY UPDATE SKIP LOCKED')
+    assert locked.count() == 1
+
+@pytest.mark.django_db
+def test_account_set_shard_count():
+    account = mommy.make(Account, value=Decimal('1'))
+
+    account = Account.objects.set_shard_count(account.pk, 4)
+    assert account.shard_count == 4
+    assert sorted(account.shards.values_list('index', flat=True)) == [0, 1, 2, 3]
+
+    for _ in range(10):
+        Account.objects.credit_shard(account, Decimal('0.5'))
+    assert Account.objects.with_balance().get(pk=account.pk).balance == Decimal('6')
+
+    # Disabling sharding moves shard values to the Account value
+    account = Account.objects.set_shard_count(account.pk, 0)
+    assert not account.shards.exists()
+    account.refresh_from_db()
+    assert account.value == Decimal('6')
+    assert Account.objects.with_balance().get(pk=account.pk).balance == Decimal('6')
+
+
+@pytest.mark.django_db
+def test_account_credit_shard_stale_shard_count():
+    account = mommy.make(Account, value=Decimal('1'))
+    stale = Account.objects.set_shard_count(account.pk, 4)
+
+    # Shards were removed after `shard_count` was read
+    Account.objects.set_shard_count(account.pk, 1)
+    for _ in range(10):
+        Account.objects.credit_shard(stale, Decimal('0.5'))
+        stale.shard_count = 4
+    assert Account.objects.with_balance().get(pk=account.pk).balance == Decimal('6')
+
+    stale.shard_count = 4
+    Account.objects.set_shard_count(account.pk, 0)
+    Account.objects.credit_shard(stale, Decimal('0.5'))
+    account.refresh_from_db()
+    assert account.value == Decimal('6.5')
+
+    account = Account.objects.set_shard_count(account.pk, 1)
+    account.shards.update(value=settings.AMOUNT_VALUE_MAX)
+    with pytest.raises(ValidationError) as exc_info:
+        Account.objects.credit_shard(account, Decimal('0.5'))
+    assert exc_info.value.code == 'overflow'
+
+
+@pytest.mark.django_db
+@override_settings(AMOUNT_VALUE_MAX=Decimal('10'))
+def test_account_credit_shard_total_overflow(monkeypatch):
+    account = Account.objects.set_shard_count(mommy.make(Account, value=Decimal('4')).pk, 3)
+
+    # Each shard is capped at (10 - 4) / 3, so the folded total fits
+    for index in range(account.shard_count):
+        monkeypatch.setattr(random, 'randrange', lambda stop, index=index: index)
+        Account.objects.credit_shard(account, Decimal('1.9999'))
+        Account.objects.credit_shard(account, Decimal('0.0001'))
+        with pytest.raises(ValidationError) as exc_info:
+            Account.objects.credit_shard(account, Decimal('0.0001'))
+        assert exc_info.value.code == 'overflow'
+    assert Account.objects.with_balance().get(pk=account.pk).balance == Decimal('10')
+
+    account = Account.objects.set_shard_count(account.pk, 0)
+    assert account.value == Decimal('10')
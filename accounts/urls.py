@@ -2,12 +2,13 @@ from django.urls import path, include
 from rest_framework import routers
 
 from accounts.apps import AccountsConfig
-from accounts.views import AccountViewSet
+from accounts.views import AccountViewSet, CurrencyViewSet
 
 app_name = AccountsConfig.name
 
 router = routers.DefaultRouter()
 router.register(r'accounts', AccountViewSet, basename='accounts')
+router.register(r'currencies', CurrencyViewSet, basename='currencies')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,10 +1,162 @@
+from collections import OrderedDict
+from typing import Iterator, Optional, Type
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Model
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.mixins import ListModelMixin
+from rest_framework.parsers import JSONParser
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
-from accounts.models import Account
-from accounts.serializers import AccountSerializer
+from accounts.cache import balance_cache
+from accounts.imports import AccountImporter
+from accounts.models import Account, Currency
+from accounts.parsers import CSVParser, NDJSONParser
+from accounts.serializers import AccountSerializer, BalanceAsOfSerializer
+from postings.models import AccountTurnover, CurrencyTurnover, Posting, TurnoverMark
+from postings.serializers import (
+    PostingValuesSerializer, PostingFilterSerializer, TurnoverFilterSerializer, TurnoverSerializer,
+)
+from utils.pagination import KeysetPagination
+from utils.routers import is_pinned, read_from_primary
+from utils.views import ReplicaReadMixin
+
+
+class TurnoversMixin:
+    """
+    Detail action serving daily turnovers rolled up by `roll_up_turnovers` management command
+
+    Filters: `date_from`, `date_to` (exclusive) days. Response `as_of` is the moment turnovers are
+    complete until, Postings created later are rolled up by a next run.
+
+    Attributes
+
+     - turnover_model (Model): Turnover model, e.g. :class:`postings.models.AccountTurnover`.
+     - turnover_field (str): Foreign key of `turnover_model` to the model looked up by `lookup_field`.
 
+    """
 
-class AccountViewSet(ListModelMixin, GenericViewSet):
-    queryset = Account.objects.all()
+    turnover_model = None  # type: Optional[Type[Model]]
+    turnover_field = ''
+
+    @action(detail=True, serializer_class=TurnoverSerializer)
+    def turnovers(self, request, *args, **kwargs):
+        if self.turnover_model is None:
+            raise ImproperlyConfigured('{} must set turnover_model.'.format(type(self).__name__))
+        filters = TurnoverFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        related_model = self.turnover_model._meta.get_field(self.turnover_field).related_model
+        related_pk = get_object_or_404(
+            related_model.objects.values_list('pk', flat=True), **{self.lookup_field: kwargs[self.lookup_field]}
+        )
+        queryset = filters.filter_queryset(self.turnover_model.objects.filter(**{self.turnover_field: related_pk}))
+        serializer = self.get_serializer(TurnoverSerializer.prepare_queryset(queryset), many=True)
+        as_of = TurnoverMark.objects.values_list('as_of', flat=True).first()
+        return Response(OrderedDict((
+            ('as_of', as_of.isoformat() if as_of is not None else None),
+            ('results', serializer.data),
+        )))
+
+
+class AccountViewSet(TurnoversMixin, ReplicaReadMixin, ListModelMixin, GenericViewSet):
+    queryset = Account.objects.with_balance()
+    replica_actions = ('list', 'postings', 'turnovers')
     serializer_class = AccountSerializer
+    lookup_field = 'name'
+    lookup_value_regex = '[^/]+'
+    turnover_model = AccountTurnover
+    turnover_field = 'account'
+
+    def get_queryset(self):
+        """Annotate balances as of `as_of` query parameter if it is given."""
+        if self.action == 'list':
+            filters = BalanceAsOfSerializer(data=self.request.query_params)
+            filters.is_valid(raise_exception=True)
+            if 'as_of' in filters.validated_data:
+                return Account.objects.with_balance(as_of=filters.validated_data['as_of'])
+        return super().get_queryset()
+
+    def list(self, request, *args, **kwargs):
+        """
+        Serve current balances from :func:`accounts.cache.balance_cache` if it is enabled
+
+        Pages are cached as lists of Account names and Accounts are cached separately, so only Accounts
+        missing in the cache are read. A fully cached page is served without database queries.
+        The cache is filled from the primary database only, as a lagging replica would put back balances
+        invalidated by committed payments. Clients pinned to the primary database bypass the cache,
+        so they read their own writes.
+        """
+        cache = balance_cache()
+        if cache is None or 'as_of' in request.query_params or is_pinned(request):
+            return super().list(request, *args, **kwargs)
+
+        with read_from_primary():
+            return self.list_cached(cache, request, *args, **kwargs)
+
+    def list_cached(self, cache, request, *args, **kwargs):
+        url = request.build_absolute_uri()
+        page = cache.get_page(url)
+        if page is None:
+            response = super().list(request, *args, **kwargs)
+            cache.set_accounts(response.data['results'])
+            cache.set_page(url, dict(response.data, results=[account['id'] for account in response.data['results']]))
+            return response
+
+        accounts = cache.get_accounts(page['results'])
+        missing = [name for name in page['results'] if name not in accounts]
+        if missing:
+            fetched = self.get_serializer(self.get_queryset().filter(name__in=missing), many=True).data
+            cache.set_accounts(fetched)
+            accounts.update((account['id'], account) for account in fetched)
+        return Response(OrderedDict(page, results=[accounts[name] for name in page['results'] if name in accounts]))
+
+    @action(detail=True, pagination_class=KeysetPagination, serializer_class=PostingValuesSerializer)
+    def postings(self, request, *args, **kwargs):
+        """
+        Account statement, newest Postings first
+
+        Filters: `date_from`, `date_to` (exclusive) and `amount_min`, `amount_max` (absolute amount).
+        """
+        account_pk = get_object_or_404(Account.objects.values_list('pk', flat=True), name=kwargs['name'])
+        filters = PostingFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+
+        queryset = filters.filter_queryset(Posting.objects.filter(account_id=account_pk))
+        page = self.paginate_queryset(PostingValuesSerializer.prepare_queryset(queryset))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[JSONParser, CSVParser, NDJSONParser])
+    def import_accounts(self, request, *args, **kwargs):
+        """
+        Create Accounts from a JSON array, CSV or NDJSON rows with `name`, `currency` and optional `owner`
+
+        The body is read while Accounts are created in batches, see :mod:`accounts.imports`.
+        Invalid rows are skipped and reported by row number, other rows are created anyway. If the body
+        cannot be read to the end, `complete` is false and Accounts of the rows read are still created.
+        """
+        rows = request.data
+        if isinstance(rows, dict):
+            rows = [rows]
+        elif not isinstance(rows, (list, Iterator)):
+            raise ParseError('Expected a list of rows.')
+        result = AccountImporter(settings.ACCOUNT_IMPORT_BATCH_SIZE).run(rows)
+        succeeded = result.complete and (result.created or not result.errors)
+        return Response(OrderedDict((
+            ('created', result.created),
+            ('complete', result.complete),
+            ('errors', [OrderedDict((('row', number), ('errors', errors))) for number, errors in result.errors]),
+        )), status=status.HTTP_201_CREATED if succeeded else status.HTTP_400_BAD_REQUEST)
+
+
+class CurrencyViewSet(TurnoversMixin, ReplicaReadMixin, GenericViewSet):
+    queryset = Currency.objects.all()
+    replica_actions = ('turnovers',)
+    lookup_field = 'code'
+    turnover_model = CurrencyTurnover
+    turnover_field = 'currency'
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of per-payment amount arithmetic
+
+Measures CPU time of :meth:`payments.managers.PaymentManager.validate_payment` followed by both Account value
+changes, i.e. everything `create_payment` computes in Python, for different amount types:
+
+ - `decimal`: C `decimal.Decimal`, what the ORM and DRF return.
+ - `_pydecimal`: pure Python `Decimal`.
+ - `money`: :class:`utils.money.Money` integer minor units.
+
+Usage::
+
+    python -m benchmarks.money --number 100000
+"""
+
+import argparse
+import json
+import os
+import timeit
+from types import SimpleNamespace
+
+import django
+
+
+def payment_path(validate_payment, from_account, to_account, value):
+    validate_payment(from_account, to_account, value)
+    from_account.value -= value
+    to_account.value += value
+    # Keep balances stable between runs
+    from_account.value += value
+    to_account.value -= value
+
+
+def run(number: int) -> dict:
+    import _pydecimal
+    import decimal
+
+    from django.conf import settings
+    from django.test import override_settings
+
+    from payments.managers import PaymentManager
+    from utils.money import Money
+
+    amount_types = dict(
+        decimal=decimal.Decimal,
+        _pydecimal=_pydecimal.Decimal,
+        money=Money.from_decimal,
+    )
+    results = {}
+    for name, amount_type in amount_types.items():
+        from_account = SimpleNamespace(currency_id=1, value=amount_type('100.0000'))
+        to_account = SimpleNamespace(currency_id=1, value=amount_type('0.0100'))
+        value = amount_type('12.3400')
+        with override_settings(AMOUNT_VALUE_MAX=amount_type(str(settings.AMOUNT_VALUE_MAX))):
+            seconds = min(timeit.repeat(
+                lambda: payment_path(PaymentManager.validate_payment, from_account, to_account, value),
+                number=number, repeat=5,
+            ))
+        results[name] = dict(ns_per_payment=round(seconds / number * 10 ** 9))
+    baseline = results['decimal']['ns_per_payment']
+    for result in results.values():
+        result['relative_to_decimal'] = round(result['ns_per_payment'] / baseline, 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=100000, help='Payments per measurement.')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'double_entry.settings')
+    django.setup()
+    print(json.dumps(run(args.number), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+Load test of the payment hot path
+
+Seeds Accounts in a fresh test database and makes payments between them by concurrent workers,
+then prints a JSON report to compare between commits:
+
+ - `latency_ms`: p50, p99 and max latency of successful payments, including retries.
+ - `payments_per_second`: successful payments per second of wall time.
+ - `deadlocks`, `serialization_failures`, `retries`, `gave_up`: transient database errors, a payment
+   failed by one is retried up to `--retries` times by :func:`utils.transactions.retry_on_conflict`.
+ - `queries_per_payment`: database queries per attempted payment.
+ - `failed`: payments rejected by validation (e.g. `no_funds`) or HTTP status.
+ - `consistent`: whether the total balance of all Accounts did not change.
+
+Targets:
+
+ - `manager`: :meth:`payments.managers.PaymentManager.create_payment`.
+ - `api`: `POST /v1/payments/` through the whole Django stack by the test client, without a HTTP server.
+
+Hot-account skew: Accounts of a currency are chosen with Zipf weights `1 / rank ** skew`,
+so `--skew 0` is uniform and `--skew 1.5` sends most payments through few Accounts.
+
+Usage::
+
+    python -m benchmarks.payments --target api --mode process --workers 8 --payments 500 --skew 1.2
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from itertools import accumulate, product
+from multiprocessing import get_context
+from string import ascii_uppercase
+from typing import List, Optional, Tuple
+
+import django
+
+# Initial value of each Account, big enough to make `no_funds` rare
+INITIAL_VALUE = 10 ** 6
+
+
+def seed(accounts: int, currencies: int) -> List[List[Tuple[int, str]]]:
+    """Create Accounts evenly split between Currencies, return primary keys and names grouped by Currency."""
+    from accounts.models import Account, Currency
+
+    codes = [''.join(code) for code in product(ascii_uppercase, repeat=3)][:currencies]
+    currency_pks = [currency.pk for currency in Currency.objects.bulk_create(Currency(code=code) for code in codes)]
+    Account.objects.bulk_create(
+        (Account(name='bench{}'.format(i), currency_id=currency_pks[i % currencies], value=INITIAL_VALUE)
+         for i in range(accounts)),
+        batch_size=1000,
+    )
+    groups = {pk: [] for pk in currency_pks}
+    for pk, name, currency_id in Account.objects.order_by('pk').values_list('pk', 'name', 'currency_id'):
+        groups[currency_id].append((pk, name))
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def payments(groups: List[List[Tuple[int, str]]], skew: float, count: int, seed_: int):
+    """Yield `count` distinct Accounts of the same Currency chosen with Zipf weights, and a payment value."""
+    rnd = random.Random(seed_)
+    weights = [list(accumulate(1 / (rank + 1) ** skew for rank in range(len(group)))) for group in groups]
+    for _ in range(count):
+        index = rnd.randrange(len(groups))
+        while True:
+            from_account, to_account = rnd.choices(groups[index], cum_weights=weights[index], k=2)
+            if from_account != to_account:
+                yield from_account, to_account, Decimal(rnd.randint(1, 10000)) / 100
+                break
+
+
+def run_worker(options: dict, groups: List[List[Tuple[int, str]]], worker: int) -> dict:
+    """Make `options['payments']` payments, return latencies of successful ones and counters."""
+    from django.core.exceptions import ValidationError
+    from django.db import OperationalError, connection
+    from django.test import Client
+
+    from payments.models import Payment
+    from utils.transactions import retry_counters, retryable_error
+
+    retries = retry_counters.as_dict()
+    client = Client()
+    counters = Counter()
+    latencies = []
+
+    def count_queries(execute, sql, params, many, context):
+        counters['queries'] += 1
+        return execute(sql, params, many, context)
+
+    def pay(from_account, to_account, value):
+        if options['target'] == 'api':
+            response = client.post('/v1/payments/', content_type='application/json', data=json.dumps(dict(
+                from_account=from_account[1], to_account=to_account[1], value=str(value),
+            )))
+            return None if response.status_code == 201 else 'http_{}'.format(response.status_code)
+        try:
+            Payment.objects.create_payment(from_account_pk=from_account[0], to_account_pk=to_account[0], value=value)
+        except ValidationError as exc:
+            return exc.code
+        return None
+
+    try:
+        with connection.execute_wrapper(count_queries):
+            for from_account, to_account, value in payments(
+                    groups, options['skew'], options['payments'], options['seed'] * 1000 + worker):
+                started = time.perf_counter()
+                try:
+                    error = pay(from_account, to_account, value)
+                except OperationalError as exc:
+                    # Given up by `retry_on_conflict`
+                    error = retryable_error(exc)
+                    if error is None:
+                        raise
+                if error is None:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    counters['failed:{}'.format(error)] += 1
+    finally:
+        connection.close()
+    # Retries made by this worker, if it is the only one of the process
+    retries = Counter({name: value - retries[name] for name, value in retry_counters.as_dict().items()})
+    return dict(latencies=latencies, counters=counters, retries=retries)
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """Return nearest-rank percentile of sorted `values`."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def total_balance() -> int:
+    from accounts.models import Account
+
+    return sum(account.balance for account in Account.objects.with_balance())
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options: dict) -> dict:
+    from django.conf import settings
+    from django.db import connection, connections
+
+    from utils.transactions import retry_counters
+
+    settings.PAYMENTS_ENGINE = options['engine']
+    settings.TRANSACTION_RETRY_ATTEMPTS = options['retries'] + 1
+    groups = seed(options['accounts'], options['currencies'])
+    balance = total_balance()
+    # Workers open their own connections, forked processes must not share the parent one
+    connections.close_all()
+
+    if options['mode'] == 'process':
+        executor = ProcessPoolExecutor(options['workers'], mp_context=get_context('fork'))
+    else:
+        executor = ThreadPoolExecutor(options['workers'])
+    retries = retry_counters.as_dict()
+    started = time.perf_counter()
+    with executor:
+        futures = [executor.submit(run_worker, options, groups, worker) for worker in range(options['workers'])]
+        results = [future.result() for future in futures]
+    seconds = time.perf_counter() - started
+
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    counters = sum((result['counters'] for result in results), Counter())
+    if options['mode'] == 'process':
+        retries = sum((result['retries'] for result in results), Counter())
+    else:
+        retries = {name: value - retries[name] for name, value in retry_counters.as_dict().items()}
+    attempted = options['workers'] * options['payments']
+    return dict(
+        commit=git_commit(),
+        options=options,
+        database=connection.settings_dict['NAME'],
+        completed=len(latencies),
+        failed={key.split(':', 1)[1]: value for key, value in counters.items() if key.startswith('failed:')},
+        seconds=round(seconds, 3),
+        payments_per_second=round(len(latencies) / seconds, 1),
+        latency_ms={
+            name: round(value * 1000, 3) if value is not None else None
+            for name, value in (('p50', percentile(latencies, 50)), ('p99', percentile(latencies, 99)),
+                                ('max', latencies[-1] if latencies else None))
+        },
+        deadlocks=retries['deadlock'],
+        serialization_failures=retries['serialization_failure'],
+        retries=retries['retries'],
+        gave_up=retries['gave_up'],
+        queries_per_payment=round(counters['queries'] / attempted, 2),
+        consistent=total_balance() == balance,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['manager', 'api'], default='manager', help='What makes payments.')
+    parser.add_argument('--mode', choices=['thread', 'process'], default='thread', help='How workers run.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of concurrent workers.')
+    parser.add_argument('--payments', type=int, default=200, help='Payments per worker.')
+    parser.add_argument('--accounts', type=int, default=1000, help='Number of Accounts.')
+    parser.add_argument('--currencies', type=int, default=1, help='Number of Currencies.')
+    parser.add_argument('--skew', type=float, default=0, help='Zipf exponent of Account choice, 0 is uniform.')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Retries of a payment failed by a deadlock or a serialization failure.')
+    parser.add_argument('--engine', choices=['locking', 'conditional_update'], default=None,
+                        help='`settings.PAYMENTS_ENGINE`, the configured one by default.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed makes the same payments.')
+    parser.add_argument('--output', help='Write the report to this file too.')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'double_entry.settings')
+    django.setup()
+    from django.apps import apps
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    options = vars(args).copy()
+    options.pop('output')
+    options['engine'] = options['engine'] or settings.PAYMENTS_ENGINE
+    setup_test_environment()
+    # Tables are created from models, as migrations are generated locally
+    settings.MIGRATION_MODULES = {app.label: None for app in apps.get_app_configs()}
+    connection.settings_dict['TEST']['NAME'] = 'benchmark_{}'.format(connection.settings_dict['NAME'])
+    database = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        report = run(options)
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def primary_database_only(request, settings):
+    """
+    Read from the primary database unless a test is marked by `replica`
+
+    Read replicas mirror the `default` test database by separate connections, which do not see data
+    of test transactions.
+    """
+    if request.node.get_closest_marker('replica') is None:
+        settings.DATABASE_REPLICAS = []
+
+
+@pytest.fixture(autouse=True)
+def clear_account_pks():
+    """Names of Accounts are reused by tests, while primary keys of rolled back Accounts are not."""
+    from accounts.cache import account_pks
+    account_pks.clear()
@@ -3,6 +3,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework_swagger.views import get_swagger_view
 
+from utils.views import metrics
+
 swagger_view = get_swagger_view(title='double_entry API')
 
 
@@ -12,4 +14,5 @@ urlpatterns = [
     path('v1/', include('payments.urls', namespace='payments_v1')),
     url(r'v[0-9]+/', include('payments.urls', namespace='payments_v_')),
     path('swagger/', swagger_view, name='swagger'),
+    path('metrics', metrics, name='metrics'),
 ]
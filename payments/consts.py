@@ -0,0 +1,9 @@
+# Values of `settings.PAYMENTS_ENGINE`, see :meth:`payments.managers.PaymentManager.create_payment`
+PAYMENTS_ENGINE_LOCKING = 'locking'
+PAYMENTS_ENGINE_CONDITIONAL_UPDATE = 'conditional_update'
+
+# Values of `PaymentRequest.status`, see :meth:`payments.managers.PaymentRequestManager.process_batch`
+PAYMENT_REQUEST_PENDING = 'pending'
+PAYMENT_REQUEST_COMPLETED = 'completed'
+PAYMENT_REQUEST_FAILED = 'failed'
+PAYMENT_REQUEST_STATUSES = (PAYMENT_REQUEST_PENDING, PAYMENT_REQUEST_COMPLETED, PAYMENT_REQUEST_FAILED)
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.models import PaymentRequest
+
+
+class Command(BaseCommand):
+    help = 'Create queued payments in batches, see PAYMENTS_ASYNC setting.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.PAYMENTS_WORKER_BATCH_SIZE,
+                            help='Maximum number of payments created in a transaction.')
+        parser.add_argument('--poll-interval', type=float, default=settings.PAYMENTS_WORKER_POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty.')
+
+    def handle(self, *args, **options):
+        while True:
+            result = PaymentRequest.objects.process_batch(options['batch_size'])
+            if result is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+            if options['verbosity'] > 1:
+                self.stdout.write('Completed {}, failed {} payments.'.format(*result))
@@ -1,41 +1,47 @@
-from _pydecimal import Decimal
+import time
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
+from django.apps import apps
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, CharField, F, IntegerField, Q, Value, When
+from django.utils import timezone
 from django.utils.translation import gettext as _
 
+from accounts.cache import invalidate_on_commit
+from accounts.contention import lock_profiler
 from accounts.models import Account
+from payments.consts import (
+    PAYMENTS_ENGINE_CONDITIONAL_UPDATE, PAYMENT_REQUEST_PENDING, PAYMENT_REQUEST_COMPLETED, PAYMENT_REQUEST_FAILED,
+)
 from postings.models import Posting
+from utils.cache import LRUCache
+from utils.money import Money, to_decimal
+from utils.transactions import retry_on_conflict
+
+# Recently created Payments by idempotency key, so retries do not even query the database
+idempotency_cache = LRUCache(settings.IDEMPOTENCY_CACHE_SIZE, ttl=settings.IDEMPOTENCY_CACHE_TTL)
 
 
 class PaymentManager(models.Manager):
     """Custom Manager with ability to proper payment creation."""
 
-    @transaction.atomic
-    def create_payment(self, from_account_pk: int, to_account_pk: int, value: Decimal):
-        if from_account_pk == to_account_pk:
-            raise ValidationError('Unable to create payment for the same account', code='same_account')
-
-        # Order Accounts so that first returns `from_account`
-        order_by = 'pk' if from_account_pk < to_account_pk else '-pk'
-        # Lock both Accounts in same time to avoid race conditions.
-        # Also lock related Currency (just in case, for safety) although that not right really needed
-        # and can be skipped for performance.
+    @staticmethod
+    def validate_payment(from_account: Account, to_account: Account, value: Decimal):
+        """
+        Check that `value` can be transferred from `from_account` to `to_account`
 
-        accounts = Account.objects.filter(
-            pk__in=[from_account_pk, to_account_pk]
-        ).select_related('currency').select_for_update(of=['currency']).order_by(order_by)
-        accounts = list(accounts)
-        # Both Accounts must exists
-        if len(accounts) != 2:
-            raise Account.DoesNotExist
-        from_account, to_account = accounts
+        Accounts values are used as is, so Accounts must be locked by the caller. Shards of a sharded `to_account`
+        credited by its value must be folded first, so the overflow check covers the total of the Account.
 
+        :raises ValidationError: if payment is not allowed.
+        """
         if value <= 0:
             raise ValidationError(_('Payment value must be greater than zero'), code='invalid_value')
 
-        if from_account.currency != to_account.currency:
+        if from_account.currency_id != to_account.currency_id:
             raise ValidationError(_('Account currency must be the same.'), code='invalid_currency')
 
         if from_account.value < value:
@@ -44,15 +50,384 @@ class PaymentManager(models.Manager):
         if to_account.value + value > settings.AMOUNT_VALUE_MAX:
             raise ValidationError(_('Value overflow for an account {}').format(to_account), code='overflow')
 
+    @staticmethod
+    def balance_after(account: Account) -> Optional[Decimal]:
+        """
+        Return `account` balance to store in :attr:`postings.models.Posting.balance_after`
+
+        `account.value` must be already changed by the Posting and the Account must be locked.
+        Balance of a sharded Account is not known, as its shards are credited without the Account lock.
+        """
+        return None if account.shard_count else account.value
+
+    @retry_on_conflict
+    @transaction.atomic
+    def create_payment(self, from_account_pk: int, to_account_pk: int, value: Union[Decimal, Money],
+                       idempotency_key: str = None):
+        """
+        Transfer `value` from `from_account_pk` to `to_account_pk`
+
+        With `idempotency_key` a repeated call returns the Payment created by the first call instead of
+        creating another one. The key is looked up in :data:`idempotency_cache` and then by the unique index
+        before any Account is locked. A concurrent call with the same key fails on the unique index
+        (or on validation of Accounts changed by the winner) and returns the Payment of the winner.
+
+        :raises ValidationError: if payment is not allowed or `idempotency_key` is used for another payment.
+        """
+        value = to_decimal(value)
+        if idempotency_key is None:
+            return self._create_payment(from_account_pk, to_account_pk, value)
+
+        payment = idempotency_cache.get(idempotency_key) or self.filter(idempotency_key=idempotency_key).first()
+        if payment is None:
+            try:
+                with transaction.atomic():
+                    payment = self._create_payment(from_account_pk, to_account_pk, value, idempotency_key)
+            except (IntegrityError, ValidationError):
+                # A concurrent call with the same key may have been committed while Accounts were locked
+                payment = self.filter(idempotency_key=idempotency_key).first()
+                if payment is None:
+                    raise
+        if (payment.from_account_id, payment.to_account_id, payment.value) != (from_account_pk, to_account_pk, value):
+            raise ValidationError(_('Idempotency key is already used for another payment'),
+                                  code='idempotency_key_reused')
+        transaction.on_commit(lambda: idempotency_cache.set(idempotency_key, payment))
+        return payment
+
+    def _create_payment(self, from_account_pk: int, to_account_pk: int, value: Decimal, idempotency_key: str = None):
+        if from_account_pk == to_account_pk:
+            raise ValidationError('Unable to create payment for the same account', code='same_account')
+
+        if settings.PAYMENTS_ENGINE == PAYMENTS_ENGINE_CONDITIONAL_UPDATE:
+            return self._create_payment_conditional_update(from_account_pk, to_account_pk, value, idempotency_key)
+
+        # Lock both Accounts in same time to avoid race conditions.
+        # Rows are always locked in primary key order to avoid deadlocks between opposite payments.
+        # Related Currency is not locked: that is not really needed, and locking it together with Accounts
+        # makes concurrent payments deadlock on the shared Currency row.
+        # Sharded `to_account` is not locked, its shard is credited instead.
+
+        locked = Account.objects.filter(Q(pk=from_account_pk) | Q(pk=to_account_pk, shard_count=0))
+        profiler = lock_profiler()
+        if profiler is None:
+            accounts = {account.pk: account for account in locked.order_by('pk').select_for_no_key_update()}
+        else:
+            # Lock Accounts one by one to time each lock
+            accounts = {}
+            for pk in sorted((from_account_pk, to_account_pk)):
+                started = time.perf_counter()
+                accounts.update((account.pk, account) for account in locked.filter(pk=pk).select_for_no_key_update())
+                if pk in accounts:
+                    profiler.record(pk, time.perf_counter() - started)
+        if to_account_pk not in accounts:
+            accounts.update((account.pk, account) for account in Account.objects.filter(pk=to_account_pk))
+        # Both Accounts must exists
+        if len(accounts) != 2:
+            raise Account.DoesNotExist
+        from_account, to_account = accounts[from_account_pk], accounts[to_account_pk]
+
+        if from_account.shard_count and from_account.value < value:
+            Account.objects.fold_shards(from_account)
+
+        self.validate_payment(from_account, to_account, value)
+
         # Create Payment
-        payment = self.create(from_account=from_account, to_account=to_account, value=value)
+        payment = self.create(from_account=from_account, to_account=to_account, value=value,
+                              idempotency_key=idempotency_key)
+        from_account.value -= value
+        if not to_account.shard_count:
+            to_account.value += value
         # Create Postings
-        Posting.objects.create(payment=payment, account=from_account, value=-value)
-        Posting.objects.create(payment=payment, account=to_account, value=value)
+        Posting.objects.create(payment=payment, account=from_account, value=-value,
+                               balance_after=self.balance_after(from_account))
+        Posting.objects.create(payment=payment, account=to_account, value=value,
+                               balance_after=self.balance_after(to_account))
         # Change Account values accordingly
-        from_account.value -= value
         from_account.save(update_fields=['value'])
-        to_account.value += value
-        to_account.save(update_fields=['value'])
+        if to_account.shard_count:
+            Account.objects.credit_shard(to_account, value)
+        else:
+            to_account.save(update_fields=['value'])
+        invalidate_on_commit([from_account.name, to_account.name])
 
         return payment
+
+    def _create_payment_conditional_update(self, from_account_pk: int, to_account_pk: int, value: Decimal,
+                                           idempotency_key: str = None):
+        """
+        Create payment without explicit row locks
+
+        Account values are changed by guarded UPDATE statements, e.g.
+        `UPDATE ... SET value = value - %s WHERE id = %s AND value >= %s`, and the number of updated rows tells
+        whether the guard passed. Row locks are still taken by UPDATEs implicitly and held until commit,
+        so UPDATEs are issued in primary key order to avoid deadlocks. Neither Currency rows are locked
+        nor Account rows are read for update, except a sharded `from_account` without enough funds
+        outside of its shards.
+        Validation order differs from the locking engine: funds and overflow are checked in primary key order.
+        """
+        if value <= 0:
+            raise ValidationError(_('Payment value must be greater than zero'), code='invalid_value')
+
+        accounts = Account.objects.filter(
+            pk__in=[from_account_pk, to_account_pk]
+        ).only('name', 'currency', 'shard_count')
+        accounts = {account.pk: account for account in accounts}
+        # Both Accounts must exists
+        if len(accounts) != 2:
+            raise Account.DoesNotExist
+        from_account, to_account = accounts[from_account_pk], accounts[to_account_pk]
+
+        if from_account.currency_id != to_account.currency_id:
+            raise ValidationError(_('Account currency must be the same.'), code='invalid_currency')
+
+        profiler = lock_profiler()
+        balances = {}
+        for pk in sorted(accounts):
+            started = time.perf_counter()
+            if pk == from_account_pk:
+                balances[pk] = self._debit_conditional_update(from_account, value)
+            elif to_account.shard_count:
+                Account.objects.credit_shard(to_account, value)
+            else:
+                values = Account.objects.filter(
+                    pk=pk, value__lte=settings.AMOUNT_VALUE_MAX - value
+                ).update_returning_values(value=F('value') + value)
+                if not values:
+                    raise ValidationError(_('Value overflow for an account {}').format(to_account), code='overflow')
+                balances[pk] = values[0]
+            if profiler is not None:
+                profiler.record(pk, time.perf_counter() - started)
+
+        payment = self.create(from_account=from_account, to_account=to_account, value=value,
+                              idempotency_key=idempotency_key)
+        Posting.objects.bulk_create([
+            Posting(payment=payment, account=from_account, value=-value, balance_after=balances.get(from_account_pk)),
+            Posting(payment=payment, account=to_account, value=value, balance_after=balances.get(to_account_pk)),
+        ])
+        invalidate_on_commit([from_account.name, to_account.name])
+
+        return payment
+
+    @classmethod
+    def _debit_conditional_update(cls, account: Account, value: Decimal) -> Optional[Decimal]:
+        """Debit `account`, return its balance after the debit, see :meth:`balance_after`."""
+        values = Account.objects.filter(pk=account.pk, value__gte=value).update_returning_values(
+            value=F('value') - value
+        )
+        if values:
+            account.value = values[0]
+            return cls.balance_after(account)
+        if account.shard_count:
+            # Not enough funds outside of shards, so collect shards under the Account lock
+            account, = Account.objects.filter(pk=account.pk).select_for_no_key_update()
+            Account.objects.fold_shards(account)
+            if account.value >= value:
+                account.value -= value
+                account.save(update_fields=['value'])
+                return None
+        raise ValidationError(_('Insufficient funds for an account {}').format(account), code='no_funds')
+
+    @retry_on_conflict
+    @transaction.atomic
+    def create_transaction(self, legs: Iterable[Tuple[int, Union[Decimal, Money]]]):
+        """
+        Create a Payment with a Posting per leg, e.g. a transfer with a fee
+
+        All Accounts are locked by a single query ordered by primary key, so concurrent transactions
+        can not deadlock each other, and Postings are written by a single `bulk_create`. Credits to sharded
+        Accounts go to the Account value, since the Account is locked anyway, and its shards are folded first.
+        A Payment with a single debit and a single credit leg is the same as created by :meth:`create_payment`,
+        otherwise its `from_account` and `to_account` are empty.
+
+        :param legs: Iterable of `(account_pk, value)` tuples, negative values are debits, positive are credits.
+        :return: Created Payment, its value is the sum of credits.
+        :raises ValidationError: if the transaction is not allowed.
+        :raises Account.DoesNotExist: if any of Accounts does not exist.
+        """
+        legs = [(account_pk, to_decimal(value)) for account_pk, value in legs]
+        account_pks = {account_pk for account_pk, _value in legs}
+        if len(legs) < 2:
+            raise ValidationError(_('Transaction must have at least two legs'), code='invalid_legs')
+        if len(account_pks) != len(legs):
+            raise ValidationError(_('Transaction must have a single leg per account'), code='same_account')
+        if any(value == 0 for _account_pk, value in legs):
+            raise ValidationError(_('Leg value must not be zero'), code='invalid_value')
+        if sum(value for _account_pk, value in legs) != 0:
+            raise ValidationError(_('Leg values must sum to zero'), code='unbalanced')
+
+        accounts = Account.objects.filter(pk__in=account_pks).order_by('pk').select_for_no_key_update()
+        accounts = {account.pk: account for account in accounts}
+        if len(accounts) != len(account_pks):
+            raise Account.DoesNotExist
+        if len({account.currency_id for account in accounts.values()}) != 1:
+            raise ValidationError(_('Account currency must be the same.'), code='invalid_currency')
+
+        for account_pk, value in legs:
+            account = accounts[account_pk]
+            if account.shard_count and (value > 0 or account.value < -value):
+                Account.objects.fold_shards(account)
+            if account.value + value < 0:
+                raise ValidationError(_('Insufficient funds for an account {}').format(account), code='no_funds')
+            if account.value + value > settings.AMOUNT_VALUE_MAX:
+                raise ValidationError(_('Value overflow for an account {}').format(account), code='overflow')
+
+        debits = [accounts[account_pk] for account_pk, value in legs if value < 0]
+        credits = [accounts[account_pk] for account_pk, value in legs if value > 0]
+        payment = self.create(
+            from_account=debits[0] if len(debits) == 1 else None,
+            to_account=credits[0] if len(credits) == 1 else None,
+            value=sum(value for _account_pk, value in legs if value > 0),
+        )
+        for account_pk, value in legs:
+            accounts[account_pk].value += value
+        Posting.objects.bulk_create(
+            Posting(payment=payment, account=accounts[account_pk], value=value,
+                    balance_after=self.balance_after(accounts[account_pk]))
+            for account_pk, value in legs
+        )
+        for account_pk, _value in legs:
+            Account.objects.filter(pk=account_pk).update(value=accounts[account_pk].value)
+        invalidate_on_commit(account.name for account in accounts.values())
+
+        return payment
+
+    @retry_on_conflict
+    @transaction.atomic
+    def create_payments(self, transfers: Iterable[Tuple[int, int, Union[Decimal, Money]]],
+                        errors: Dict[int, ValidationError] = None) -> List:
+        """
+        Create many payments in a single database transaction
+
+        All involved Accounts are locked by a single query ordered by primary key, so concurrent batches
+        can not deadlock each other. Transfers are validated in memory one by one in the given order,
+        i.e. a transfer may spend funds received by a previous transfer of the same batch.
+        Payments and Postings are written with `bulk_create` and each Account is updated only once.
+        Credits to sharded Accounts go to the Account value, since the Account is locked anyway, and its shards
+        are folded first. Either all payments are created or none of them, unless `errors` is given.
+
+        :param transfers: Iterable of `(from_account_pk, to_account_pk, value)` tuples.
+        :param errors: If given, invalid transfers are skipped and their errors are stored by the transfer position.
+        :return: List of created payments in the order of `transfers`, `None` for skipped transfers.
+        :raises ValidationError: if any of transfers is invalid and `errors` is not given, `error_dict` is keyed
+            by the transfer position.
+        :raises Account.DoesNotExist: if any of Accounts does not exist.
+        """
+        transfers = [(from_pk, to_pk, to_decimal(value)) for from_pk, to_pk, value in transfers]
+        account_pks = {pk for from_pk, to_pk, _value in transfers for pk in (from_pk, to_pk)}
+        accounts = Account.objects.filter(pk__in=account_pks).order_by('pk').select_for_no_key_update()
+        accounts = {account.pk: account for account in accounts}
+        if len(accounts) != len(account_pks):
+            raise Account.DoesNotExist
+        initial_values = {pk: account.value for pk, account in accounts.items()}
+
+        payments = []
+        balances = []
+        folded = set()
+        for index, (from_pk, to_pk, value) in enumerate(transfers):
+            from_account, to_account = accounts[from_pk], accounts[to_pk]
+            try:
+                if from_pk == to_pk:
+                    raise ValidationError(_('Unable to create payment for the same account'), code='same_account')
+                if from_account.shard_count and from_account.value < value and from_pk not in folded:
+                    Account.objects.fold_shards(from_account)
+                    folded.add(from_pk)
+                if to_account.shard_count and to_pk not in folded:
+                    Account.objects.fold_shards(to_account)
+                    folded.add(to_pk)
+                self.validate_payment(from_account, to_account, value)
+            except ValidationError as exc:
+                if errors is None:
+                    raise ValidationError({index: exc})
+                errors[index] = exc
+                payments.append(None)
+                continue
+            from_account.value -= value
+            to_account.value += value
+            payments.append(self.model(from_account=from_account, to_account=to_account, value=value))
+            balances.append((self.balance_after(from_account), self.balance_after(to_account)))
+
+        # Primary keys are returned by `bulk_create` on PostgreSQL, so Postings can refer to Payments.
+        created = [payment for payment in payments if payment is not None]
+        self.bulk_create(created)
+        Posting.objects.bulk_create(
+            Posting(payment=payment, account=account, value=value, balance_after=balance_after)
+            for payment, (from_balance, to_balance) in zip(created, balances)
+            for account, value, balance_after in (
+                (payment.from_account, -payment.value, from_balance),
+                (payment.to_account, payment.value, to_balance),
+            )
+        )
+        for pk, account in accounts.items():
+            if account.value != initial_values[pk]:
+                Account.objects.filter(pk=pk).update(value=account.value)
+        invalidate_on_commit(account.name for pk, account in accounts.items() if account.value != initial_values[pk])
+
+        return payments
+
+
+class PaymentRequestManager(models.Manager):
+    """Custom Manager with ability to queue payments and process them in batches."""
+
+    def enqueue(self, from_account_pk: int, to_account_pk: int, value: Decimal, idempotency_key: str = None):
+        """
+        Queue a payment to be created by :meth:`process_batch`
+
+        A repeated call with the same `idempotency_key` returns the already queued request.
+        """
+        if idempotency_key is not None:
+            payment_request = self.filter(idempotency_key=idempotency_key).first()
+            if payment_request is not None:
+                return payment_request
+        try:
+            with transaction.atomic():
+                return self.create(from_account_id=from_account_pk, to_account_id=to_account_pk, value=value,
+                                   idempotency_key=idempotency_key)
+        except IntegrityError:
+            payment_request = self.filter(idempotency_key=idempotency_key).first() if idempotency_key else None
+            if payment_request is None:
+                raise
+            return payment_request
+
+    @retry_on_conflict
+    @transaction.atomic
+    def process_batch(self, size: int) -> Optional[Tuple[int, int]]:
+        """
+        Create Payments of up to `size` oldest pending requests in a single transaction
+
+        Requests are locked with `SKIP LOCKED`, so several workers take different batches, while a single
+        worker applies requests strictly in the queued order. Payments are created by
+        :meth:`PaymentManager.create_payments`, i.e. with a single ordered lock of all involved Accounts.
+        Invalid requests are marked as failed and do not affect other requests of the batch.
+        All requests are marked by a single UPDATE.
+
+        :return: numbers of completed and failed requests, `None` if there are no pending requests.
+        """
+        requests = list(
+            self.filter(status=PAYMENT_REQUEST_PENDING).order_by('pk').select_for_update(skip_locked=True)[:size]
+        )
+        if not requests:
+            return None
+
+        errors = {}
+        payments = apps.get_model('payments', 'Payment').objects.create_payments(
+            ((request.from_account_id, request.to_account_id, request.value) for request in requests),
+            errors=errors,
+        )
+
+        status, payment_id, error_code, error_message = [], [], [], []
+        for index, (request, payment) in enumerate(zip(requests, payments)):
+            if payment is None:
+                status.append(When(pk=request.pk, then=Value(PAYMENT_REQUEST_FAILED)))
+                error_code.append(When(pk=request.pk, then=Value(errors[index].code)))
+                error_message.append(When(pk=request.pk, then=Value(errors[index].message)))
+            else:
+                status.append(When(pk=request.pk, then=Value(PAYMENT_REQUEST_COMPLETED)))
+                payment_id.append(When(pk=request.pk, then=Value(payment.pk)))
+        self.filter(pk__in=[request.pk for request in requests]).update(
+            status=Case(*status, output_field=CharField()),
+            payment_id=Case(*payment_id, output_field=IntegerField()),
+            error_code=Case(*error_code, output_field=CharField()),
+            error_message=Case(*error_message, output_field=CharField()),
+            processed=timezone.now(),
+        )
+        return len(requests) - len(errors), len(errors)
@@ -3,10 +3,12 @@ from decimal import Decimal
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 
 from accounts.models import Account
-from payments.managers import PaymentManager
-from utils.models import AmountField
+from payments.consts import PAYMENT_REQUEST_STATUSES, PAYMENT_REQUEST_PENDING
+from payments.managers import PaymentManager, PaymentRequestManager
+from utils.models import AmountField, DefaultCharField
 
 
 class Payment(models.Model):
@@ -23,16 +25,66 @@ class Payment(models.Model):
      - In a real project, this model is better renamed and treated as a transaction.
      - This model denormalize database schema for simplicity and performance.
 
+    Attributes
+
+     - from_account (:class:`accounts.models.Account`): Source Account, empty if there are several debit
+       Postings, see :meth:`payments.managers.PaymentManager.create_transaction`.
+     - to_account (:class:`accounts.models.Account`): Destination Account, empty if there are several credit
+       Postings.
+     - value (`Decimal`): Transferred amount, i.e. the sum of credit Postings. Must be greater than zero.
+     - created (`datetime`): Creation time.
+     - idempotency_key (str): Client provided key, repeated requests with the same key return this Payment.
+
+    """
+
+    from_account = models.ForeignKey(Account, null=True, related_name='payments_from', on_delete=models.CASCADE)
+    to_account = models.ForeignKey(Account, null=True, related_name='payments_to', on_delete=models.CASCADE)
+    value = AmountField(validators=[MinValueValidator(Decimal(1)/(10**settings.AMOUNT_DECIMAL_PLACES))])
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    idempotency_key = DefaultCharField(unique=True, null=True, editable=False)
+
+    objects = PaymentManager()
+
+
+class PaymentRequest(models.Model):
+    """
+    Represents a queued payment
+
+    With `settings.PAYMENTS_ASYNC` the API stores payment requests instead of creating Payments,
+    and `run_payment_worker` management command creates Payments in batches,
+    see :meth:`payments.managers.PaymentRequestManager.process_batch`.
+
     Attributes
 
      - from_account (:class:`accounts.models.Account`): Source Account.
      - to_account (:class:`accounts.models.Account`): Destination Account.
-     - value (`Decimal`): Transferred amount. Must be greater than zero.
+     - value (`Decimal`): Amount to transfer.
+     - status (str): `pending`, `completed` or `failed`.
+     - payment (:class:`Payment`): Created Payment of a completed request.
+     - error_code (str): Validation error code of a failed request, e.g. `no_funds`.
+     - error_message (str): Validation error message of a failed request.
+     - idempotency_key (str): Client provided key, repeated requests with the same key return this request.
+     - created (`datetime`): Creation time.
+     - processed (`datetime`): Time the request was completed or failed.
 
     """
 
-    from_account = models.ForeignKey(Account, related_name='payments_from', on_delete=models.CASCADE)
-    to_account = models.ForeignKey(Account, related_name='payments_to', on_delete=models.CASCADE)
+    from_account = models.ForeignKey(Account, related_name='payment_requests_from', on_delete=models.CASCADE)
+    to_account = models.ForeignKey(Account, related_name='payment_requests_to', on_delete=models.CASCADE)
     value = AmountField(validators=[MinValueValidator(Decimal(1)/(10**settings.AMOUNT_DECIMAL_PLACES))])
+    status = models.CharField(max_length=16, choices=[(status, status) for status in PAYMENT_REQUEST_STATUSES],
+                              default=PAYMENT_REQUEST_PENDING, editable=False)
+    payment = models.OneToOneField(Payment, null=True, related_name='payment_request', on_delete=models.SET_NULL,
+                                   editable=False)
+    error_code = models.CharField(max_length=32, null=True, editable=False)
+    error_message = models.TextField(null=True, editable=False)
+    idempotency_key = DefaultCharField(unique=True, null=True, editable=False)
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    processed = models.DateTimeField(null=True, editable=False)
 
-    objects = PaymentManager()
+    objects = PaymentRequestManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='payment_requests_status_id'),
+        ]
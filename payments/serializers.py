@@ -1,26 +1,213 @@
+from django.conf import settings
 from django.core import exceptions
+from django.db import IntegrityError
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError, ErrorDetail
 
+from accounts.cache import account_pks, resolve_account_pks
 from accounts.models import Account
-from payments.models import Payment
+from accounts.serializers import AccountNameField
+from payments.models import Payment, PaymentRequest
+from postings import export
+from utils.serializers import AmountField, TimedSerializerMixin
 
 
-class PaymentSerializer(serializers.ModelSerializer):
-    from_account = serializers.SlugRelatedField(slug_field='name', queryset=Account.objects.all())
-    to_account = serializers.SlugRelatedField(slug_field='name', queryset=Account.objects.all())
+class PaymentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Account names are resolved by cache, so Accounts are read only by :meth:`PaymentManager.create_payment`."""
+
+    from_account = AccountNameField()
+    to_account = AccountNameField()
 
     class Meta:
         model = Payment
-        fields = '__all__'
+        exclude = ['idempotency_key']
+
+    default_error_messages = {
+        'account_does_not_exist': 'Account does not exist.',
+    }
 
     def create(self, validated_data):
         try:
             instance = Payment.objects.create_payment(
-                from_account_pk=validated_data['from_account'].pk,
-                to_account_pk=validated_data['to_account'].pk,
+                from_account_pk=validated_data['from_account'],
+                to_account_pk=validated_data['to_account'],
                 value=validated_data['value'],
+                idempotency_key=validated_data.get('idempotency_key'),
             )
         except exceptions.ValidationError as exc:
             raise ValidationError(dict(non_field_errors=[ErrorDetail(exc.message, code=exc.code)]))
+        except Account.DoesNotExist:
+            # Account was deleted after its primary key had been cached
+            account_pks.clear()
+            raise ValidationError(dict(non_field_errors=[
+                ErrorDetail(self.error_messages['account_does_not_exist'], code='does_not_exist')
+            ]))
         return instance
+
+
+class PaymentRequestSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Queues a payment, see :meth:`payments.managers.PaymentRequestManager.enqueue`."""
+
+    url = serializers.HyperlinkedIdentityField(view_name='payment-requests-detail')
+    from_account = AccountNameField()
+    to_account = AccountNameField()
+
+    class Meta:
+        model = PaymentRequest
+        exclude = ['idempotency_key']
+
+    default_error_messages = {
+        'account_does_not_exist': 'Account does not exist.',
+    }
+
+    def create(self, validated_data):
+        try:
+            return PaymentRequest.objects.enqueue(
+                from_account_pk=validated_data['from_account'],
+                to_account_pk=validated_data['to_account'],
+                value=validated_data['value'],
+                idempotency_key=validated_data.get('idempotency_key'),
+            )
+        except IntegrityError:
+            # Account was deleted after its primary key had been cached
+            account_pks.clear()
+            raise ValidationError(dict(non_field_errors=[
+                ErrorDetail(self.error_messages['account_does_not_exist'], code='does_not_exist')
+            ]))
+
+
+class PaymentBatchItemSerializer(PaymentSerializer):
+    """Batch item, Account names are resolved by :class:`PaymentBatchSerializer` for the whole batch at once."""
+
+    from_account = serializers.CharField()
+    to_account = serializers.CharField()
+
+
+class PaymentBatchSerializer(TimedSerializerMixin, serializers.Serializer):
+    """
+    Creates many Payments in a single transaction
+
+    See :meth:`payments.managers.PaymentManager.create_payments`.
+    """
+
+    payments = PaymentBatchItemSerializer(many=True, allow_empty=False)
+
+    default_error_messages = {
+        'max_length': 'Ensure this field has no more than {max_length} elements.',
+        'does_not_exist': 'Object with name={value} does not exist.',
+        'account_does_not_exist': 'Account does not exist.',
+    }
+
+    def validate_payments(self, value):
+        if len(value) > settings.PAYMENTS_BATCH_MAX_SIZE:
+            self.fail('max_length', max_length=settings.PAYMENTS_BATCH_MAX_SIZE)
+
+        # Resolve all Account names by cache and a single query
+        account_pks = resolve_account_pks({item[field] for item in value for field in ('from_account', 'to_account')})
+
+        errors = {}
+        for index, item in enumerate(value):
+            for field in ('from_account', 'to_account'):
+                if item[field] not in account_pks:
+                    errors.setdefault(index, {})[field] = [ErrorDetail(
+                        self.error_messages['does_not_exist'].format(value=item[field]), code='does_not_exist'
+                    )]
+        if errors:
+            raise ValidationError(errors)
+
+        return [
+            dict(item, from_account=account_pks[item['from_account']], to_account=account_pks[item['to_account']])
+            for item in value
+        ]
+
+    def create(self, validated_data):
+        try:
+            payments = Payment.objects.create_payments(
+                (item['from_account'], item['to_account'], item['value']) for item in validated_data['payments']
+            )
+        except exceptions.ValidationError as exc:
+            raise ValidationError(dict(payments={
+                index: dict(non_field_errors=[ErrorDetail(error.message, code=error.code) for error in errors])
+                for index, errors in exc.error_dict.items()
+            }))
+        except Account.DoesNotExist:
+            # Account was deleted after validation or after its primary key had been cached
+            account_pks.clear()
+            raise ValidationError(dict(non_field_errors=[
+                ErrorDetail(self.error_messages['account_does_not_exist'], code='does_not_exist')
+            ]))
+        return dict(payments=payments)
+
+    def to_representation(self, instance):
+        return dict(payments=PaymentSerializer(instance['payments'], many=True).data)
+
+
+class TransactionLegSerializer(serializers.Serializer):
+    """Transaction leg, negative `value` is a debit, positive is a credit."""
+
+    account = serializers.CharField()
+    value = AmountField()
+
+
+class TransactionSerializer(TimedSerializerMixin, serializers.Serializer):
+    """
+    Creates a Payment with many legs, e.g. a transfer with a fee
+
+    See :meth:`payments.managers.PaymentManager.create_transaction`.
+    """
+
+    legs = TransactionLegSerializer(many=True, allow_empty=False)
+
+    default_error_messages = {
+        'max_length': 'Ensure this field has no more than {max_length} elements.',
+        'does_not_exist': 'Object with name={value} does not exist.',
+        'account_does_not_exist': 'Account does not exist.',
+    }
+
+    def validate_legs(self, value):
+        if len(value) > settings.PAYMENTS_TRANSACTION_MAX_LEGS:
+            self.fail('max_length', max_length=settings.PAYMENTS_TRANSACTION_MAX_LEGS)
+
+        account_pks = resolve_account_pks({leg['account'] for leg in value})
+        errors = {
+            index: dict(account=[ErrorDetail(
+                self.error_messages['does_not_exist'].format(value=leg['account']), code='does_not_exist'
+            )])
+            for index, leg in enumerate(value) if leg['account'] not in account_pks
+        }
+        if errors:
+            raise ValidationError(errors)
+
+        return [dict(leg, account_pk=account_pks[leg['account']]) for leg in value]
+
+    def create(self, validated_data):
+        try:
+            return Payment.objects.create_transaction(
+                (leg['account_pk'], leg['value']) for leg in validated_data['legs']
+            )
+        except exceptions.ValidationError as exc:
+            raise ValidationError(dict(non_field_errors=[ErrorDetail(exc.message, code=exc.code)]))
+        except Account.DoesNotExist:
+            # Account was deleted after validation or after its primary key had been cached
+            account_pks.clear()
+            raise ValidationError(dict(non_field_errors=[
+                ErrorDetail(self.error_messages['account_does_not_exist'], code='does_not_exist')
+            ]))
+
+    def to_representation(self, instance):
+        return dict(
+            id=instance.pk,
+            value=AmountField().to_representation(instance.value),
+            created=serializers.DateTimeField().to_representation(instance.created),
+            legs=[
+                dict(account=leg['account'], value=AmountField().to_representation(leg['value']))
+                for leg in self.validated_data['legs']
+            ],
+        )
+
+
+class ExportSerializer(serializers.Serializer):
+    """Validates ledger export query parameters."""
+
+    kind = serializers.ChoiceField(choices=list(export.COLUMNS), default=export.KIND_POSTINGS)
+    output = serializers.ChoiceField(choices=list(export.RENDERERS), default=export.FORMAT_NDJSON)
@@ -0,0 +1,105 @@
+import random
+import threading
+from decimal import Decimal
+
+import pytest
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import override_settings
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from payments.consts import PAYMENTS_ENGINE_LOCKING, PAYMENTS_ENGINE_CONDITIONAL_UPDATE
+from payments.managers import idempotency_cache
+from payments.models import Payment
+from postings.models import Posting
+
+THREADS = 8
+PAYMENTS_PER_THREAD = 25
+ACCOUNTS = 4
+INITIAL_VALUE = Decimal('10')
+
+
+def make_payments(account_pks, seed, errors):
+    rnd = random.Random(seed)
+    try:
+        for _ in range(PAYMENTS_PER_THREAD):
+            from_pk, to_pk = rnd.sample(account_pks, 2)
+            try:
+                Payment.objects.create_payment(
+                    from_account_pk=from_pk, to_account_pk=to_pk, value=Decimal(rnd.randint(1, 500)) / 100
+                )
+            except ValidationError as exc:
+                # Insufficient funds is expected, anything else is a failure
+                if exc.code != 'no_funds':
+                    errors.append(exc)
+    except Exception as exc:  # pylint: disable=broad-except
+        errors.append(exc)
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('engine', (PAYMENTS_ENGINE_LOCKING, PAYMENTS_ENGINE_CONDITIONAL_UPDATE))
+@pytest.mark.django_db(transaction=True)
+def test_create_payment_concurrent(engine):
+    """Concurrent payments between few Accounts must neither lose nor create money."""
+    currency = mommy.make(Currency)
+    accounts = mommy.make(Account, currency=currency, value=INITIAL_VALUE, _quantity=ACCOUNTS)
+    # One of Accounts is hot
+    Account.objects.set_shard_count(accounts[0].pk, 2)
+    account_pks = [account.pk for account in accounts]
+
+    errors = []
+    with override_settings(PAYMENTS_ENGINE=engine):
+        threads = [
+            threading.Thread(target=make_payments, args=(account_pks, seed, errors)) for seed in range(THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert not errors
+    assert Payment.objects.exists()
+    accounts = Account.objects.with_balance()
+    assert sum(account.balance for account in accounts) == INITIAL_VALUE * ACCOUNTS
+    for account in accounts:
+        assert account.value >= 0
+        postings_sum = Posting.objects.filter(account=account).aggregate(sum=Sum('value'))['sum'] or 0
+        assert account.balance == INITIAL_VALUE + postings_sum
+
+
+@pytest.mark.parametrize('engine', (PAYMENTS_ENGINE_LOCKING, PAYMENTS_ENGINE_CONDITIONAL_UPDATE))
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_idempotency_key(engine):
+    currency = mommy.make(Currency)
+    from_account = mommy.make(Account, currency=currency, value=Decimal('1'))
+    to_account = mommy.make(Account, currency=currency, value=Decimal('0'))
+    # Only one payment can be made, so the second call also fails validation if it is not deduplicated
+    created, commit = threading.Event(), threading.Event()
+    payments = []
+
+    def first():
+        try:
+            with transaction.atomic():
+                payments.append(Payment.objects.create_payment(from_account.pk, to_account.pk, Decimal('1'), 'key'))
+                created.set()
+                commit.wait(5)
+        finally:
+            connection.close()
+
+    with override_settings(PAYMENTS_ENGINE=engine):
+        idempotency_cache.clear()
+        thread = threading.Thread(target=first)
+        thread.start()
+        assert created.wait(5)
+        # The second call waits for the first transaction on Account locks or the unique index
+        threading.Timer(0.5, commit.set).start()
+        payment = Payment.objects.create_payment(from_account.pk, to_account.pk, Decimal('1'), 'key')
+        thread.join()
+
+    assert payment.pk == payments[0].pk
+    assert Payment.objects.count() == 1
+    from_account.refresh_from_db()
+    assert from_account.value == Decimal('0')
@@ -4,11 +4,18 @@ import pytest
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db.models import Sum
+from django.test import override_settings
 from model_mommy import mommy
 
 from accounts.models import Account, Currency
-from payments.models import Payment
+from payments.consts import (
+    PAYMENTS_ENGINE_LOCKING, PAYMENTS_ENGINE_CONDITIONAL_UPDATE, PAYMENT_REQUEST_COMPLETED, PAYMENT_REQUEST_FAILED,
+    PAYMENT_REQUEST_PENDING,
+)
+from payments.managers import idempotency_cache
+from payments.models import Payment, PaymentRequest
 from postings.models import Posting
+from utils.money import Money
 
 
 @pytest.mark.django_db(transaction=True)  # Note: Testing transactions
@@ -87,3 +94,326 @@ def test_create_payment_same_account():
             from_account_pk=from_account.pk, to_account_pk=from_account.pk, value=Decimal('0.01')
         )
     assert exc_info.value.code == 'same_account'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_payments(django_assert_num_queries):
+    currency = mommy.make(Currency)
+    account_a = mommy.make(Account, currency=currency, value=Decimal('100'))
+    account_b = mommy.make(Account, currency=currency, value=Decimal('0'))
+    account_c = mommy.make(Account, currency=currency, value=Decimal('0'))
+
+    transfers = [
+        (account_a.pk, account_b.pk, Decimal('60')),
+        (account_b.pk, account_c.pk, Decimal('50')),  # Spends funds received in the same batch
+        (account_a.pk, account_c.pk, Decimal('40')),
+    ]
+    # Lock, Payments insert, Postings insert and an update per Account, transaction savepoints are not used.
+    with django_assert_num_queries(6):
+        payments = Payment.objects.create_payments(transfers)
+
+    assert [(p.from_account_id, p.to_account_id, p.value) for p in payments] == transfers
+    assert Posting.objects.count() == 6
+    for payment in payments:
+        assert payment.postings.aggregate(sum=Sum('value'))['sum'] == 0
+
+    for account, value in ((account_a, Decimal('0')), (account_b, Decimal('10')), (account_c, Decimal('90'))):
+        account.refresh_from_db()
+        assert account.value == value
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_payments_fail():
+    currency = mommy.make(Currency)
+    account_a = mommy.make(Account, currency=currency, value=Decimal('100'))
+    account_b = mommy.make(Account, currency=currency, value=Decimal('0'))
+
+    with pytest.raises(ValidationError) as exc_info:
+        Payment.objects.create_payments([
+            (account_a.pk, account_b.pk, Decimal('60')),
+            (account_a.pk, account_b.pk, Decimal('60')),
+        ])
+    assert list(exc_info.value.error_dict) == [1]
+    assert exc_info.value.error_dict[1][0].code == 'no_funds'
+
+    # Nothing is created
+    assert not Payment.objects.exists()
+    account_a.refresh_from_db()
+    assert account_a.value == Decimal('100')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_payments_errors():
+    currency = mommy.make(Currency)
+    account_a = mommy.make(Account, currency=currency, value=Decimal('100'))
+    account_b = mommy.make(Account, currency=currency, value=Decimal('0'))
+
+    errors = {}
+    payments = Payment.objects.create_payments([
+        (account_a.pk, account_b.pk, Decimal('60')),
+        (account_a.pk, account_b.pk, Decimal('60')),
+        (account_a.pk, account_b.pk, Decimal('40')),
+    ], errors=errors)
+    assert payments[1] is None
+    assert [payment.value for payment in payments if payment] == [Decimal('60'), Decimal('40')]
+    assert list(errors) == [1]
+    assert errors[1].code == 'no_funds'
+
+    assert Payment.objects.count() == 2
+    account_a.refresh_from_db()
+    assert account_a.value == Decimal('0')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_process_payment_requests(django_assert_num_queries):
+    currency = mommy.make(Currency)
+    account_a = mommy.make(Account, currency=currency, value=Decimal('100'))
+    account_b = mommy.make(Account, currency=currency, value=Decimal('0'))
+    requests = [
+        PaymentRequest.objects.enqueue(account_a.pk, account_b.pk, Decimal('60')),
+        PaymentRequest.objects.enqueue(account_a.pk, account_b.pk, Decimal('60')),
+        PaymentRequest.objects.enqueue(account_b.pk, account_a.pk, Decimal('10'), idempotency_key='key'),
+    ]
+    # Repeated request is not queued
+    assert PaymentRequest.objects.enqueue(account_b.pk, account_a.pk, Decimal('10'), 'key') == requests[2]
+
+    # Requests lock, savepoint, Accounts lock, Payments insert, Postings insert, an update per Account,
+    # savepoint release and requests update
+    with django_assert_num_queries(9):
+        assert PaymentRequest.objects.process_batch(2) == (1, 1)
+    assert PaymentRequest.objects.process_batch(2) == (1, 0)
+    assert PaymentRequest.objects.process_batch(2) is None
+
+    for request in requests:
+        request.refresh_from_db()
+        assert request.processed is not None
+    assert [request.status for request in requests] == [
+        PAYMENT_REQUEST_COMPLETED, PAYMENT_REQUEST_FAILED, PAYMENT_REQUEST_COMPLETED,
+    ]
+    assert requests[0].payment.value == Decimal('60')
+    assert requests[1].payment is None
+    assert requests[1].error_code == 'no_funds'
+    assert requests[1].error_message == 'Insufficient funds for an account {}'.format(account_a)
+    assert requests[2].error_code is None
+
+    account_a.refresh_from_db()
+    assert account_a.value == Decimal('50')
+    assert not PaymentRequest.objects.filter(status=PAYMENT_REQUEST_PENDING).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_payment_money():
+    currency = mommy.make(Currency)
+    from_account = mommy.make(Account, currency=currency, value=Decimal('1'))
+    to_account = mommy.make(Account, currency=currency, value=Decimal('0'))
+
+    payment = Payment.objects.create_payment(
+        from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=Money.from_decimal('0.25')
+    )
+
+    payment.refresh_from_db()
+    assert payment.value == Decimal('0.25')
+    to_account.refresh_from_db()
+    assert to_account.value == Decimal('0.25')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_payment_idempotency_key(django_assert_num_queries):
+    currency = mommy.make(Currency)
+    from_account = mommy.make(Account, currency=currency, value=Decimal('10'))
+    to_account = mommy.make(Account, currency=currency, value=Decimal('0'))
+    idempotency_cache.clear()
+
+    payment = Payment.objects.create_payment(from_account.pk, to_account.pk, Decimal('1'), idempotency_key='key')
+    # Retry is served by the cache
+    with django_assert_num_queries(0):
+        assert Payment.objects.create_payment(from_account.pk, to_account.pk, Decimal('1'), 'key') == payment
+    # Then by the unique index, no Account is locked
+    idempotency_cache.clear()
+    with django_assert_num_queries(1):
+        assert Payment.objects.create_payment(from_account.pk, to_account.pk, Decimal('1'), 'key') == payment
+
+    with pytest.raises(ValidationError) as exc_info:
+        Payment.objects.create_payment(from_account.pk, to_account.pk, Decimal('2'), idempotency_key='key')
+    assert exc_info.value.code == 'idempotency_key_reused'
+
+    assert Payment.objects.count() == 1
+    from_account.refresh_from_db()
+    assert from_account.value == Decimal('9')
+
+
+@pytest.mark.parametrize('from_value,to_value,value,exc_code', (
+    (Decimal('99'), Decimal('0.01'), Decimal('100'), 'no_funds'),
+    (settings.AMOUNT_VALUE_MAX, Decimal('0.01'), settings.AMOUNT_VALUE_MAX, 'overflow'),
+))
+@pytest.mark.django_db(transaction=True)
+@override_settings(PAYMENTS_ENGINE=PAYMENTS_ENGINE_CONDITIONAL_UPDATE)
+def test_create_payment_conditional_update_fail(from_value, to_value, value, exc_code):
+    currency = mommy.make(Currency)
+    from_account = mommy.make(Account, currency=currency, value=from_value)
+    to_account = mommy.make(Account, currency=currency, value=to_value)
+
+    with pytest.raises(ValidationError) as exc_info:
+        Payment.objects.create_payment(from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=value)
+    assert exc_info.value.code == exc_code
+
+    # Nothing is changed
+    assert not Payment.objects.exists()
+    from_account.refresh_from_db()
+    assert from_account.value == from_value
+    to_account.refresh_from_db()
+    assert to_account.value == to_value
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(PAYMENTS_ENGINE=PAYMENTS_ENGINE_CONDITIONAL_UPDATE)
+def test_create_payment_conditional_update(django_assert_num_queries):
+    currency = mommy.make(Currency)
+    from_account = mommy.make(Account, currency=currency, value=Decimal('100'))
+    to_account = mommy.make(Account, currency=currency, value=Decimal('0'))
+
+    # Accounts select, two updates, Payment and Postings inserts
+    with django_assert_num_queries(5):
+        payment = Payment.objects.create_payment(
+            from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=Decimal('40')
+        )
+
+    assert payment.postings.aggregate(sum=Sum('value'))['sum'] == 0
+    from_account.refresh_from_db()
+    assert from_account.value == Decimal('60')
+    to_account.refresh_from_db()
+    assert to_account.value == Decimal('40')
+
+
+@pytest.mark.parametrize('engine', (PAYMENTS_ENGINE_LOCKING, PAYMENTS_ENGINE_CONDITIONAL_UPDATE))
+@pytest.mark.django_db(transaction=True)
+def test_create_payment_sharded(engine):
+    currency = mommy.make(Currency)
+    merchant = mommy.make(Account, currency=currency, value=Decimal('0'))
+    merchant = Account.objects.set_shard_count(merchant.pk, 3)
+    customer = mommy.make(Account, currency=currency, value=Decimal('10'))
+
+    with override_settings(PAYMENTS_ENGINE=engine):
+        for _ in range(5):
+            Payment.objects.create_payment(from_account_pk=customer.pk, to_account_pk=merchant.pk, value=Decimal('2'))
+        # Credits went to shards
+        merchant.refresh_from_db()
+        assert merchant.value == Decimal('0')
+        assert Account.objects.with_balance().get(pk=merchant.pk).balance == Decimal('10')
+
+        # Debit collects shards
+        Payment.objects.create_payment(from_account_pk=merchant.pk, to_account_pk=customer.pk, value=Decimal('7'))
+        merchant.refresh_from_db()
+        assert merchant.value == Decimal('3')
+        assert not merchant.shards.exclude(value=0).exists()
+
+        with pytest.raises(ValidationError) as exc_info:
+            Payment.objects.create_payment(
+                from_account_pk=merchant.pk, to_account_pk=customer.pk, value=Decimal('4')
+            )
+        assert exc_info.value.code == 'no_funds'
+
+
+@pytest.mark.django_db
+@override_settings(AMOUNT_VALUE_MAX=Decimal('10'))
+def test_credit_sharded_overflow():
+    currency = mommy.make(Currency)
+    merchant = Account.objects.set_shard_count(mommy.make(Account, currency=currency, value=Decimal('4')).pk, 2)
+    customer = mommy.make(Account, currency=currency, value=Decimal('10'))
+    merchant.shards.update(value=Decimal('2.9999'))
+
+    # Locked credits fold shards, so the total is checked
+    with pytest.raises(ValidationError) as exc_info:
+        Payment.objects.create_transaction([(customer.pk, Decimal('-0.5')), (merchant.pk, Decimal('0.5'))])
+    assert exc_info.value.code == 'overflow'
+    errors = {}
+    assert Payment.objects.create_payments([(customer.pk, merchant.pk, Decimal('0.5'))], errors=errors) == [None]
+    assert errors[0].code == 'overflow'
+
+    Payment.objects.create_payments([(customer.pk, merchant.pk, Decimal('0.0001'))] * 2)
+    merchant.refresh_from_db()
+    assert merchant.value == Decimal('10')
+    assert not merchant.shards.exclude(value=0).exists()
+
+@pytest.mark.parametrize('engine', (PAYMENTS_ENGINE_LOCKING, PAYMENTS_ENGINE_CONDITIONAL_UPDATE))
+@pytest.mark.django_db(transaction=True)
+def test_create_payment_balance_after(engine):
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, currency=currency, value=Decimal('0'))
+    merchant = Account.objects.set_shard_count(mommy.make(Account, currency=currency, value=Decimal('0')).pk, 2)
+
+    with override_settings(PAYMENTS_ENGINE=engine):
+        for from_account, to_account, value in ((bob, alice, '10'), (alice, bob, '3'), (bob, merchant, '5')):
+            Payment.objects.create_payment(
+                from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=Decimal(value),
+            )
+
+    # Balance of a sharded Account is not known
+    assert list(Posting.objects.order_by('pk').values_list('account_id', 'balance_after')) == [
+        (bob.pk, Decimal('90')), (alice.pk, Decimal('10')),
+        (alice.pk, Decimal('7')), (bob.pk, Decimal('93')),
+        (bob.pk, Decimal('88')), (merchant.pk, None),
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_payments_balance_after():
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, currency=currency, value=Decimal('0'))
+
+    Payment.objects.create_payments([
+        (bob.pk, alice.pk, Decimal('10')), (alice.pk, bob.pk, Decimal('3')), (bob.pk, alice.pk, Decimal('5')),
+    ])
+
+    assert list(Posting.objects.order_by('pk').values_list('account_id', 'balance_after')) == [
+        (bob.pk, Decimal('90')), (alice.pk, Decimal('10')),
+        (alice.pk, Decimal('7')), (bob.pk, Decimal('93')),
+        (bob.pk, Decimal('88')), (alice.pk, Decimal('12')),
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_transaction(django_assert_num_queries):
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, currency=currency, value=Decimal('0'))
+    bank = mommy.make(Account, currency=currency, value=Decimal('0'))
+
+    # Lock, Payment insert, Postings insert and an update per Account
+    with django_assert_num_queries(6):
+        payment = Payment.objects.create_transaction([
+            (bob.pk, Decimal('-10.5')), (alice.pk, Decimal('10')), (bank.pk, Decimal('0.5')),
+        ])
+
+    assert (payment.from_account, payment.to_account, payment.value) == (bob, None, Decimal('10.5'))
+    assert sorted(payment.postings.values_list('account_id', 'value')) == sorted([
+        (bob.pk, Decimal('-10.5')), (alice.pk, Decimal('10')), (bank.pk, Decimal('0.5')),
+    ])
+    for account, value in ((bob, Decimal('89.5')), (alice, Decimal('10')), (bank, Decimal('0.5'))):
+        account.refresh_from_db()
+        assert account.value == value
+        assert payment.postings.get(account=account).balance_after == value
+
+
+@pytest.mark.parametrize('legs,exc_code', (
+    ([(0, '-1')], 'invalid_legs'),
+    ([(0, '-1'), (0, '1')], 'same_account'),
+    ([(0, '0'), (1, '0')], 'invalid_value'),
+    ([(0, '-1'), (1, '0.5')], 'unbalanced'),
+    ([(0, '-101'), (1, '101')], 'no_funds'),
+    ([(1, '-1'), (2, '1')], 'invalid_currency'),
+))
+@pytest.mark.django_db(transaction=True)
+def test_create_transaction_fail(legs, exc_code):
+    currency = mommy.make(Currency)
+    accounts = [
+        mommy.make(Account, currency=currency, value=Decimal('100')),
+        mommy.make(Account, currency=currency, value=Decimal('100')),
+        mommy.make(Account, value=Decimal('100')),
+    ]
+    with pytest.raises(ValidationError) as exc_info:
+        Payment.objects.create_transaction((accounts[index].pk, Decimal(value)) for index, value in legs)
+    assert exc_info.value.code == exc_code
+    assert not Payment.objects.exists()
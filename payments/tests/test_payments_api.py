@@ -1,13 +1,21 @@
 from decimal import Decimal
 
+from io import StringIO
+
 from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from model_mommy import mommy
 from parameterized import parameterized
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from accounts.cache import account_pks, resolve_account_pks
 from accounts.models import Currency, Account
+from payments.models import Payment, PaymentRequest
 from postings.models import Posting
 from postings.serializers import PaymentDirection
 from utils.views import reverse_querystring
@@ -34,7 +42,6 @@ class CreatePaymentTestCase(APITestCase):
         # Test list
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
-        self.assertEqual(response.data['count'], 2)
         results = response.data['results']
         self.assertEqual(len(results), 2)
 
@@ -55,8 +62,23 @@ class CreatePaymentTestCase(APITestCase):
         self.assertNotIn('from_account', posting)
 
     def test_pagination(self):
+        postings = mommy.make(Posting, _quantity=3)
+        url = reverse_querystring('payments_v1:payments-list', query_kwargs=dict(page_size=2))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertNotIn('count', response.data)
+        self.assertEqual([posting['id'] for posting in response.data['results']], [postings[2].pk, postings[1].pk])
+
+        # New Posting does not shift the next page
+        mommy.make(Posting)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual([posting['id'] for posting in response.data['results']], [postings[0].pk])
+        self.assertIsNone(response.data['next'])
+
+    def test_pagination_legacy(self):
         mommy.make(Posting, _quantity=2)
-        url = reverse('payments_v1:payments-list')
+        url = reverse_querystring('payments_v1:payments-list', query_kwargs=dict(limit=100))
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
         self.assertEqual(response.data['count'], 2)
@@ -68,6 +90,15 @@ class CreatePaymentTestCase(APITestCase):
         self.assertEqual(response.data['count'], 2)
         self.assertEqual(len(response.data['results']), 1)
 
+    def test_list_queries(self):
+        mommy.make(Posting, _quantity=10)
+        url = reverse('payments_v1:payments-list')
+        # Whole page is fetched by a single query without total count
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(len(response.data['results']), 10)
+
     def test_invalid_account(self):
         mommy.make(Account, currency=self.currency_a, name='bob123', value=Decimal('100'))
         url = reverse('payments_v1:payments-list')
@@ -83,6 +114,34 @@ class CreatePaymentTestCase(APITestCase):
         self.assertEqual(len(errors), 1)
         self.assertEqual(response.data['to_account'][0].code, 'does_not_exist', response.data)
 
+    def test_create_payment_queries(self):
+        mommy.make(Account, currency=self.currency_a, name='bob123', value=Decimal('100'))
+        mommy.make(Account, currency=self.currency_a, name='alice456', value=Decimal('0'))
+        url = reverse('payments_v1:payments-list')
+        data = dict(from_account='bob123', to_account='alice456', value=Decimal('1'))
+        self.client.post(url, data=data)
+
+        # Account names are resolved by cache, Accounts are read by the lock only
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual((response.data['from_account'], response.data['to_account']), ('bob123', 'alice456'))
+        account_reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT "accounts_account"')]
+        self.assertEqual(len(account_reads), 1, account_reads)
+        self.assertIn('FOR NO KEY UPDATE', account_reads[0])
+
+    def test_deleted_account(self):
+        mommy.make(Account, currency=self.currency_a, name='bob123', value=Decimal('100'))
+        alice = mommy.make(Account, currency=self.currency_a, name='alice456', value=Decimal('0'))
+        resolve_account_pks(['bob123', 'alice456'])
+        # Deleted by another process, i.e. without signals
+        Account.objects.filter(pk=alice.pk)._raw_delete(Account.objects.db)  # pylint: disable=protected-access
+        url = reverse('payments_v1:payments-list')
+        response = self.client.post(url, data=dict(from_account='bob123', to_account='alice456', value='1'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertEqual(response.data['non_field_errors'][0].code, 'does_not_exist')
+        self.assertIsNone(account_pks.get('alice456'))
+
     def test_same_account(self):
         mommy.make(Account, currency=self.currency_a, name='bob123', value=Decimal('100'))
         url = reverse('payments_v1:payments-list')
@@ -134,3 +193,201 @@ class CreatePaymentTestCase(APITestCase):
         url = reverse('payments_v_:payments-list')
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED, response.data)
+
+
+class IdempotencyKeyTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        currency = mommy.make(Currency, code='AAA')
+        mommy.make(Account, currency=currency, name='bob123', value=Decimal('100'))
+        mommy.make(Account, currency=currency, name='alice456', value=Decimal('0'))
+
+    def test_retry(self):
+        url = reverse('payments_v1:payments-list')
+        data = dict(from_account='bob123', to_account='alice456', value=Decimal('10'))
+        response = self.client.post(url, data=data, HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertNotIn('idempotency_key', response.data)
+
+        retry = self.client.post(url, data=data, HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED, retry.data)
+        self.assertEqual(retry.data, response.data)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Account.objects.get(name='bob123').value, Decimal('90'))
+
+        response = self.client.post(url, data=dict(data, value=Decimal('5')), HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertEqual(response.data['non_field_errors'][0].code, 'idempotency_key_reused')
+
+    def test_without_key(self):
+        url = reverse('payments_v1:payments-list')
+        data = dict(from_account='bob123', to_account='alice456', value=Decimal('10'))
+        self.client.post(url, data=data)
+        self.client.post(url, data=data)
+        self.assertEqual(Payment.objects.count(), 2)
+
+    def test_key_too_long(self):
+        url = reverse('payments_v1:payments-list')
+        data = dict(from_account='bob123', to_account='alice456', value=Decimal('10'))
+        response = self.client.post(url, data=data, HTTP_IDEMPOTENCY_KEY='k' * 255)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertIn('idempotency_key', response.data)
+        self.assertFalse(Payment.objects.exists())
+
+
+@override_settings(PAYMENTS_ASYNC=True)
+class AsyncPaymentTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        currency = mommy.make(Currency, code='AAA')
+        mommy.make(Account, currency=currency, name='bob123', value=Decimal('100'))
+        mommy.make(Account, currency=currency, name='alice456', value=Decimal('0'))
+
+    def test_create_payment(self):
+        url = reverse('payments_v1:payments-list')
+        data = dict(from_account='bob123', to_account='alice456', value=Decimal('10'))
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED, response.data)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(response['Location'], response.data['url'])
+        self.assertFalse(Payment.objects.exists())
+
+        call_command('run_payment_worker', once=True, stdout=StringIO())
+
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(response.data['payment'], Payment.objects.get().pk)
+        self.assertEqual(Account.objects.get(name='alice456').value, Decimal('10'))
+
+    def test_create_payment_failed(self):
+        url = reverse('payments_v1:payments-list')
+        data = dict(from_account='alice456', to_account='bob123', value=Decimal('10'))
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED, response.data)
+
+        PaymentRequest.objects.process_batch(settings.PAYMENTS_WORKER_BATCH_SIZE)
+
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(response.data['error_code'], 'no_funds')
+
+    def test_invalid_account(self):
+        url = reverse('payments_v1:payments-list')
+        data = dict(from_account='dave000', to_account='bob123', value=Decimal('10'))
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertFalse(PaymentRequest.objects.exists())
+
+    def test_retry(self):
+        url = reverse('payments_v1:payments-list')
+        data = dict(from_account='bob123', to_account='alice456', value=Decimal('10'))
+        response = self.client.post(url, data=data, HTTP_IDEMPOTENCY_KEY='retry-1')
+        retry = self.client.post(url, data=data, HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(retry.status_code, status.HTTP_202_ACCEPTED, retry.data)
+        self.assertEqual(retry.data['url'], response.data['url'])
+        self.assertEqual(PaymentRequest.objects.count(), 1)
+
+
+class CreatePaymentBatchTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        currency = mommy.make(Currency, code='AAA')
+        mommy.make(Account, currency=currency, name='bob123', value=Decimal('100'))
+        mommy.make(Account, currency=currency, name='alice456', value=Decimal('0'))
+
+    def test_create_batch(self):
+        url = reverse('payments_v1:payments-batch')
+        data = dict(payments=[
+            dict(from_account='bob123', to_account='alice456', value=Decimal('70')),
+            dict(from_account='alice456', to_account='bob123', value=Decimal('20')),
+        ])
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(len(response.data['payments']), 2)
+        self.assertEqual(response.data['payments'][1]['from_account'], 'alice456')
+        self.assertEqual(Account.objects.get(name='bob123').value, Decimal('50'))
+        self.assertEqual(Account.objects.get(name='alice456').value, Decimal('50'))
+
+    def test_invalid_account(self):
+        url = reverse('payments_v1:payments-batch')
+        data = dict(payments=[
+            dict(from_account='bob123', to_account='alice456', value=Decimal('1')),
+            dict(from_account='bob123', to_account='carol789', value=Decimal('1')),
+        ])
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertEqual(response.data['payments'][1]['to_account'][0].code, 'does_not_exist', response.data)
+        self.assertNotIn(0, response.data['payments'])
+
+    def test_no_funds(self):
+        url = reverse('payments_v1:payments-batch')
+        data = dict(payments=[
+            dict(from_account='bob123', to_account='alice456', value=Decimal('70')),
+            dict(from_account='bob123', to_account='alice456', value=Decimal('70')),
+        ])
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertEqual(response.data['payments'][1]['non_field_errors'][0].code, 'no_funds', response.data)
+        self.assertEqual(Account.objects.get(name='bob123').value, Decimal('100'))
+
+
+class CreateTransactionTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        currency = mommy.make(Currency, code='AAA')
+        mommy.make(Account, currency=currency, name='bob123', value=Decimal('100'))
+        mommy.make(Account, currency=currency, name='alice456', value=Decimal('0'))
+        mommy.make(Account, currency=currency, name='fees', value=Decimal('0'))
+
+    def test_create_transaction(self):
+        url = reverse('payments_v1:payments-transaction')
+        legs = [
+            dict(account='bob123', value='-10.5000'),
+            dict(account='alice456', value='10.0000'),
+            dict(account='fees', value='0.5000'),
+        ]
+        response = self.client.post(url, data=dict(legs=legs))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data['value'], '10.5000')
+        self.assertEqual(response.data['legs'], legs)
+        self.assertEqual(Account.objects.get(name='fees').value, Decimal('0.5'))
+
+        # Postings of the transaction are listed without a counterpart for the side with several legs
+        response = self.client.get(reverse('payments_v1:payments-list'))
+        postings = {posting['account']: posting for posting in response.data['results']}
+        self.assertEqual(postings['fees']['from_account'], 'bob123')
+        self.assertIsNone(postings['bob123']['to_account'])
+
+    def test_unbalanced(self):
+        url = reverse('payments_v1:payments-transaction')
+        legs = [dict(account='bob123', value='-10'), dict(account='alice456', value='9')]
+        response = self.client.post(url, data=dict(legs=legs))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertEqual(response.data['non_field_errors'][0].code, 'unbalanced')
+
+    def test_invalid_account(self):
+        url = reverse('payments_v1:payments-transaction')
+        legs = [dict(account='bob123', value='-10'), dict(account='dave000', value='10')]
+        response = self.client.post(url, data=dict(legs=legs))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertEqual(response.data['legs'][1]['account'][0].code, 'does_not_exist')
+
+
+class ExportTestCase(APITestCase):
+    def test_export(self):
+        postings = mommy.make(Posting, _quantity=3)
+        url = reverse_querystring('payments_v1:payments-export', query_kwargs=dict(output='csv'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual([int(line.split(',')[0]) for line in lines[1:]], [posting.pk for posting in postings])
+
+    def test_export_invalid(self):
+        url = reverse_querystring('payments_v1:payments-export', query_kwargs=dict(kind='accounts'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertIn('kind', response.data)
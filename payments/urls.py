@@ -2,12 +2,13 @@ from django.urls import path, include
 from rest_framework import routers
 
 from payments.apps import PaymentsConfig
-from payments.views import PaymentViewSet
+from payments.views import PaymentViewSet, PaymentRequestViewSet
 
 app_name = PaymentsConfig.name
 
 router = routers.DefaultRouter()
 router.register(r'payments', PaymentViewSet, basename='payments')
+router.register(r'payment-requests', PaymentRequestViewSet, basename='payment-requests')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,31 +1,42 @@
-from rest_framework.mixins import ListModelMixin, CreateModelMixin
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError, ErrorDetail
+from rest_framework.mixins import ListModelMixin, CreateModelMixin, RetrieveModelMixin
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
-from payments.models import Payment
-from payments.serializers import PaymentSerializer
+from payments.models import Payment, PaymentRequest
+from payments.serializers import (
+    PaymentSerializer, PaymentBatchSerializer, PaymentRequestSerializer, TransactionSerializer, ExportSerializer,
+)
+from postings import export
 from postings.models import Posting
-from postings.serializers import PostingSerializer
-from utils.views import NotImplementedAPI
+from postings.serializers import PostingValuesSerializer
+from utils.pagination import KeysetPagination
+from utils.views import NotImplementedAPI, ReplicaReadMixin
 
 
-class PaymentViewSet(ListModelMixin, CreateModelMixin, GenericViewSet):
+class PaymentViewSet(ReplicaReadMixin, ListModelMixin, CreateModelMixin, GenericViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     list_queryset = Posting.objects.order_by('-pk')
+    list_serializer_class = PostingValuesSerializer
+    pagination_class = KeysetPagination
 
     def list(self, request, *args, **kwargs):
         # If this View can be used for different API version, we must check current API version.
         # This is an example how we can use one View for different API versions.
         if request.version == 'payments_v1':
-            queryset = self.filter_queryset(self.list_queryset)
+            queryset = self.list_serializer_class.prepare_queryset(self.filter_queryset(self.list_queryset))
 
             page = self.paginate_queryset(queryset)
             if page is not None:
-                serializer = PostingSerializer(page, many=True)
+                serializer = self.list_serializer_class(page, many=True)
                 return self.get_paginated_response(serializer.data)
 
-            serializer = PostingSerializer(queryset, many=True)
+            serializer = self.list_serializer_class(queryset, many=True)
             return Response(serializer.data)
         raise NotImplementedAPI()
 
@@ -33,5 +44,75 @@ class PaymentViewSet(ListModelMixin, CreateModelMixin, GenericViewSet):
         # If this View can be used for different API version, we must check current API version.
         # This is an example how we can use one View for different API versions.
         if request.version == 'payments_v1':
+            if settings.PAYMENTS_ASYNC:
+                return self.enqueue(request)
             return super().create(request, *args, **kwargs)
         raise NotImplementedAPI()
+
+    def enqueue(self, request):
+        """Queue the payment and respond with `202 Accepted` and the request status URL."""
+        serializer = PaymentRequestSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save(idempotency_key=self.get_idempotency_key())
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': serializer.data['url']})
+
+    def get_idempotency_key(self):
+        """Return `Idempotency-Key` header, so retried requests return the result of the first one."""
+        idempotency_key = self.request.META.get('HTTP_IDEMPOTENCY_KEY') or None
+        max_length = Payment._meta.get_field('idempotency_key').max_length
+        if idempotency_key is not None and len(idempotency_key) > max_length:
+            raise ValidationError(dict(idempotency_key=[ErrorDetail(
+                'Ensure this header has no more than {} characters.'.format(max_length), code='max_length',
+            )]))
+        return idempotency_key
+
+    def perform_create(self, serializer):
+        serializer.save(idempotency_key=self.get_idempotency_key())
+
+    @action(detail=False, methods=['post'], serializer_class=PaymentBatchSerializer)
+    def batch(self, request, *args, **kwargs):
+        """Create many payments at once, either all of them are created or none."""
+        if request.version == 'payments_v1':
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        raise NotImplementedAPI()
+
+    @action(detail=False, methods=['post'], serializer_class=TransactionSerializer)
+    def transaction(self, request, *args, **kwargs):
+        """Create a payment with many legs summing to zero, e.g. a transfer with a fee."""
+        if request.version == 'payments_v1':
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        raise NotImplementedAPI()
+
+    @action(detail=False, serializer_class=ExportSerializer)
+    def export(self, request, *args, **kwargs):
+        """
+        Stream the whole ledger without pagination
+
+        Query parameters: `kind` is `postings` or `payments`, `output` is `ndjson` or `csv`.
+        """
+        if request.version == 'payments_v1':
+            serializer = self.get_serializer(data=request.query_params)
+            serializer.is_valid(raise_exception=True)
+            kind, output = serializer.validated_data['kind'], serializer.validated_data['output']
+            response = StreamingHttpResponse(export.export(kind, output), content_type=export.CONTENT_TYPES[output])
+            response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(kind, output)
+            return response
+        raise NotImplementedAPI()
+
+
+class PaymentRequestViewSet(RetrieveModelMixin, GenericViewSet):
+    """Status of a queued payment."""
+
+    queryset = PaymentRequest.objects.select_related('from_account', 'to_account')
+    serializer_class = PaymentRequestSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.version == 'payments_v1':
+            return super().retrieve(request, *args, **kwargs)
+        raise NotImplementedAPI()
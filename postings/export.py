@@ -0,0 +1,102 @@
+"""
+Streaming ledger export
+
+Rows are read by server-side cursors (`QuerySet.iterator`) and rendered line by line,
+so memory usage does not depend on the ledger size.
+"""
+
+import csv
+from itertools import islice
+from typing import Iterable, Iterator, Sequence, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from payments.models import Payment
+from postings.models import Posting
+
+KIND_POSTINGS = 'postings'
+KIND_PAYMENTS = 'payments'
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+
+CONTENT_TYPES = {
+    FORMAT_NDJSON: 'application/x-ndjson',
+    FORMAT_CSV: 'text/csv',
+}
+
+# Output column name -> queryset field
+COLUMNS = {
+    KIND_POSTINGS: (
+        ('id', 'pk'),
+        ('payment', 'payment_id'),
+        ('account', 'account__name'),
+        ('value', 'value'),
+        ('created', 'created'),
+    ),
+    KIND_PAYMENTS: (
+        ('id', 'pk'),
+        ('from_account', 'from_account__name'),
+        ('to_account', 'to_account__name'),
+        ('value', 'value'),
+        ('created', 'created'),
+    ),
+}
+
+QUERYSETS = {
+    KIND_POSTINGS: Posting.objects.all(),
+    KIND_PAYMENTS: Payment.objects.all(),
+}
+
+
+def export_rows(kind: str, chunk_size: int = None) -> Tuple[Sequence[str], Iterator[tuple]]:
+    """Return column names and iterator over all rows of `kind` ordered by primary key."""
+    names, fields = zip(*COLUMNS[kind])
+    rows = QUERYSETS[kind].order_by('pk').values_list(*fields).iterator(
+        chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE
+    )
+    return names, rows
+
+
+def render_ndjson(names: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(names, row))) + '\n'
+
+
+class Echo:
+    """File-like object returning written value, see `Streaming large CSV files` in Django docs."""
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def render_csv(names: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(names)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+RENDERERS = {
+    FORMAT_NDJSON: render_ndjson,
+    FORMAT_CSV: render_csv,
+}
+
+
+def buffered(lines: Iterable[str], size: int) -> Iterator[str]:
+    """Join every `size` lines, so a chunk is written per many rows instead of per row."""
+    lines = iter(lines)
+    while True:
+        chunk = ''.join(islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export(kind: str, format: str, chunk_size: int = None) -> Iterator[str]:
+    """Return iterator over chunks of text of all rows of `kind` rendered to `format`."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    names, rows = export_rows(kind, chunk_size)
+    return buffered(RENDERERS[format](names, rows), chunk_size)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Account
+from postings.models import Posting
+
+
+class Command(BaseCommand):
+    help = 'Fill running balances of Postings created before `Posting.balance_after` was added, Account by Account.'
+
+    def handle(self, *args, **options):
+        account_pks = Account.objects.filter(
+            shard_count=0, postings__balance_after__isnull=True,
+        ).values_list('pk', flat=True).distinct()
+        filled = 0
+        for account_pk in list(account_pks):
+            filled += Posting.objects.backfill_balance_after(account_pk)
+        self.stdout.write('Filled {} Postings.'.format(filled))
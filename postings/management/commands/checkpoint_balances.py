@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from postings.models import BalanceCheckpoint
+
+
+class Command(BaseCommand):
+    help = 'Create balance checkpoints of Accounts changed since the previous run, to be run periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=int, default=settings.BALANCE_CHECKPOINT_LAG,
+                            help='Seconds, checkpoints include Postings created before this time ago.')
+
+    def handle(self, *args, **options):
+        as_of = timezone.now() - timedelta(seconds=options['lag'])
+        checkpoints = BalanceCheckpoint.objects.create_checkpoints(as_of)
+        self.stdout.write('Created {} checkpoints as of {}.'.format(len(checkpoints), as_of.isoformat()))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from postings import export
+
+
+class Command(BaseCommand):
+    help = 'Export all Postings or Payments as NDJSON or CSV using a server-side cursor.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(export.COLUMNS), default=export.KIND_POSTINGS)
+        parser.add_argument('--format', choices=list(export.RENDERERS), default=export.FORMAT_NDJSON)
+        parser.add_argument('--output', help='Output file path, stdout by default.')
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE,
+                            help='Rows fetched from the database at once.')
+
+    def handle(self, *args, **options):
+        chunks = export.export(options['kind'], options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from postings import partitions
+
+
+class Command(BaseCommand):
+    help = ('Create monthly Posting partitions ahead of time and detach old ones, to be run periodically. '
+            'PostgreSQL only, see `postings.partitions`.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--setup', action='store_true',
+                            help='Convert Postings table to a partitioned one, existing Postings are kept '
+                                 'in a partition for Postings created before the next month.')
+        parser.add_argument('--ahead', type=int, default=settings.POSTINGS_PARTITIONS_AHEAD,
+                            help='Months, partitions are created until this number of months ahead.')
+        parser.add_argument('--retain', type=int, default=settings.POSTINGS_PARTITIONS_RETAIN,
+                            help='Months, partitions of Postings created before are detached. '
+                                 'Nothing is detached by default.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL.')
+        now = timezone.now()
+        if not partitions.is_partitioned():
+            if not options['setup']:
+                raise CommandError('Postings table is not partitioned, run with --setup.')
+            partitions.partition_table(partitions.month_start(now, 1))
+            self.stdout.write('Partitioned Postings table.')
+
+        created = partitions.create_partitions(partitions.month_start(now, options['ahead']))
+        self.stdout.write('Created {} partitions{}'.format(
+            len(created), ': {}.'.format(', '.join(created)) if created else '.',
+        ))
+        if options['retain'] is not None:
+            detached = partitions.detach_partitions(partitions.month_start(now, -options['retain']))
+            self.stdout.write('Detached {} partitions{}'.format(
+                len(detached), ': {}.'.format(', '.join(detached)) if detached else '.',
+            ))
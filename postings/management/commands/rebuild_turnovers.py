@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from postings.models import TurnoverMark
+
+
+class Command(BaseCommand):
+    help = ('Replace daily turnovers by a roll up of all Postings, in a single transaction. Turnovers of days '
+            'in detached Posting partitions are kept.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=int, default=settings.TURNOVER_ROLLUP_LAG,
+                            help='Seconds, Postings created later are rolled up by `roll_up_turnovers`.')
+
+    def handle(self, *args, **options):
+        as_of = timezone.now() - timedelta(seconds=options['lag'])
+        rolled_up = TurnoverMark.objects.rebuild(as_of)
+        self.stdout.write('Rebuilt turnovers of {} postings as of {}.'.format(rolled_up, as_of.isoformat()))
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from postings.models import ReconciliationMark
+
+
+class Command(BaseCommand):
+    help = ('Check that Account balances match their Postings and Payment Postings sum to zero, '
+            'only Postings created since the previous run are read.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=int, default=settings.LEDGER_RECONCILE_LAG,
+                            help='Seconds, Postings created later are checked again next run.')
+
+    def handle(self, *args, **options):
+        as_of = timezone.now() - timedelta(seconds=options['lag'])
+        result = ReconciliationMark.objects.reconcile(as_of)
+        for name, balance, expected in result.drifts:
+            self.stderr.write('Account {} balance {} does not match Postings {}.'.format(name, balance, expected))
+        for payment_id, total in result.unbalanced_payments:
+            self.stderr.write('Payment {} Postings sum to {}.'.format(payment_id, total))
+        self.stdout.write('Checked {} accounts, {} new.'.format(result.checked, result.baselined))
+        if result.drifts or result.unbalanced_payments:
+            raise CommandError('Ledger is inconsistent.')
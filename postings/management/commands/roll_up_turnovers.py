@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from postings.models import TurnoverMark
+
+
+class Command(BaseCommand):
+    help = 'Add Postings created since the previous run to daily turnovers, to be run periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=int, default=settings.TURNOVER_ROLLUP_LAG,
+                            help='Seconds, Postings created later are rolled up next run.')
+        parser.add_argument('--batch-size', type=int, default=settings.TURNOVER_ROLLUP_BATCH_SIZE,
+                            help='Postings rolled up by a single transaction.')
+
+    def handle(self, *args, **options):
+        as_of = timezone.now() - timedelta(seconds=options['lag'])
+        total = 0
+        while True:
+            rolled_up = TurnoverMark.objects.roll_up(as_of, batch_size=options['batch_size'])
+            if not rolled_up:
+                break
+            total += rolled_up
+        self.stdout.write('Rolled up {} postings as of {}.'.format(total, as_of.isoformat()))
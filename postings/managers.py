@@ -0,0 +1,284 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from typing import List, NamedTuple, Optional, Tuple
+
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, Exists, F, Max, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from accounts.managers import sum_of_values
+from accounts.models import Account, Currency
+from utils.models import AmountField
+
+
+class PostingManager(models.Manager):
+    """Custom Manager with ability to fill running balances of existing Postings and find settled ones."""
+
+    def last_id_before(self, as_of: datetime) -> int:
+        """
+        Return id of the latest Posting created before `as_of`, 0 if there is none
+
+        Posting ids are taken from a sequence when a payment transaction inserts them, but the Postings become
+        visible on commit, so a transaction still in flight may commit Postings with ids below the returned one
+        later. Jobs which process Postings up to this id and remember it as a mark must pass `as_of` lagging
+        behind current time for longer than any payment transaction lasts, so no Posting is skipped.
+        """
+        return self.filter(created__lt=as_of).aggregate(Max('id'))['id__max'] or 0
+
+    @transaction.atomic
+    def backfill_balance_after(self, account_pk: int) -> int:
+        """
+        Fill empty `balance_after` of Account Postings from its current balance
+
+        Balance after a Posting is the current balance minus all later Postings, calculated by a single
+        window function scan of Account Postings. The Account is locked meanwhile, so no Posting is added
+        concurrently. Sharded Accounts are skipped, see :meth:`payments.managers.PaymentManager.balance_after`.
+
+        :return: number of filled Postings.
+        """
+        accounts = list(Account.objects.filter(pk=account_pk, shard_count=0).select_for_no_key_update())
+        if not accounts:
+            return 0
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {table} AS posting SET balance_after = later.balance_after FROM ('
+                '  SELECT id, %s - COALESCE(SUM(value) OVER ('
+                '    ORDER BY id DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING'
+                '  ), 0) AS balance_after FROM {table} WHERE account_id = %s'
+                ') AS later '
+                'WHERE posting.id = later.id AND posting.account_id = %s AND posting.balance_after IS NULL'.format(
+                    table=table,
+                ),
+                [accounts[0].value, account_pk, account_pk],
+            )
+            return cursor.rowcount
+
+
+class BalanceCheckpointManager(models.Manager):
+    """Custom Manager with ability to create balance checkpoints."""
+
+    def create_checkpoints(self, as_of: datetime) -> List[models.Model]:
+        """
+        Create checkpoints as of `as_of` for all Accounts with Postings since the previous checkpoints
+
+        Checkpoints include Postings up to the latest one created before `as_of`, which must lag behind current
+        time, see :meth:`PostingManager.last_id_before`. Values are calculated by one query, which reads
+        a consistent snapshot, so no locks are taken. A new checkpoint is the previous checkpoint of the Account
+        plus new Postings, or current balance minus later Postings for Accounts without checkpoints.
+
+        :return: created checkpoints.
+        """
+        posting_model = Account.postings.rel.related_model
+        last_posting_id = posting_model.objects.last_id_before(as_of)
+        previous_posting_id = self.aggregate(Max('last_posting_id'))['last_posting_id__max'] or 0
+        if last_posting_id <= previous_posting_id:
+            return []
+
+        postings = posting_model.objects.filter(account=OuterRef('pk'))
+        previous = self.filter(account=OuterRef('pk')).order_by('-last_posting_id')
+        accounts = Account.objects.with_balance().annotate(
+            has_postings=Exists(postings.filter(id__gt=previous_posting_id, id__lte=last_posting_id)),
+            checkpoint_value=Subquery(previous.values('value')[:1], output_field=AmountField()),
+            checkpoint_posting_id=Subquery(previous.values('last_posting_id')[:1]),
+        ).filter(has_postings=True).annotate(as_of_value=Case(
+            When(checkpoint_value__isnull=True,
+                 then=F('balance') - sum_of_values(postings.filter(id__gt=last_posting_id))),
+            default=F('checkpoint_value') + sum_of_values(
+                postings.filter(id__gt=OuterRef('checkpoint_posting_id'), id__lte=last_posting_id)
+            ),
+            output_field=AmountField(),
+        )).values_list('pk', 'as_of_value')
+
+        return self.bulk_create(
+            self.model(account_id=account_pk, last_posting_id=last_posting_id, value=value, as_of=as_of)
+            for account_pk, value in accounts
+        )
+
+
+class Reconciliation(NamedTuple):
+    """
+    Result of :meth:`ReconciliationMarkManager.reconcile`
+
+    Attributes
+
+     - checked (int): Number of Accounts checked.
+     - baselined (int): Number of Accounts seen for the first time, their balances are taken as is.
+     - drifts (list): `(account name, balance, expected balance)` of Accounts which balance is not equal to
+       their Postings.
+     - unbalanced_payments (list): `(payment id, postings sum)` of Payments which Postings do not sum to zero.
+
+    """
+
+    checked: int
+    baselined: int
+    drifts: List[Tuple[str, Decimal, Decimal]]
+    unbalanced_payments: List[Tuple[int, Decimal]]
+
+
+class ReconciliationMarkManager(models.Manager):
+    """Custom Manager with ability to reconcile Account values with Postings incrementally."""
+
+    @transaction.atomic
+    def reconcile(self, as_of: datetime) -> Reconciliation:
+        """
+        Check Accounts and Payments changed since the previous reconciliation
+
+        An Account balance must be equal to its marked value plus all Postings after the mark. Balances and
+        Posting sums are read by one query, so they are consistent without locks. Marks of consistent Accounts
+        are moved to the latest Posting created before `as_of`, see :meth:`PostingManager.last_id_before`,
+        later Postings are checked again next time. Marks of drifted Accounts are kept, so the drift
+        is reported until it is fixed.
+
+        Payments with Postings since the previous reconciliation must have Postings summing to zero.
+        """
+        posting_model = Account.postings.rel.related_model
+        last_posting_id = posting_model.objects.last_id_before(as_of)
+        previous_posting_id = self.aggregate(Max('last_posting_id'))['last_posting_id__max'] or 0
+
+        postings = posting_model.objects.filter(account=OuterRef('pk'))
+        new_postings = postings.filter(id__gt=OuterRef('mark_posting_id'))
+        accounts = Account.objects.with_balance().annotate(
+            mark_posting_id=F('reconciliation_mark__last_posting_id'),
+            mark_value=F('reconciliation_mark__value'),
+            has_new_postings=Exists(new_postings),
+        ).filter(Q(mark_posting_id__isnull=True) | Q(has_new_postings=True)).annotate(
+            new_sum=sum_of_values(new_postings),
+            settled_sum=sum_of_values(new_postings.filter(id__lte=last_posting_id)),
+            unsettled_sum=sum_of_values(postings.filter(id__gt=last_posting_id)),
+        ).values_list('pk', 'name', 'balance', 'mark_posting_id', 'mark_value',
+                      'new_sum', 'settled_sum', 'unsettled_sum')
+
+        checked, new_marks, drifts = 0, [], []
+        for pk, name, balance, mark_posting_id, mark_value, new_sum, settled_sum, unsettled_sum in accounts:
+            checked += 1
+            if mark_posting_id is None:
+                new_marks.append(self.model(
+                    account_id=pk, last_posting_id=last_posting_id, value=balance - unsettled_sum,
+                ))
+            elif balance != mark_value + new_sum:
+                drifts.append((name, balance, mark_value + new_sum))
+            elif last_posting_id > mark_posting_id:
+                self.filter(account_id=pk).update(last_posting_id=last_posting_id, value=mark_value + settled_sum)
+        self.bulk_create(new_marks)
+
+        payment_ids = posting_model.objects.filter(
+            id__gt=previous_posting_id, id__lte=last_posting_id,
+        ).values('payment_id')
+        unbalanced_payments = list(posting_model.objects.filter(payment_id__in=payment_ids).order_by().values(
+            'payment_id',
+        ).annotate(total=Sum('value')).exclude(total=0).values_list('payment_id', 'total'))
+
+        return Reconciliation(checked, len(new_marks), drifts, unbalanced_payments)
+
+
+class TurnoverMarkManager(models.Manager):
+    """Custom Manager with ability to roll up Postings to daily turnovers incrementally."""
+
+    def _upsert(self, model, column: str, key: str, postings: models.QuerySet) -> int:
+        """Add daily sums of `postings` grouped by `key` to `model` rows, return the number of Postings."""
+        rows = postings.annotate(day=TruncDate('created')).order_by().values(key, 'day').annotate(
+            debit=Coalesce(Sum(Case(When(value__lt=0, then=-F('value')), output_field=AmountField())), 0),
+            credit=Coalesce(Sum(Case(When(value__gt=0, then=F('value')), output_field=AmountField())), 0),
+            postings=Count('id'),
+        ).values_list(key, 'day', 'debit', 'credit', 'postings')
+        sql, params = rows.query.get_compiler(self.db).as_sql()
+        connection = connections[self.db]
+        table, column = connection.ops.quote_name(model._meta.db_table), connection.ops.quote_name(column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'WITH daily AS ({rows}), upsert AS ('
+                '  INSERT INTO {table} ({column}, day, debit, credit, postings) SELECT * FROM daily'
+                '  ON CONFLICT ({column}, day) DO UPDATE SET debit = {table}.debit + EXCLUDED.debit,'
+                '  credit = {table}.credit + EXCLUDED.credit, postings = {table}.postings + EXCLUDED.postings'
+                ') SELECT COALESCE(SUM(postings), 0) FROM daily'.format(rows=sql, table=table, column=column),
+                params,
+            )
+            return cursor.fetchone()[0]
+
+    def _lock(self) -> models.Model:
+        """Return the only mark locked until the transaction ends."""
+        self.get_or_create(pk=1)
+        return self.select_for_update().get(pk=1)
+
+    @transaction.atomic
+    def roll_up(self, as_of: datetime, batch_size: Optional[int] = None) -> int:
+        """
+        Add Postings created since the previous roll up to daily turnovers of Accounts and Currencies
+
+        Postings up to the latest one created before `as_of` are rolled up, see :meth:`PostingManager.last_id_before`.
+        With `batch_size` at most that many Postings are rolled up, so a long backlog is caught up by short
+        transactions, and the mark moves to `as_of` with the last batch. The mark is locked meanwhile,
+        so concurrent roll ups wait for each other instead of adding Postings twice.
+
+        :return: number of rolled up Postings.
+        """
+        mark = self._lock()
+        posting_model = Account.postings.rel.related_model
+        last_posting_id = posting_model.objects.last_id_before(as_of)
+        if last_posting_id <= mark.last_posting_id:
+            return 0
+
+        postings = posting_model.objects.filter(id__gt=mark.last_posting_id, id__lte=last_posting_id)
+        batch_end = None
+        if batch_size is not None:
+            batch = postings.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size]
+            batch_end = next(iter(batch), None)
+        if batch_end is not None and batch_end < last_posting_id:
+            last_posting_id, as_of = batch_end, mark.as_of
+            postings = postings.filter(id__lte=last_posting_id)
+        self._upsert(Account.turnovers.rel.related_model, 'account_id', 'account_id', postings)
+        rolled_up = self._upsert(Currency.turnovers.rel.related_model, 'currency_id', 'account__currency_id', postings)
+        self.filter(pk=mark.pk).update(last_posting_id=last_posting_id, as_of=as_of)
+        return rolled_up
+
+    def _attached_since(self) -> Optional[datetime]:
+        """Return the start of the earliest Posting partition if older ones were detached, otherwise `None`."""
+        from postings import partitions
+
+        table = Account.postings.rel.related_model._meta.db_table
+        if connections[self.db].vendor != 'postgresql' or not partitions.is_partitioned(table):
+            return None
+        attached = partitions.partitions(table)
+        bounds = [bound for _, bound in attached if bound is not None]
+        if '{}_legacy'.format(table) in {name for name, _ in attached} or not bounds:
+            return None
+        return partitions.month_start(min(bounds), -1)
+
+    @transaction.atomic
+    def rebuild(self, as_of: datetime) -> int:
+        """
+        Replace daily turnovers by a roll up of all Postings created before `as_of`
+
+        If old Posting partitions were detached by `partition_postings --retain`, turnovers of days before the
+        earliest attached partition are kept, as their Postings are archived. A day split by the partition
+        boundary in `settings.TIME_ZONE` is kept too. Readers see the previous turnovers until the transaction
+        commits.
+
+        :return: number of rolled up Postings.
+        """
+        mark = self._lock()
+        posting_model = Account.postings.rel.related_model
+        last_posting_id = posting_model.objects.last_id_before(as_of)
+        account_turnovers = Account.turnovers.rel.related_model.objects.all()
+        currency_turnovers = Currency.turnovers.rel.related_model.objects.all()
+        postings = posting_model.objects.filter(id__lte=last_posting_id)
+
+        since = self._attached_since()
+        if since is not None:
+            since = timezone.localtime(since)
+            day = since.date()
+            if since.time() != time.min:
+                day += timedelta(days=1)
+            account_turnovers = account_turnovers.filter(day__gte=day)
+            currency_turnovers = currency_turnovers.filter(day__gte=day)
+            postings = postings.filter(created__gte=timezone.make_aware(datetime.combine(day, time.min)))
+
+        account_turnovers.delete()
+        currency_turnovers.delete()
+        self._upsert(Account.turnovers.rel.related_model, 'account_id', 'account_id', postings)
+        rolled_up = self._upsert(Currency.turnovers.rel.related_model, 'currency_id', 'account__currency_id', postings)
+        self.filter(pk=mark.pk).update(last_posting_id=last_posting_id, as_of=as_of)
+        return rolled_up
@@ -1,6 +1,10 @@
 from django.db import models
+from django.utils import timezone
 
-from accounts.models import Account
+from accounts.models import Account, Currency
+from postings.managers import (
+    BalanceCheckpointManager, PostingManager, ReconciliationMarkManager, TurnoverMarkManager,
+)
 from utils.models import AmountField
 
 
@@ -14,9 +18,147 @@ class Posting(models.Model):
      - account (:class:`accounts.models.Account`): Corresponding Account.
      - value (`Decimal`): The  amount that Account value changes. Positive amount increases Account value,
        negative - decreases.
+     - created (`datetime`): Creation time.
+     - balance_after (`Decimal`): Account balance right after the Posting, written while the Account is locked.
+       Empty for sharded Accounts, as their shards are credited without locking the Account.
+
+    Account statements with running balances are read by `(account_id, id DESC)` index range scans.
 
     """
 
     payment = models.ForeignKey('payments.Payment', related_name='postings', on_delete=models.CASCADE)
-    account = models.ForeignKey(Account, related_name='postings', on_delete=models.CASCADE)
+    # Account index is covered by the composite index below
+    account = models.ForeignKey(Account, related_name='postings', on_delete=models.CASCADE, db_index=False)
+    value = AmountField()
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    balance_after = AmountField(null=True, default=None, editable=False)
+
+    objects = PostingManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-id'], name='postings_account_id_desc'),
+        ]
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Represents an Account balance at some moment
+
+    Checkpoints are created periodically by `checkpoint_balances` management command, so a balance as of
+    any moment is the nearest checkpoint plus a bounded range of Postings,
+    see :meth:`accounts.managers.AccountQuerySet.with_balance`.
+
+    Attributes
+
+     - account (:class:`accounts.models.Account`): Corresponding Account.
+     - last_posting_id (int): The latest Posting included, i.e. `value` includes all Account Postings
+       with `id <= last_posting_id`.
+     - value (`Decimal`): Account balance.
+     - as_of (`datetime`): Moment of the balance, all included Postings were created before it.
+
+    """
+
+    account = models.ForeignKey(Account, related_name='balance_checkpoints', on_delete=models.CASCADE)
+    last_posting_id = models.IntegerField()
     value = AmountField()
+    as_of = models.DateTimeField()
+
+    objects = BalanceCheckpointManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-as_of'], name='checkpoints_account_as_of'),
+        ]
+
+
+class ReconciliationMark(models.Model):
+    """
+    Represents the latest reconciled state of an Account
+
+    Marks are moved by `reconcile_ledger` management command, so each run checks only Postings created since
+    the previous one, see :meth:`postings.managers.ReconciliationMarkManager.reconcile`.
+
+    Attributes
+
+     - account (:class:`accounts.models.Account`): Reconciled Account.
+     - last_posting_id (int): The latest reconciled Posting.
+     - value (`Decimal`): Account balance including all Account Postings with `id <= last_posting_id`.
+
+    """
+
+    account = models.OneToOneField(Account, related_name='reconciliation_mark', on_delete=models.CASCADE)
+    last_posting_id = models.IntegerField()
+    value = AmountField()
+
+    objects = ReconciliationMarkManager()
+
+
+class AccountTurnover(models.Model):
+    """
+    Represents daily turnover of an Account
+
+    Turnovers are rolled up from Postings by `roll_up_turnovers` management command,
+    see :meth:`postings.managers.TurnoverMarkManager.roll_up`.
+
+    Attributes
+
+     - account (:class:`accounts.models.Account`): Corresponding Account.
+     - day (`date`): Day of Postings creation in `settings.TIME_ZONE`.
+     - debit (`Decimal`): Sum of absolute values of outgoing Postings, i.e. decreasing the Account value.
+     - credit (`Decimal`): Sum of values of incoming Postings.
+     - postings (int): Number of Postings.
+
+    """
+
+    account = models.ForeignKey(Account, related_name='turnovers', on_delete=models.CASCADE)
+    day = models.DateField()
+    debit = AmountField()
+    credit = AmountField()
+    postings = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('account', 'day')]
+
+
+class CurrencyTurnover(models.Model):
+    """
+    Represents daily turnover of all Accounts of a Currency
+
+    Attributes
+
+     - currency (:class:`accounts.models.Currency`): Corresponding Currency.
+     - day (`date`): Day of Postings creation in `settings.TIME_ZONE`.
+     - debit (`Decimal`): Sum of absolute values of outgoing Postings.
+     - credit (`Decimal`): Sum of values of incoming Postings.
+     - postings (int): Number of Postings.
+
+    """
+
+    currency = models.ForeignKey(Currency, related_name='turnovers', on_delete=models.CASCADE)
+    day = models.DateField()
+    debit = AmountField()
+    credit = AmountField()
+    postings = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('currency', 'day')]
+
+
+class TurnoverMark(models.Model):
+    """
+    Represents the latest Posting rolled up to :class:`AccountTurnover` and :class:`CurrencyTurnover`
+
+    There is only one mark, it is locked while turnovers are rolled up.
+
+    Attributes
+
+     - last_posting_id (int): The latest rolled up Posting, all Postings with `id <= last_posting_id` are included.
+     - as_of (`datetime`): Moment of the latest roll up, all included Postings were created before it.
+
+    """
+
+    last_posting_id = models.IntegerField(default=0)
+    as_of = models.DateTimeField(null=True)
+
+    objects = TurnoverMarkManager()
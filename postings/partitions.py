@@ -0,0 +1,183 @@
+"""
+PostgreSQL declarative range partitioning of Postings by creation time
+
+Postings are only appended, so with monthly partitions inserts and vacuum touch the latest partition only,
+statements filtered by `created` skip whole partitions and old partitions may be detached and archived.
+Partitioning is optional and is managed by `partition_postings` management command (PostgreSQL 11+):
+
+ - :func:`partition_table` converts the existing table to a partitioned one. The existing rows are kept
+   in `<table>_legacy` partition holding everything created before the boundary, and a `<table>_default`
+   partition catches rows outside of all monthly partitions.
+ - :func:`create_partitions` creates monthly partitions `<table>_pYYYYMM` ahead of time, Postings which
+   landed in the default partition meanwhile are moved to their new partition.
+ - :func:`detach_partitions` detaches old partitions, detached tables are left for archiving.
+
+A primary key of a partitioned table must include the partition key, so Posting primary key becomes
+`(id, created)`. Django still treats `id` as the primary key, it is unique as it is taken from the sequence.
+Payments are not partitioned: Postings and queued payment requests reference them by foreign keys and
+idempotency keys must be unique across all Payments, neither is possible with a partitioned table.
+"""
+
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from postings.models import Posting
+
+PARTITION_KEY = 'created'
+
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(moment: datetime, months: int = 0) -> datetime:
+    """Return the first moment (UTC) of the month `months` after the month of `moment`."""
+    moment = timezone.localtime(moment, timezone.utc)
+    year, month = divmod(moment.year * 12 + moment.month - 1 + months, 12)
+    return datetime(year, month + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return '{}_p{:%Y%m}'.format(table, start)
+
+
+def is_partitioned(table: str = Posting._meta.db_table) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [table])
+        return cursor.fetchone() is not None
+
+
+def partitions(table: str = Posting._meta.db_table) -> List[Tuple[str, Optional[datetime]]]:
+    """Return names and upper bounds of partitions of `table` ordered by bound, the default one has no bound."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass',
+            [table],
+        )
+        bounds = []
+        for name, bound in cursor.fetchall():
+            match = UPPER_BOUND.search(bound)
+            bounds.append((name, parse_datetime(match.group(1)) if match else None))
+    return sorted(bounds, key=lambda partition: (partition[1] is None, partition[1] or datetime.min))
+
+
+def partition_table(boundary: datetime, table: str = Posting._meta.db_table):
+    """
+    Convert `table` to a table partitioned by creation time
+
+    Existing rows become `<table>_legacy` partition for rows created before `boundary`. Indexes and foreign keys
+    are recreated on the partitioned table, and the sequence of `id` is moved to it. The table is locked
+    exclusively until the transaction ends, the legacy partition is scanned once to validate its range
+    and to build its new primary key index.
+    """
+    quote = connection.ops.quote_name
+    legacy = '{}_legacy'.format(table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Tables with pending deferred foreign key checks cannot be altered
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [table],
+        )
+        primary_key = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN '
+            '(SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)',
+            [table, table],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+
+        # Free the names for the partitioned table, its primary key and foreign keys replace the legacy ones
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(quote(table), quote(legacy)))
+        for name in [primary_key] + [name for name, _ in foreign_keys]:
+            cursor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(quote(legacy), quote(name)))
+        for name, _ in indexes:
+            cursor.execute('ALTER INDEX {} RENAME TO {}'.format(quote(name), quote('{:.56}_legacy'.format(name))))
+
+        cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                       'PARTITION BY RANGE ({})'.format(quote(table), quote(legacy), quote(PARTITION_KEY)))
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY (id, {})'.format(
+            quote(table), quote(primary_key), quote(PARTITION_KEY),
+        ))
+        # Definitions were read before renaming, so they refer to the partitioned table
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(quote(table), quote(name), definition))
+        cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, quote(table)))
+
+        cursor.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (MINVALUE) TO (%s)'.format(
+            quote(table), quote(legacy),
+        ), [boundary])
+        cursor.execute('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(
+            quote('{}_default'.format(table)), quote(table),
+        ))
+
+
+def create_partitions(until: datetime, table: str = Posting._meta.db_table) -> List[str]:
+    """
+    Create monthly partitions following the latest one until the partitions cover `until`, return their names
+
+    Postings of a month which started before its partition was created are in the default partition, which
+    makes creating the partition fail. Such Postings are moved to the new table before it is attached.
+    """
+    quote = connection.ops.quote_name
+    default = '{}_default'.format(table)
+    names = {name for name, _ in partitions(table)}
+    bounds = [bound for _, bound in partitions(table) if bound is not None]
+    start = max(bounds) if bounds else month_start(timezone.now())
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Tables with pending deferred foreign key checks cannot be altered
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        while start <= until:
+            end = month_start(start, 1)
+            name = partition_name(table, start)
+            misplaced = False
+            if default in names:
+                cursor.execute('SELECT EXISTS (SELECT 1 FROM {} WHERE {} >= %s AND {} < %s)'.format(
+                    quote(default), quote(PARTITION_KEY), quote(PARTITION_KEY),
+                ), [start, end])
+                misplaced = cursor.fetchone()[0]
+            if misplaced:
+                cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(
+                    quote(name), quote(table),
+                ))
+                cursor.execute(
+                    'WITH moved AS (DELETE FROM {default} WHERE {key} >= %s AND {key} < %s RETURNING *) '
+                    'INSERT INTO {name} SELECT * FROM moved'.format(
+                        default=quote(default), key=quote(PARTITION_KEY), name=quote(name),
+                    ),
+                    [start, end],
+                )
+                cursor.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)'.format(
+                    quote(table), quote(name),
+                ), [start, end])
+            else:
+                cursor.execute('CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(
+                    quote(name), quote(table),
+                ), [start, end])
+            created.append(name)
+            start = end
+    return created
+
+
+def detach_partitions(before: datetime, table: str = Posting._meta.db_table) -> List[str]:
+    """Detach partitions holding only rows created before `before`, return their names."""
+    quote = connection.ops.quote_name
+    detached = [name for name, bound in partitions(table) if bound is not None and bound <= before]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name in detached:
+            cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(quote(table), quote(name)))
+    return detached
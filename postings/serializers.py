@@ -1,8 +1,12 @@
+from collections import OrderedDict
 from enum import Enum
 
+from django.db.models import Q
 from rest_framework import serializers
 
 from postings.models import Posting
+from utils.money import to_decimal
+from utils.serializers import AmountField, TimedSerializerMixin
 
 
 class PaymentDirection(Enum):
@@ -22,16 +26,23 @@ class PostingRelatedAccountField(serializers.SlugRelatedField):
         return super().get_attribute(instance)
 
 
-class PostingSerializer(serializers.ModelSerializer):
+class PostingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Use :meth:`prepare_queryset` to fetch related Accounts and Payment by the same query."""
+
     account = serializers.SlugRelatedField(slug_field='name', read_only=True)
     direction = serializers.SerializerMethodField()
     amount = serializers.SerializerMethodField()
+    balance_after = AmountField(read_only=True)
     from_account = PostingRelatedAccountField(source='payment.from_account')
     to_account = PostingRelatedAccountField(source='payment.to_account')
 
     class Meta:
         model = Posting
-        fields = ['id', 'account', 'amount', 'direction', 'from_account', 'to_account']
+        fields = ['id', 'account', 'amount', 'direction', 'balance_after', 'from_account', 'to_account']
+
+    @staticmethod
+    def prepare_queryset(queryset):
+        return queryset.select_related('account', 'payment__from_account', 'payment__to_account')
 
     @staticmethod
     def get_direction(instance):
@@ -41,4 +52,90 @@ class PostingSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_amount(instance):
-        return str(abs(instance.value))
+        return str(abs(to_decimal(instance.value)))
+
+
+class PostingValuesSerializer(TimedSerializerMixin, serializers.BaseSerializer):
+    """
+    Read only fast counterpart of :class:`PostingSerializer`
+
+    Produces the same output from `values()` rows, so neither model instances nor serializer fields
+    are created per Posting. Use :meth:`prepare_queryset` to fetch the rows.
+    """
+
+    values_fields = (
+        'pk', 'account__name', 'value', 'balance_after', 'payment__from_account__name', 'payment__to_account__name',
+    )
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        return queryset.values(*cls.values_fields)
+
+    def to_representation(self, instance):
+        value = instance['value']
+        data = OrderedDict((
+            ('id', instance['pk']),
+            ('account', instance['account__name']),
+            ('amount', str(abs(value))),
+            ('direction', (PaymentDirection.INCOMING if value > 0 else PaymentDirection.OUTGOING).value),
+            ('balance_after', None if instance['balance_after'] is None else str(instance['balance_after'])),
+        ))
+        if value >= 0:
+            data['from_account'] = instance['payment__from_account__name']
+        if value <= 0:
+            data['to_account'] = instance['payment__to_account__name']
+        return data
+
+
+class PostingFilterSerializer(serializers.Serializer):
+    """
+    Validates Postings filter query parameters
+
+    Dates are ISO 8601 dates or date times, `date_to` is exclusive. Amounts are compared with absolute
+    Posting values.
+    """
+
+    date_from = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
+    date_to = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
+    amount_min = AmountField(required=False, min_value=0)
+    amount_max = AmountField(required=False, min_value=0)
+
+    def filter_queryset(self, queryset):
+        data = self.validated_data
+        if 'date_from' in data:
+            queryset = queryset.filter(created__gte=data['date_from'])
+        if 'date_to' in data:
+            queryset = queryset.filter(created__lt=data['date_to'])
+        if 'amount_min' in data:
+            queryset = queryset.filter(Q(value__gte=data['amount_min']) | Q(value__lte=-data['amount_min']))
+        if 'amount_max' in data:
+            queryset = queryset.filter(value__gte=-data['amount_max'], value__lte=data['amount_max'])
+        return queryset
+
+
+class TurnoverSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Daily turnover of an Account or a Currency, use :meth:`prepare_queryset` to fetch `values()` rows."""
+
+    day = serializers.DateField(read_only=True)
+    debit = AmountField(read_only=True)
+    credit = AmountField(read_only=True)
+    postings = serializers.IntegerField(read_only=True)
+
+    @staticmethod
+    def prepare_queryset(queryset):
+        return queryset.order_by('-day').values('day', 'debit', 'credit', 'postings')
+
+
+class TurnoverFilterSerializer(serializers.Serializer):
+    """Validates daily turnovers filter query parameters, `date_to` is exclusive."""
+
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def filter_queryset(self, queryset):
+        data = self.validated_data
+        if 'date_from' in data:
+            queryset = queryset.filter(day__gte=data['date_from'])
+        if 'date_to' in data:
+            queryset = queryset.filter(day__lt=data['date_to'])
+        return queryset
@@ -0,0 +1,31 @@
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from payments.models import Payment
+from postings.models import Posting
+
+
+@pytest.mark.django_db
+def test_backfill_balance_after():
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, currency=currency, value=Decimal('0'))
+    merchant = Account.objects.set_shard_count(mommy.make(Account, currency=currency, value=Decimal('0')).pk, 2)
+    for from_account, to_account, value in ((bob, alice, '10'), (alice, bob, '3'), (bob, merchant, '5')):
+        Payment.objects.create_payment(
+            from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=Decimal(value),
+        )
+    expected = list(Posting.objects.order_by('pk').values_list('account_id', 'balance_after'))
+    # Postings created before balances were stored
+    Posting.objects.update(balance_after=None)
+
+    out = StringIO()
+    call_command('backfill_balance_after', stdout=out)
+    assert out.getvalue() == 'Filled 5 Postings.\n'
+    assert list(Posting.objects.order_by('pk').values_list('account_id', 'balance_after')) == expected
+    assert Posting.objects.backfill_balance_after(bob.pk) == 0
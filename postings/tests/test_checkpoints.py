@@ -0,0 +1,65 @@
+from datetime import datetime
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils.timezone import utc
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from payments.models import Payment
+from postings.models import Posting, BalanceCheckpoint
+
+
+@pytest.fixture
+def accounts():
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('100'))
+    mommy.make(Account, name='carol789', currency=currency, value=Decimal('50'))
+    for day, from_account, to_account, value in [(1, bob, alice, '10'), (2, alice, bob, '3'), (3, bob, alice, '5')]:
+        payment = Payment.objects.create_payment(
+            from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=Decimal(value),
+        )
+        Posting.objects.filter(payment=payment).update(created=datetime(2018, 12, day, tzinfo=utc))
+    return bob, alice
+
+
+def balances(as_of):
+    return dict(Account.objects.with_balance(as_of=as_of).values_list('name', 'balance'))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('checkpoints', [False, True])
+def test_balance_as_of(accounts, checkpoints):
+    if checkpoints:
+        BalanceCheckpoint.objects.create_checkpoints(datetime(2018, 12, 1, 1, tzinfo=utc))
+        BalanceCheckpoint.objects.create_checkpoints(datetime(2018, 12, 2, 12, tzinfo=utc))
+    assert balances(datetime(2018, 11, 30, tzinfo=utc)) == dict(bob123=100, alice456=100, carol789=50)
+    assert balances(datetime(2018, 12, 1, 12, tzinfo=utc)) == dict(bob123=90, alice456=110, carol789=50)
+    assert balances(datetime(2018, 12, 2, 12, tzinfo=utc)) == dict(bob123=93, alice456=107, carol789=50)
+    assert balances(datetime(2018, 12, 3, 12, tzinfo=utc)) == dict(bob123=88, alice456=112, carol789=50)
+
+
+@pytest.mark.django_db
+def test_create_checkpoints(accounts):
+    bob, alice = accounts
+    assert BalanceCheckpoint.objects.create_checkpoints(datetime(2018, 11, 30, tzinfo=utc)) == []
+    first = BalanceCheckpoint.objects.create_checkpoints(datetime(2018, 12, 1, 1, tzinfo=utc))
+    assert {(checkpoint.account_id, checkpoint.value) for checkpoint in first} == {(bob.pk, 90), (alice.pk, 110)}
+    assert BalanceCheckpoint.objects.create_checkpoints(datetime(2018, 12, 1, 2, tzinfo=utc)) == []
+
+    second = BalanceCheckpoint.objects.create_checkpoints(datetime(2018, 12, 2, 12, tzinfo=utc))
+    assert {(checkpoint.account_id, checkpoint.value) for checkpoint in second} == {(bob.pk, 93), (alice.pk, 107)}
+    assert {checkpoint.last_posting_id for checkpoint in second} == {
+        Posting.objects.filter(created__lt=datetime(2018, 12, 2, 12, tzinfo=utc)).latest('pk').pk
+    }
+
+
+@pytest.mark.django_db
+def test_checkpoint_balances_command(accounts):
+    stdout = StringIO()
+    call_command('checkpoint_balances', lag=0, stdout=stdout)
+    assert stdout.getvalue().startswith('Created 2 checkpoints')
+    assert dict(BalanceCheckpoint.objects.values_list('account__name', 'value')) == dict(bob123=88, alice456=112)
@@ -0,0 +1,44 @@
+import csv
+import json
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from payments.models import Payment
+from postings import export
+
+
+@pytest.fixture
+def payments():
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('100'))
+    return [
+        Payment.objects.create_payment(from_account_pk=bob.pk, to_account_pk=alice.pk, value=Decimal('1')),
+        Payment.objects.create_payment(from_account_pk=alice.pk, to_account_pk=bob.pk, value=Decimal('2.5')),
+    ]
+
+
+@pytest.mark.django_db
+def test_export_postings_ndjson(payments):
+    lines = ''.join(export.export(export.KIND_POSTINGS, export.FORMAT_NDJSON, chunk_size=1)).splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert [(row['payment'], row['account'], row['value']) for row in rows] == [
+        (payments[0].pk, 'bob123', '-1.0000'),
+        (payments[0].pk, 'alice456', '1.0000'),
+        (payments[1].pk, 'alice456', '-2.5000'),
+        (payments[1].pk, 'bob123', '2.5000'),
+    ]
+
+
+@pytest.mark.django_db
+def test_export_ledger_command_csv(payments):
+    stdout = StringIO()
+    call_command('export_ledger', kind=export.KIND_PAYMENTS, format=export.FORMAT_CSV, stdout=stdout)
+    rows = list(csv.reader(StringIO(stdout.getvalue())))
+    assert rows[0] == ['id', 'from_account', 'to_account', 'value', 'created']
+    assert [row[1:4] for row in rows[1:]] == [['bob123', 'alice456', '1.0000'], ['alice456', 'bob123', '2.5000']]
@@ -0,0 +1,85 @@
+from datetime import datetime
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.utils.timezone import utc
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from payments.models import Payment
+from postings import partitions
+from postings.models import Posting
+
+
+def test_month_start():
+    moment = datetime(2018, 12, 15, 10, tzinfo=utc)
+    assert partitions.month_start(moment) == datetime(2018, 12, 1, tzinfo=utc)
+    assert partitions.month_start(moment, 1) == datetime(2019, 1, 1, tzinfo=utc)
+    assert partitions.month_start(moment, -12) == datetime(2017, 12, 1, tzinfo=utc)
+
+
+@pytest.mark.django_db
+def test_partition_postings_requires_setup():
+    with pytest.raises(CommandError):
+        call_command('partition_postings', stdout=StringIO())
+
+
+@pytest.mark.django_db
+def test_partition_postings():
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('100'))
+    Payment.objects.create_payment(from_account_pk=bob.pk, to_account_pk=alice.pk, value=Decimal('10'))
+
+    call_command('partition_postings', '--setup', '--ahead=2', stdout=StringIO())
+    assert partitions.is_partitioned()
+    now = timezone.now()
+    assert partitions.partitions() == [
+        ('postings_posting_legacy', partitions.month_start(now, 1)),
+        (partitions.partition_name('postings_posting', partitions.month_start(now, 1)), partitions.month_start(now, 2)),
+        (partitions.partition_name('postings_posting', partitions.month_start(now, 2)), partitions.month_start(now, 3)),
+        ('postings_posting_default', None),
+    ]
+    # Partitions are created following the latest one only
+    call_command('partition_postings', '--ahead=2', stdout=StringIO())
+    assert len(partitions.partitions()) == 4
+
+    payment = Payment.objects.create_payment(from_account_pk=alice.pk, to_account_pk=bob.pk, value=Decimal('3'))
+    Posting.objects.filter(payment=payment).update(created=partitions.month_start(now, 1))
+    assert Posting.objects.count() == 4
+    assert Posting.objects.filter(created__gte=partitions.month_start(now, 1)).count() == 2
+    assert Account.objects.with_balance().get(pk=bob.pk).balance == Decimal('93')
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM {}'.format(partitions.partition_name(
+            'postings_posting', partitions.month_start(now, 1),
+        )))
+        assert cursor.fetchone() == (2,)
+
+    assert partitions.detach_partitions(partitions.month_start(now, 1)) == ['postings_posting_legacy']
+    assert list(Posting.objects.values_list('payment_id', flat=True).distinct()) == [payment.pk]
+
+
+@pytest.mark.django_db
+def test_create_partitions_moves_default_rows():
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('100'))
+    call_command('partition_postings', '--setup', '--ahead=1', stdout=StringIO())
+
+    # Created in a month without a partition, so it lands in the default partition
+    now = timezone.now()
+    payment = Payment.objects.create_payment(from_account_pk=bob.pk, to_account_pk=alice.pk, value=Decimal('10'))
+    Posting.objects.filter(payment=payment).update(created=partitions.month_start(now, 2))
+
+    name = partitions.partition_name('postings_posting', partitions.month_start(now, 2))
+    assert partitions.create_partitions(partitions.month_start(now, 2)) == [name]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM {}'.format(name))
+        assert cursor.fetchone() == (2,)
+        cursor.execute('SELECT count(*) FROM postings_posting_default')
+        assert cursor.fetchone() == (0,)
+    assert Posting.objects.filter(created__gte=partitions.month_start(now, 2)).count() == 2
@@ -0,0 +1,92 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command, CommandError
+from django.db.models import F
+from django.utils import timezone
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from payments.models import Payment
+from postings.models import Posting, ReconciliationMark
+
+
+@pytest.fixture
+def accounts():
+    currency = mommy.make(Currency)
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('100'))
+    carol = mommy.make(Account, name='carol789', currency=currency, value=Decimal('50'))
+    Payment.objects.create_payment(from_account_pk=bob.pk, to_account_pk=alice.pk, value=Decimal('10'))
+    return bob, alice, carol
+
+
+def reconcile():
+    return ReconciliationMark.objects.reconcile(timezone.now() + timedelta(seconds=1))
+
+
+@pytest.mark.django_db
+def test_reconcile(accounts):
+    bob, alice, carol = accounts
+    assert reconcile() == (3, 3, [], [])
+    assert dict(ReconciliationMark.objects.values_list('account__name', 'value')) == dict(
+        bob123=90, alice456=110, carol789=50,
+    )
+    assert reconcile() == (0, 0, [], [])
+
+    Payment.objects.create_payment(from_account_pk=alice.pk, to_account_pk=bob.pk, value=Decimal('3'))
+    assert reconcile() == (2, 0, [], [])
+    assert ReconciliationMark.objects.get(account=bob).value == 93
+    assert ReconciliationMark.objects.get(account=bob).last_posting_id == Posting.objects.latest('pk').pk
+
+
+@pytest.mark.django_db
+def test_reconcile_unsettled_postings(accounts):
+    bob, alice, carol = accounts
+    reconcile()
+    Payment.objects.create_payment(from_account_pk=alice.pk, to_account_pk=bob.pk, value=Decimal('3'))
+    # Postings created after `as_of` are checked but not marked
+    assert ReconciliationMark.objects.reconcile(timezone.now() - timedelta(minutes=1)) == (2, 0, [], [])
+    assert ReconciliationMark.objects.get(account=bob).value == 90
+    assert reconcile() == (2, 0, [], [])
+    assert ReconciliationMark.objects.get(account=bob).value == 93
+
+
+@pytest.mark.django_db
+def test_reconcile_drift(accounts):
+    bob, alice, carol = accounts
+    reconcile()
+    Account.objects.filter(pk=bob.pk).update(value=F('value') + 1)
+    Payment.objects.create_payment(from_account_pk=bob.pk, to_account_pk=carol.pk, value=Decimal('1'))
+    assert reconcile().drifts == [('bob123', 90, 89)]
+    # Drifted Account is checked again
+    assert reconcile().drifts == [('bob123', 90, 89)]
+
+
+@pytest.mark.django_db
+def test_reconcile_unbalanced_payment(accounts):
+    bob, alice, carol = accounts
+    reconcile()
+    payment = Payment.objects.create_payment(from_account_pk=alice.pk, to_account_pk=bob.pk, value=Decimal('3'))
+    mommy.make(Posting, payment=payment, account=carol, value=Decimal('1'))
+    Account.objects.filter(pk=carol.pk).update(value=F('value') + 1)
+    result = reconcile()
+    assert result.drifts == []
+    assert result.unbalanced_payments == [(payment.pk, 1)]
+
+
+@pytest.mark.django_db
+def test_reconcile_ledger_command(accounts):
+    bob, alice, carol = accounts
+    stdout = StringIO()
+    call_command('reconcile_ledger', lag=0, stdout=stdout)
+    assert stdout.getvalue() == 'Checked 3 accounts, 3 new.\n'
+
+    Account.objects.filter(pk=bob.pk).update(value=F('value') + 1)
+    Payment.objects.create_payment(from_account_pk=bob.pk, to_account_pk=carol.pk, value=Decimal('1'))
+    stderr = StringIO()
+    with pytest.raises(CommandError):
+        call_command('reconcile_ledger', lag=0, stdout=stdout, stderr=stderr)
+    assert 'bob123' in stderr.getvalue()
@@ -0,0 +1,33 @@
+from decimal import Decimal
+
+import pytest
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from payments.models import Payment
+from postings.models import Posting
+from postings.serializers import PostingSerializer, PostingValuesSerializer
+
+
+@pytest.fixture
+def postings():
+    currency = mommy.make(Currency)
+    accounts = mommy.make(Account, currency=currency, value=Decimal('100'), _quantity=3)
+    for from_account, to_account in zip(accounts, accounts[1:] + accounts[:1]):
+        Payment.objects.create_payment(from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=Decimal('1'))
+
+
+@pytest.mark.parametrize('serializer_class', (PostingSerializer, PostingValuesSerializer))
+@pytest.mark.django_db
+def test_posting_serializer_queries(serializer_class, postings, django_assert_num_queries):
+    queryset = serializer_class.prepare_queryset(Posting.objects.order_by('-pk'))
+    with django_assert_num_queries(1):
+        data = serializer_class(queryset, many=True).data
+    assert len(data) == 6
+
+
+@pytest.mark.django_db
+def test_posting_values_serializer(postings):
+    queryset = Posting.objects.order_by('-pk')
+    expected = PostingSerializer(PostingSerializer.prepare_queryset(queryset), many=True).data
+    assert PostingValuesSerializer(PostingValuesSerializer.prepare_queryset(queryset), many=True).data == expected
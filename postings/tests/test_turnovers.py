@@ -0,0 +1,120 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.timezone import utc
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from payments.models import Payment
+from postings import partitions
+from postings.models import AccountTurnover, CurrencyTurnover, Posting, TurnoverMark
+
+
+def pay(from_account, to_account, value, created):
+    payment = Payment.objects.create_payment(
+        from_account_pk=from_account.pk, to_account_pk=to_account.pk, value=Decimal(value),
+    )
+    Posting.objects.filter(payment=payment).update(created=created)
+
+
+@pytest.fixture
+def accounts():
+    currency = mommy.make(Currency, code='AAA')
+    bob = mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    alice = mommy.make(Account, name='alice456', currency=currency, value=Decimal('100'))
+    pay(bob, alice, '10', datetime(2018, 12, 1, 10, tzinfo=utc))
+    pay(alice, bob, '3', datetime(2018, 12, 1, 20, tzinfo=utc))
+    pay(bob, alice, '5', datetime(2018, 12, 2, 10, tzinfo=utc))
+    return bob, alice
+
+
+def account_turnovers():
+    return {
+        (account, day): (debit, credit, postings) for account, day, debit, credit, postings in
+        AccountTurnover.objects.values_list('account__name', 'day', 'debit', 'credit', 'postings')
+    }
+
+
+def currency_turnovers():
+    return {
+        (currency, day): (debit, credit, postings) for currency, day, debit, credit, postings in
+        CurrencyTurnover.objects.values_list('currency__code', 'day', 'debit', 'credit', 'postings')
+    }
+
+
+@pytest.mark.django_db
+def test_roll_up(accounts):
+    assert TurnoverMark.objects.roll_up(datetime(2018, 12, 2, tzinfo=utc)) == 4
+    assert account_turnovers() == {
+        ('bob123', date(2018, 12, 1)): (10, 3, 2),
+        ('alice456', date(2018, 12, 1)): (3, 10, 2),
+    }
+    assert currency_turnovers() == {('AAA', date(2018, 12, 1)): (13, 13, 4)}
+    assert TurnoverMark.objects.roll_up(datetime(2018, 12, 2, tzinfo=utc)) == 0
+
+    assert TurnoverMark.objects.roll_up(datetime(2018, 12, 3, tzinfo=utc)) == 2
+    assert account_turnovers()[('bob123', date(2018, 12, 2))] == (5, 0, 1)
+    assert currency_turnovers() == {('AAA', date(2018, 12, 1)): (13, 13, 4), ('AAA', date(2018, 12, 2)): (5, 5, 2)}
+    mark = TurnoverMark.objects.get()
+    assert mark.last_posting_id == Posting.objects.latest('pk').pk
+    assert mark.as_of == datetime(2018, 12, 3, tzinfo=utc)
+
+
+@pytest.mark.django_db
+def test_roll_up_adds_to_existing_days(accounts):
+    bob, alice = accounts
+    TurnoverMark.objects.roll_up(datetime(2018, 12, 3, tzinfo=utc))
+    pay(alice, bob, '1', datetime(2018, 12, 2, 12, tzinfo=utc))
+    assert TurnoverMark.objects.roll_up(datetime(2018, 12, 3, tzinfo=utc)) == 2
+    assert account_turnovers()[('bob123', date(2018, 12, 2))] == (5, 1, 2)
+    assert currency_turnovers()[('AAA', date(2018, 12, 2))] == (6, 6, 4)
+
+
+@pytest.mark.django_db
+def test_roll_up_batches(accounts):
+    assert TurnoverMark.objects.roll_up(datetime(2018, 12, 3, tzinfo=utc), batch_size=4) == 4
+    assert TurnoverMark.objects.get().as_of is None
+    assert TurnoverMark.objects.roll_up(datetime(2018, 12, 3, tzinfo=utc), batch_size=4) == 2
+    assert TurnoverMark.objects.get().as_of == datetime(2018, 12, 3, tzinfo=utc)
+    assert currency_turnovers() == {('AAA', date(2018, 12, 1)): (13, 13, 4), ('AAA', date(2018, 12, 2)): (5, 5, 2)}
+
+
+@pytest.mark.django_db
+def test_roll_up_turnovers_command(accounts):
+    out = StringIO()
+    call_command('roll_up_turnovers', '--batch-size', '3', stdout=out)
+    assert out.getvalue().startswith('Rolled up 6 postings as of ')
+    assert len(account_turnovers()) == 4
+
+
+@pytest.mark.django_db
+def test_rebuild_turnovers_command(accounts):
+    TurnoverMark.objects.roll_up(datetime(2018, 12, 3, tzinfo=utc))
+    CurrencyTurnover.objects.update(debit=0)
+    AccountTurnover.objects.filter(day=date(2018, 12, 2)).delete()
+
+    out = StringIO()
+    call_command('rebuild_turnovers', stdout=out)
+    assert out.getvalue().startswith('Rebuilt turnovers of 6 postings as of ')
+    assert currency_turnovers() == {('AAA', date(2018, 12, 1)): (13, 13, 4), ('AAA', date(2018, 12, 2)): (5, 5, 2)}
+    assert len(account_turnovers()) == 4
+
+
+@pytest.mark.django_db
+def test_rebuild_keeps_detached_days(accounts):
+    bob, alice = accounts
+    call_command('partition_postings', '--setup', '--ahead=1', stdout=StringIO())
+    boundary = partitions.month_start(timezone.now(), 1)
+    pay(bob, alice, '1', boundary + timedelta(hours=1))
+    as_of = boundary + timedelta(days=1)
+    TurnoverMark.objects.roll_up(as_of)
+    expected = currency_turnovers()
+
+    partitions.detach_partitions(boundary)
+    assert TurnoverMark.objects.rebuild(as_of) == 2
+    assert currency_turnovers() == expected
+    assert account_turnovers()[('bob123', boundary.date())] == (1, 0, 1)
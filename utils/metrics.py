@@ -0,0 +1,191 @@
+"""
+Per-request instrumentation
+
+With `settings.REQUEST_METRICS` enabled :class:`utils.middleware.RequestMetricsMiddleware` records for each request:
+
+ - `queries`: number of SQL queries.
+ - `db`: seconds spent in SQL queries.
+ - `lock`: seconds spent in `SELECT ... FOR [NO KEY] UPDATE` queries, i.e. mostly waiting for row locks.
+ - `serialize`: seconds spent in representation by serializers using :class:`utils.serializers.TimedSerializerMixin`
+   and in rendering, excluding queries made meanwhile.
+
+They are sent in `Server-Timing` response header and observed by :data:`registry` histograms,
+which are exposed in Prometheus text format by :func:`utils.views.metrics`. Histograms are kept in each process.
+With metrics disabled the middleware is not loaded, and :func:`current` returns `None` to instrumented code.
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+LOCKING_QUERY = re.compile(r' FOR (NO KEY )?UPDATE\b')
+
+# Upper bounds of histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+_state = threading.local()
+
+
+class RequestMetrics:
+    """
+    Metrics of a single request
+
+    Attributes
+
+     - queries (int): Number of SQL queries.
+     - db (float): Seconds spent in SQL queries.
+     - lock (float): Seconds spent in locking SQL queries.
+     - serialize (float): Seconds spent in serialization, excluding SQL queries.
+
+    """
+
+    __slots__ = ('queries', 'db', 'lock', 'serialize', 'timing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = self.lock = self.serialize = 0.0
+        self.timing = False
+
+    def execute(self, execute, sql, params, many, context):
+        """Database execute wrapper, see `Database instrumentation` in Django docs."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db += elapsed
+            if LOCKING_QUERY.search(sql):
+                self.lock += elapsed
+
+    @contextmanager
+    def timer(self, name: str):
+        """Add seconds spent in the block except SQL queries to `name` metric, nested blocks are not counted twice."""
+        if self.timing:
+            yield
+            return
+        self.timing = True
+        started, db = time.perf_counter(), self.db
+        try:
+            yield
+        finally:
+            setattr(self, name, getattr(self, name) + time.perf_counter() - started - (self.db - db))
+            self.timing = False
+
+
+def current() -> Optional[RequestMetrics]:
+    """Return metrics of the request being handled by this thread, `None` if metrics are not recorded."""
+    return getattr(_state, 'metrics', None)
+
+
+@contextmanager
+def recording() -> Iterator[RequestMetrics]:
+    """Record metrics of this thread in the block."""
+    _state.metrics = RequestMetrics()
+    try:
+        yield _state.metrics
+    finally:
+        _state.metrics = None
+
+
+class Histogram:
+    """Cumulative histogram of observed values by label values, in Prometheus sense."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # Label values -> (counts by bucket, with the last one for +Inf, sum)
+        self._series = {}  # type: Dict[Tuple[str, ...], Tuple[list, float]]
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            counts, total = self._series.get(label_values) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._series[label_values] = counts, total + value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> Iterator[str]:
+        yield '# HELP {} {}'.format(self.name, self.help)
+        yield '# TYPE {} histogram'.format(self.name)
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for label_values, counts, total in series:
+            labels = ','.join('{}="{}"'.format(name, escape(value)) for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '{}_bucket{{{}{}le="{}"}} {}'.format(self.name, labels, ',' if labels else '', bound, cumulative)
+            yield '{}_sum{{{}}} {}'.format(self.name, labels, total)
+            yield '{}_count{{{}}} {}'.format(self.name, labels, cumulative)
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    """Histograms of request metrics."""
+
+    labels = ('method', 'view')
+
+    def __init__(self):
+        self.histograms = {
+            'duration': Histogram('http_request_duration_seconds', 'Request duration.', self.labels, SECONDS_BUCKETS),
+            'queries': Histogram('http_request_queries', 'SQL queries per request.', self.labels, QUERIES_BUCKETS),
+            'db': Histogram('http_request_db_seconds', 'Time in SQL queries.', self.labels, SECONDS_BUCKETS),
+            'lock': Histogram('http_request_lock_wait_seconds', 'Time in SELECT FOR UPDATE queries.',
+                              self.labels, SECONDS_BUCKETS),
+            'serialize': Histogram('http_request_serialize_seconds', 'Time in serialization.',
+                                   self.labels, SECONDS_BUCKETS),
+        }
+
+    def observe(self, metrics: RequestMetrics, duration: float, method: str, view: str):
+        values = dict(duration=duration, queries=metrics.queries, db=metrics.db, lock=metrics.lock,
+                      serialize=metrics.serialize)
+        for name, histogram in self.histograms.items():
+            histogram.observe(values[name], method, view)
+
+    def clear(self):
+        for histogram in self.histograms.values():
+            histogram.clear()
+
+    def render(self) -> str:
+        from utils.transactions import retry_counters
+
+        lines = [line for histogram in self.histograms.values() for line in histogram.render()]
+        counters = retry_counters.as_dict()
+        lines += [
+            '# HELP transaction_retries_total Transactions run again after a deadlock or a serialization failure.',
+            '# TYPE transaction_retries_total counter',
+            'transaction_retries_total {}'.format(counters.pop('retries')),
+            '# HELP transaction_gave_up_total Transactions failed after the last attempt.',
+            '# TYPE transaction_gave_up_total counter',
+            'transaction_gave_up_total {}'.format(counters.pop('gave_up')),
+            '# HELP transaction_conflicts_total Deadlocks and serialization failures.',
+            '# TYPE transaction_conflicts_total counter',
+        ]
+        lines += ['transaction_conflicts_total{{error="{}"}} {}'.format(*item) for item in sorted(counters.items())]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def server_timing(metrics: RequestMetrics, duration: float) -> str:
+    """Return `Server-Timing` header value, durations are in milliseconds."""
+    return ', '.join([
+        'db;desc="{} queries";dur={:.3f}'.format(metrics.queries, metrics.db * 1000),
+        'lock;dur={:.3f}'.format(metrics.lock * 1000),
+        'serialize;dur={:.3f}'.format(metrics.serialize * 1000),
+        'total;dur={:.3f}'.format(duration * 1000),
+    ])
@@ -0,0 +1,57 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from utils import metrics
+from utils.routers import pin
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReadAfterWriteMiddleware:
+    """
+    Pin clients to the primary database for a while after a successful write request
+
+    So a client reads its own writes even if read replicas lag behind, see :class:`utils.views.ReplicaReadMixin`.
+    Pinning is disabled by `settings.DATABASE_REPLICA_PIN_SECONDS = 0`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400 \
+                and settings.DATABASE_REPLICA_PIN_SECONDS:
+            pin(response)
+        return response
+
+
+class RequestMetricsMiddleware:
+    """
+    Record queries and timings of each request, see :mod:`utils.metrics`
+
+    Should be the first middleware, so the whole request is measured. Not loaded at all unless
+    `settings.REQUEST_METRICS` is enabled.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with metrics.recording() as request_metrics, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(request_metrics.execute))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        metrics.registry.observe(request_metrics, duration, request.method, match.view_name if match else '')
+        response['Server-Timing'] = metrics.server_timing(request_metrics, duration)
+        return response
@@ -5,6 +5,8 @@ from django.db import models
 from model_mommy import mommy
 from model_mommy.generators import default_mapping
 
+from utils.money import Money
+
 
 class DefaultCharField(models.CharField):
     """
@@ -20,12 +22,23 @@ class DefaultCharField(models.CharField):
 
 
 class AmountField(models.DecimalField):
+    """
+    Decimal amount field, :class:`utils.money.Money` values are accepted as well
+
+    Database values are returned as `Decimal` from C `decimal` module.
+    """
+
     def __init__(self,  *args, **kwargs):
         kwargs.setdefault('max_digits', settings.AMOUNT_MAX_DIGITS)
         kwargs.setdefault('decimal_places', settings.AMOUNT_DECIMAL_PLACES)
         kwargs.setdefault('default', Decimal(0))
         super().__init__(*args, **kwargs)
 
+    def to_python(self, value):
+        if isinstance(value, Money):
+            return value.to_decimal()
+        return super().to_python(value)
+
 
 mommy.generators.add(DefaultCharField, default_mapping[models.CharField])
 mommy.generators.add(AmountField, default_mapping[models.DecimalField])
@@ -0,0 +1,155 @@
+from decimal import Decimal
+from numbers import Number
+from typing import Union
+
+from django.conf import settings
+
+
+class Money(int):
+    """
+    Amount stored as an integer number of minor units
+
+    Scale is defined by `settings.AMOUNT_DECIMAL_PLACES`, e.g. with 4 decimal places `Money(12345)` means `1.2345`.
+    Arithmetic and comparisons are plain integer operations, so Money can only be combined with another Money
+    or `int` minor units. Any other number (e.g. `Decimal` or `float`) raises `TypeError` instead of silently
+    treating minor units as major ones. Division returns Money too, `/` raises `ValueError` if the result
+    is not a whole number of minor units, `//` rounds down. Note that `Decimal` or `float` as the left operand
+    still treats Money as `int`, so convert explicitly with :meth:`to_decimal` or :meth:`from_decimal`.
+
+    :Example:
+
+    >>> from decimal import Decimal
+    >>> from utils.money import Money
+    >>> str(Money.from_decimal(Decimal('1.5')) - Money(1))
+    '1.4999'
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def scale(cls) -> int:
+        return 10 ** settings.AMOUNT_DECIMAL_PLACES
+
+    @classmethod
+    def from_decimal(cls, value: Union[Decimal, int, str]) -> 'Money':
+        """
+        Convert amount in major units to Money
+
+        :raises ValueError: if `value` has more decimal places than `settings.AMOUNT_DECIMAL_PLACES`.
+        """
+        if isinstance(value, Money):
+            return value
+        scaled = Decimal(value).scaleb(settings.AMOUNT_DECIMAL_PLACES)
+        if scaled != scaled.to_integral_value():
+            raise ValueError('Amount {} has more than {} decimal places'.format(value, settings.AMOUNT_DECIMAL_PLACES))
+        return cls(scaled)
+
+    def to_decimal(self) -> Decimal:
+        return Decimal(int(self)).scaleb(-settings.AMOUNT_DECIMAL_PLACES)
+
+    def __str__(self):
+        places = settings.AMOUNT_DECIMAL_PLACES
+        whole, fraction = divmod(abs(int(self)), self.scale())
+        sign = '-' if self < 0 else ''
+        if not places:
+            return '{}{}'.format(sign, whole)
+        return '{}{}.{:0{}d}'.format(sign, whole, fraction, places)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, str(self))
+
+    @staticmethod
+    def _is_compatible(other) -> bool:
+        """Return True for Money or `int`, raise `TypeError` for other numbers."""
+        if isinstance(other, int):
+            return True
+        if isinstance(other, Number):
+            raise TypeError('Money can only be combined with Money or int minor units, got {}'.format(
+                type(other).__name__
+            ))
+        return False
+
+    def __add__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return Money(int(self) + int(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return Money(int(self) - int(other))
+
+    def __rsub__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return Money(int(other) - int(self))
+
+    def __mul__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return Money(int(self) * int(other))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        quotient, remainder = divmod(int(self), int(other))
+        if remainder:
+            raise ValueError('{!r} is not divisible by {} into whole minor units'.format(self, int(other)))
+        return Money(quotient)
+
+    def __floordiv__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return Money(int(self) // int(other))
+
+    def __neg__(self):
+        return Money(-int(self))
+
+    def __abs__(self):
+        return Money(abs(int(self)))
+
+    def __eq__(self, other):
+        # Equality never raises, and other numbers are not equal even if they are equal to minor units,
+        # so `NotImplemented` is not returned to let them compare themselves with int
+        if isinstance(other, int):
+            return int(self) == int(other)
+        if isinstance(other, Number):
+            return False
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __lt__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return int(self) < int(other)
+
+    def __le__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return int(self) <= int(other)
+
+    def __gt__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return int(self) > int(other)
+
+    def __ge__(self, other):
+        if not self._is_compatible(other):
+            return NotImplemented
+        return int(self) >= int(other)
+
+    __hash__ = int.__hash__
+
+
+def to_decimal(value: Union[Decimal, Money]) -> Decimal:
+    """Return `value` as `Decimal` in major units, `Decimal` values are returned as is."""
+    if isinstance(value, Money):
+        return value.to_decimal()
+    return value
@@ -0,0 +1,41 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset pagination by primary key with an opaque cursor
+
+    Each page is an index range scan whatever the page depth, and no total count is calculated.
+    Clients sending legacy `limit` or `offset` query parameters are paginated by :class:`LimitOffsetPagination`
+    (with total count) for backward compatibility.
+    """
+
+    ordering = '-pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    legacy_pagination_class = LimitOffsetPagination
+
+    def __init__(self):
+        self.legacy_paginator = None
+
+    def is_legacy_request(self, request):
+        legacy = self.legacy_pagination_class
+        return legacy.limit_query_param in request.query_params or legacy.offset_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_legacy_request(request):
+            self.legacy_paginator = self.legacy_pagination_class()
+            page = self.legacy_paginator.paginate_queryset(queryset, request, view)
+            self.display_page_controls = self.legacy_paginator.display_page_controls
+            return page
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.legacy_paginator is not None:
+            return self.legacy_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.legacy_paginator is not None:
+            return self.legacy_paginator.to_html()
+        return super().to_html()
@@ -0,0 +1,14 @@
+from rest_framework import renderers
+
+from utils.metrics import current
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """Record rendering time as `serialize` request metric, see :mod:`utils.metrics`."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        metrics = current()
+        if metrics is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        with metrics.timer('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
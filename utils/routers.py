@@ -0,0 +1,79 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_state = threading.local()
+
+# Cookie holding time until which a client reads from the primary database
+PIN_COOKIE = 'primary_pinned_until'
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Route reads to a read replica within the block, see :class:`ReplicaRouter`
+
+    A single replica is chosen for the whole block, so all its queries see the same replication lag.
+    Nothing changes if there are no replicas in `settings.DATABASE_REPLICAS`.
+    """
+    previous = getattr(_state, 'alias', None)
+    _state.alias = random.choice(settings.DATABASE_REPLICAS) if settings.DATABASE_REPLICAS else None
+    try:
+        yield _state.alias
+    finally:
+        _state.alias = previous
+
+
+@contextmanager
+def read_from_primary():
+    """Route reads to the primary database within the block, even inside of a :func:`read_from_replica` block."""
+    previous = getattr(_state, 'alias', None)
+    _state.alias = None
+    try:
+        yield
+    finally:
+        _state.alias = previous
+
+
+def is_pinned(request) -> bool:
+    """Return True if the client has written recently and must read from the primary database."""
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin(response):
+    """Make the client read from the primary database for `settings.DATABASE_REPLICA_PIN_SECONDS`."""
+    seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+    response.set_cookie(PIN_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True)
+
+
+class ReplicaRouter:
+    """
+    Database router sending reads within :func:`read_from_replica` blocks to read replicas
+
+    All other queries, including reads of write transactions, go to the primary `default` database, so only
+    explicitly chosen read-only code paths see replication lag. Migrations are applied to the primary only,
+    replicas receive the schema by replication.
+    """
+
+    @staticmethod
+    def db_for_read(model, **hints):
+        return getattr(_state, 'alias', None)
+
+    @staticmethod
+    def db_for_write(model, **hints):
+        return 'default'
+
+    @staticmethod
+    def allow_relation(obj1, obj2, **hints):
+        # Replicas hold the same data as the primary database
+        return True
+
+    @staticmethod
+    def allow_migrate(db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
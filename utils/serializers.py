@@ -1,9 +1,33 @@
 from django.conf import settings
 from rest_framework import serializers
 
+from utils.metrics import current
+from utils.money import Money
+
 
 class AmountField(serializers.DecimalField):
     def __init__(self,  *args, **kwargs):
         kwargs.setdefault('max_digits', settings.AMOUNT_MAX_DIGITS)
         kwargs.setdefault('decimal_places', settings.AMOUNT_DECIMAL_PLACES)
         super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, Money):
+            data = data.to_decimal()
+        return super().to_internal_value(data)
+
+    def to_representation(self, value):
+        if isinstance(value, Money):
+            value = value.to_decimal()
+        return super().to_representation(value)
+
+
+class TimedSerializerMixin:
+    """Record representation time as `serialize` request metric, see :mod:`utils.metrics`."""
+
+    def to_representation(self, instance):
+        metrics = current()
+        if metrics is None:
+            return super().to_representation(instance)
+        with metrics.timer('serialize'):
+            return super().to_representation(instance)
@@ -0,0 +1,36 @@
+from unittest import mock
+
+from utils.cache import LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert len(cache) == 2
+
+
+def test_lru_cache_ttl():
+    cache = LRUCache(maxsize=2, ttl=10)
+    with mock.patch('utils.cache.time.monotonic', return_value=100):
+        cache.set('a', 1)
+    with mock.patch('utils.cache.time.monotonic', return_value=105):
+        assert cache.get('a') == 1
+    with mock.patch('utils.cache.time.monotonic', return_value=111):
+        assert cache.get('a', 'expired') == 'expired'
+    assert len(cache) == 0
+
+
+def test_lru_cache_delete_and_clear():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.delete('a')
+    cache.delete('missing')
+    assert cache.get('a') is None
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,76 @@
+import re
+from decimal import Decimal
+
+from django.test import override_settings
+from model_mommy import mommy
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from accounts.models import Account, Currency
+from utils import metrics
+
+
+def test_timer_excludes_queries():
+    request_metrics = metrics.RequestMetrics()
+    with request_metrics.timer('serialize'):
+        with request_metrics.timer('serialize'):
+            request_metrics.execute(lambda *args: None, 'SELECT 1 FOR NO KEY UPDATE', None, False, {})
+    assert request_metrics.queries == 1
+    assert 0 < request_metrics.lock == request_metrics.db
+    assert request_metrics.serialize < request_metrics.db + 0.01
+
+
+def test_histogram():
+    histogram = metrics.Histogram('size', 'Size.', ['view'], [1, 5])
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value, 'a"b')
+    assert list(histogram.render()) == [
+        '# HELP size Size.',
+        '# TYPE size histogram',
+        'size_bucket{view="a\\"b",le="1"} 2',
+        'size_bucket{view="a\\"b",le="5"} 3',
+        'size_bucket{view="a\\"b",le="+Inf"} 4',
+        'size_sum{view="a\\"b"} 14.5',
+        'size_count{view="a\\"b"} 4',
+    ]
+
+
+class RequestMetricsTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        currency = mommy.make(Currency, code='AAA')
+        mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+        mommy.make(Account, name='alice456', currency=currency, value=Decimal('0'))
+
+    def setUp(self):
+        metrics.registry.clear()
+
+    @override_settings(REQUEST_METRICS=True)
+    def test_metrics(self):
+        response = self.client.post(reverse('payments_v1:payments-list'), data=dict(
+            from_account='bob123', to_account='alice456', value=Decimal('10'),
+        ))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        timing = dict(re.findall(r'(\w+);(?:desc="[^"]*";)?dur=([\d.]+)', response['Server-Timing']))
+        self.assertEqual(sorted(timing), ['db', 'lock', 'serialize', 'total'])
+        self.assertGreater(float(timing['lock']), 0)
+        self.assertLessEqual(float(timing['lock']), float(timing['db']))
+        self.assertLessEqual(float(timing['db']), float(timing['total']))
+        queries = int(re.search(r'db;desc="(\d+) queries"', response['Server-Timing']).group(1))
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode()
+        self.assertIn('http_request_queries_sum{{method="POST",view="payments_v1:payments-list"}} {}'.format(
+            queries), content)
+        self.assertIn('http_request_duration_seconds_count{method="POST",view="payments_v1:payments-list"} 1', content)
+        self.assertRegex(content, r'transaction_retries_total \d+')
+
+    def test_metrics_disabled(self):
+        response = self.client.get(reverse('accounts_v1:accounts-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(metrics.current())
@@ -0,0 +1,67 @@
+from decimal import Decimal
+
+import pytest
+from django.test import override_settings
+
+from utils.money import Money, to_decimal
+
+
+@pytest.mark.parametrize('value,minor,text', (
+    (Decimal('1.2345'), 12345, '1.2345'),
+    ('100', 1000000, '100.0000'),
+    (Decimal('-0.01'), -100, '-0.0100'),
+    (0, 0, '0.0000'),
+))
+def test_money_from_decimal(value, minor, text):
+    money = Money.from_decimal(value)
+    assert money == minor
+    assert str(money) == text
+    assert money.to_decimal() == Decimal(value)
+
+
+def test_money_from_decimal_invalid():
+    with pytest.raises(ValueError):
+        Money.from_decimal(Decimal('0.00001'))
+
+
+@override_settings(AMOUNT_DECIMAL_PLACES=0)
+def test_money_no_decimal_places():
+    assert str(Money.from_decimal(12)) == '12'
+
+
+def test_money_arithmetic():
+    a, b = Money(150), Money(50)
+    assert isinstance(a - b, Money)
+    assert a - b == Money(100)
+    assert a + b == 200
+    assert -a == Money(-150)
+    assert abs(-a) == a
+    assert b < a
+    assert isinstance(a * 2, Money) and a * 2 == Money(300)
+    assert isinstance(2 * a, Money) and 2 * a == Money(300)
+    assert isinstance(a / 3, Money) and a / 3 == Money(50)
+    assert isinstance(a // 4, Money) and a // 4 == Money(37)
+    with pytest.raises(ValueError):
+        a / 4
+
+
+@pytest.mark.parametrize('other', (Decimal('1'), 1.0))
+def test_money_incompatible(other):
+    with pytest.raises(TypeError):
+        Money(1) + other
+    with pytest.raises(TypeError):
+        Money(1) < other
+    with pytest.raises(TypeError):
+        Money(1) * other
+    with pytest.raises(TypeError):
+        Money(1) / other
+    with pytest.raises(TypeError):
+        Money(1) // other
+    assert not Money(1) == other
+    assert Money(1) != other
+    assert not Money(10000) == Decimal('10000')
+
+
+def test_to_decimal():
+    assert to_decimal(Money(1)) == Decimal('0.0001')
+    assert to_decimal(Decimal('1')) == Decimal('1')
@@ -0,0 +1,79 @@
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from django.conf import settings
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from model_mommy import mommy
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from accounts.models import Account, Currency
+from utils import routers
+from utils.routers import ReplicaRouter, read_from_replica
+
+
+def test_replica_router(settings):
+    settings.DATABASE_REPLICAS = ['replica_0']
+    router = ReplicaRouter()
+    assert router.db_for_read(Account) is None
+    with read_from_replica() as alias:
+        assert alias == 'replica_0'
+        assert router.db_for_read(Account) == 'replica_0'
+        assert router.db_for_write(Account) == 'default'
+    assert router.db_for_read(Account) is None
+    assert not router.allow_migrate('replica_0', 'accounts')
+    assert router.allow_migrate('default', 'accounts')
+
+
+def test_read_from_replica_without_replicas():
+    with read_from_replica() as alias:
+        assert alias is None
+        assert ReplicaRouter().db_for_read(Account) is None
+
+
+@pytest.mark.django_db
+def test_read_after_write(settings):
+    settings.DATABASE_REPLICAS = ['replica_0']
+    currency = mommy.make(Currency)
+    mommy.make(Account, name='bob123', currency=currency, value=Decimal('100'))
+    mommy.make(Account, name='alice456', currency=currency, value=Decimal('0'))
+    client = APIClient()
+    aliases = []
+
+    def db_for_read(model, **hints):
+        aliases.append(routers._state.alias)  # pylint: disable=protected-access
+
+    # Queries still go to the `default` database, since there is no `replica_0` database
+    with mock.patch.object(ReplicaRouter, 'db_for_read', side_effect=db_for_read):
+        client.get(reverse('accounts_v1:accounts-list'))
+        assert set(aliases) == {'replica_0'}
+
+        response = client.post(
+            reverse('payments_v1:payments-list'), data=dict(from_account='bob123', to_account='alice456', value='1'),
+        )
+        assert routers.PIN_COOKIE in response.cookies
+
+        aliases.clear()
+        client.get(reverse('accounts_v1:accounts-list'))
+        assert set(aliases) == {None}
+
+        settings.DATABASE_REPLICA_PIN_SECONDS = 0
+        client.cookies.clear()
+        response = client.post(
+            reverse('payments_v1:payments-list'), data=dict(from_account='bob123', to_account='alice456', value='1'),
+        )
+        assert routers.PIN_COOKIE not in response.cookies
+
+
+@pytest.mark.replica
+@pytest.mark.skipif(not settings.DATABASE_REPLICAS, reason='DATABASE_REPLICA_URLS is not configured')
+@pytest.mark.django_db(transaction=True, databases='__all__')
+def test_list_from_replica():
+    mommy.make(Account, name='bob123', value=Decimal('100'))
+    alias = settings.DATABASE_REPLICAS[0]
+    with CaptureQueriesContext(connections[alias]) as queries:
+        response = APIClient().get(reverse('accounts_v1:accounts-list'))
+    assert [account['id'] for account in response.data['results']] == ['bob123']
+    assert queries.captured_queries
@@ -0,0 +1,95 @@
+import threading
+from decimal import Decimal
+
+import pytest
+from django.db import OperationalError, connection, transaction
+from model_mommy import mommy
+
+from accounts.models import Account, Currency
+from utils.transactions import retry_counters, retry_on_conflict
+
+
+class DatabaseError(Exception):
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+def failing(*pgcodes):
+    """Return a function raising errors with `pgcodes` by consecutive calls, and returning the number of calls."""
+    calls = []
+
+    @retry_on_conflict
+    def func():
+        calls.append(None)
+        if len(calls) <= len(pgcodes):
+            raise OperationalError() from DatabaseError(pgcodes[len(calls) - 1])
+        return len(calls)
+    return func
+
+
+@pytest.fixture(autouse=True)
+def retry_settings(settings):
+    settings.TRANSACTION_RETRY_ATTEMPTS = 3
+    settings.TRANSACTION_RETRY_BASE_DELAY = 0
+    retry_counters.clear()
+
+
+def test_retry_on_conflict():
+    assert failing('40P01', '40001')() == 3
+    assert retry_counters.as_dict() == dict(retries=2, gave_up=0, deadlock=1, serialization_failure=1)
+
+
+def test_retry_on_conflict_gives_up():
+    with pytest.raises(OperationalError):
+        failing('40P01', '40P01', '40P01')()
+    assert retry_counters.as_dict() == dict(retries=2, gave_up=1, deadlock=3, serialization_failure=0)
+
+
+def test_retry_on_conflict_other_error():
+    with pytest.raises(OperationalError):
+        failing('57014')()
+    assert retry_counters.as_dict() == dict(retries=0, gave_up=0, deadlock=0, serialization_failure=0)
+
+
+@pytest.mark.django_db
+def test_retry_on_conflict_in_transaction():
+    with pytest.raises(OperationalError):
+        failing('40P01')()
+    assert retry_counters.as_dict()['retries'] == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_retry_deadlock():
+    """Transactions locking rows in opposite order deadlock, the aborted one is run again."""
+    currency = mommy.make(Currency)
+    accounts = mommy.make(Account, currency=currency, value=Decimal('1'), _quantity=2)
+    locked = threading.Barrier(2, timeout=10)
+
+    @retry_on_conflict
+    @transaction.atomic
+    def lock_both(first, second, attempts):
+        attempts.append(None)
+        Account.objects.select_for_update().get(pk=first.pk)
+        if len(attempts) == 1:
+            locked.wait()
+        Account.objects.select_for_update().get(pk=second.pk)
+
+    def lock(first, second, attempts):
+        try:
+            lock_both(first, second, attempts)
+        finally:
+            connection.close()
+
+    attempts = [], []
+    threads = [
+        threading.Thread(target=lock, args=(accounts[0], accounts[1], attempts[0])),
+        threading.Thread(target=lock, args=(accounts[1], accounts[0], attempts[1])),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(len(thread_attempts) for thread_attempts in attempts) == [1, 2]
+    assert retry_counters.as_dict() == dict(retries=1, gave_up=0, deadlock=1, serialization_failure=0)
@@ -0,0 +1,98 @@
+"""
+Retries of transactions failed by deadlocks and serialization failures
+
+PostgreSQL aborts one of the transactions in a deadlock, or a transaction conflicting with a concurrent one
+at `REPEATABLE READ` or `SERIALIZABLE` isolation. Such transactions are safe to run again from the start,
+so :func:`retry_on_conflict` reruns them with jittered exponential backoff instead of failing the request.
+Retried and given up transactions are counted by :data:`retry_counters`.
+"""
+
+import random
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+# SQLSTATE of retryable errors -> counter name
+RETRYABLE_ERRORS = {
+    '40001': 'serialization_failure',
+    '40P01': 'deadlock',
+}
+
+
+class RetryCounters:
+    """
+    Process-wide counters of :func:`retry_on_conflict`
+
+    Attributes
+
+     - retries (int): Transactions run again.
+     - gave_up (int): Transactions failed after the last attempt.
+     - `serialization_failure`, `deadlock` (int): Retryable errors, whether retried or not.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = Counter()
+
+    def increment(self, *names: str):
+        with self._lock:
+            self._counter.update(names)
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {name: self._counter[name] for name in ('retries', 'gave_up', *RETRYABLE_ERRORS.values())}
+
+    def clear(self):
+        with self._lock:
+            self._counter.clear()
+
+
+retry_counters = RetryCounters()
+
+
+def retryable_error(exc: OperationalError) -> Optional[str]:
+    """Return counter name of a retryable error, `None` if `exc` must not be retried."""
+    return RETRYABLE_ERRORS.get(getattr(exc.__cause__, 'pgcode', None))
+
+
+def backoff(attempt: int) -> float:
+    """Return seconds to wait before `attempt` (from 1), random up to exponentially growing limit."""
+    limit = min(settings.TRANSACTION_RETRY_MAX_DELAY, settings.TRANSACTION_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return random.uniform(0, limit)
+
+
+def retry_on_conflict(func=None, using: str = DEFAULT_DB_ALIAS):
+    """
+    Decorator running `func` again if it fails by a deadlock or a serialization failure
+
+    Decorate a function running a whole transaction, i.e. put it above `@transaction.atomic`. Inside of
+    an outer transaction the error is raised as is, as the outer transaction is aborted and cannot be retried.
+    `func` runs at most `settings.TRANSACTION_RETRY_ATTEMPTS` times.
+    """
+    if func is None:
+        return lambda func: retry_on_conflict(func, using=using)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                error = retryable_error(exc)
+                if error is None or connections[using].in_atomic_block:
+                    raise
+                if attempt >= settings.TRANSACTION_RETRY_ATTEMPTS:
+                    retry_counters.increment(error, 'gave_up')
+                    raise
+                retry_counters.increment(error, 'retries')
+            time.sleep(backoff(attempt))
+            attempt += 1
+
+    return wrapper
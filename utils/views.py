@@ -1,10 +1,15 @@
 from urllib.parse import urlencode
 
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.utils.translation import gettext as _
 from rest_framework import status
 from rest_framework.exceptions import APIException
 from rest_framework.reverse import reverse
 
+from utils.metrics import registry
+from utils.routers import is_pinned, read_from_replica
+
 
 class NotImplementedAPI(APIException):
     status_code = status.HTTP_501_NOT_IMPLEMENTED
@@ -12,6 +17,29 @@ class NotImplementedAPI(APIException):
     default_code = 'not_implemented'
 
 
+class ReplicaReadMixin:
+    """
+    Run `replica_actions` of a ViewSet against a read replica
+
+    Clients pinned by :class:`utils.middleware.ReadAfterWriteMiddleware` read from the primary database.
+    """
+
+    replica_actions = ('list',)
+
+    def initial(self, request, *args, **kwargs):
+        self._replica = None
+        if self.action in self.replica_actions and not is_pinned(request):
+            self._replica = read_from_replica()
+            self._replica.__enter__()
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, '_replica', None) is not None:
+            self._replica.__exit__(None, None, None)
+            self._replica = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
 def reverse_querystring(view, urlconf=None, args=None, kwargs=None, current_app=None, query_kwargs=None):
     """
     Custom reverse to handle query strings.
@@ -22,3 +50,10 @@ def reverse_querystring(view, urlconf=None, args=None, kwargs=None, current_app=
     if query_kwargs:
         return '{}?{}'.format(base_url, urlencode(query_kwargs))
     return base_url
+
+
+def metrics(request):
+    """Request metrics in Prometheus text format, see :mod:`utils.metrics`."""
+    if not settings.REQUEST_METRICS:
+        raise Http404()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')